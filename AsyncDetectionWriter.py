@@ -0,0 +1,133 @@
+import asyncio
+import datetime
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class AsyncDetectionWriter(threading.Thread):
+    """
+    Run the asyncio ingestion event loop and buffer the humidity detections on it.
+    Same interface and batching rules of DetectionWriter, but the batches are written by a small thread pool,
+    the only place where the synchronous DB driver blocks, while the loop keeps receiving messages.
+    """
+
+    def __init__(self, log: logging, db, batch_size: int = 100, max_latency: float = 1.0, on_flush=None, writers: int = 2):
+        super().__init__(daemon=True, name="asyncio-ingestion")
+        self.logging = log
+        self.db = db
+        self.batch_size = max(1, batch_size)
+        self.max_latency = max_latency
+        # Called after each batch is written
+        self.on_flush = on_flush
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, writers), thread_name_prefix="detection-writer")
+        self._buffer = []
+        self._timer = None
+        self._writes = set()
+        self._stopping = False
+
+    def submit(self, plant_id: int, humidity: int, sensor_id: int, timestamp: datetime.datetime = None) -> Future:
+        """
+        Queue a detection for writing, from the event loop or from any other thread
+        :param plant_id: The detected plant
+        :param humidity: The detected soil humidity
+        :param sensor_id: The detection sensor
+        :param timestamp: The detection time, by default the submission time
+        :return: A future resolving to the detection ID
+        """
+        return self.submit_many([(plant_id, humidity, sensor_id, timestamp)])[0]
+
+    def submit_many(self, rows: list) -> list:
+        """
+        Queue several detections, they are written in the same batch
+        :param rows: List of (plant_id, humidity, sensor_id, timestamp) tuples, timestamp may be None
+        :return: The futures resolving to the detection IDs
+        """
+        now = datetime.datetime.now()
+        batch = [((plant_id, humidity, sensor_id, timestamp or now), Future()) for plant_id, humidity, sensor_id, timestamp in rows]
+        if self._stopping:
+            # Writer already stopped, write synchronously
+            self.flush(batch)
+        elif threading.get_ident() == self.ident:
+            self._add(batch)
+        else:
+            self.loop.call_soon_threadsafe(self._add, batch)
+        return [future for _, future in batch]
+
+    def run(self):
+        self.logging.info("Asyncio ingestion loop started")
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.close()
+        self.logging.info("Asyncio ingestion loop stopped")
+
+    def _add(self, batch: list):
+        """Buffer some detections (loop thread)"""
+        self._buffer.extend(batch)
+        if len(self._buffer) >= self.batch_size:
+            self._flush_buffer()
+        elif self._timer is None:
+            self._timer = self.loop.call_later(self.max_latency, self._flush_buffer)
+
+    def _flush_buffer(self):
+        """Hand the buffered detections to a writer thread (loop thread)"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = self._buffer
+        self._buffer = []
+        if batch:
+            write = self.loop.run_in_executor(self.executor, self.flush, batch)
+            self._writes.add(write)
+            write.add_done_callback(self._writes.discard)
+
+    def flush(self, batch: list):
+        """
+        Write a batch of detections in a single transaction and resolve their futures
+        :param batch: List of (values, future) tuples
+        :return:
+        """
+        try:
+            ids = self.db.insert_plant_detections([values for values, _ in batch])
+        except Exception as e:
+            self.logging.error(f"Cannot write {len(batch)} detections [{e}]")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.logging.debug(f"Written {len(batch)} detections")
+        if self.on_flush is not None:
+            self.on_flush()
+        for (_, future), detection_id in zip(batch, ids):
+            future.set_result(detection_id)
+
+    async def _drain(self):
+        self._flush_buffer()
+        if self._writes:
+            await asyncio.wait(list(self._writes))
+
+    def stop(self, timeout: float = None):
+        """
+        Flush the pending detections and stop the event loop
+        :param timeout: Seconds to wait for the last flush
+        :return:
+        """
+        # From now on the detections are written synchronously by submit
+        self._stopping = True
+        if self.is_alive():
+            drained = asyncio.run_coroutine_threadsafe(self._drain(), self.loop)
+            try:
+                drained.result(timeout)
+            except TimeoutError:
+                self.logging.warning("Detection writer stopped before the last flush")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.join(timeout)
+        if self._buffer and not self.is_alive():
+            # Submitted while the loop was stopping
+            self.flush(self._buffer)
+            self._buffer = []
+        self.executor.shutdown(wait=False)
+
+    def pending(self) -> int:
+        """Number of detections waiting to be written"""
+        return len(self._buffer)
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from socket import gaierror
+
+import paho.mqtt.client as mqtt
+
+from BinaryPayload import BinaryPayload
+from MessageHandler import MessageHandler, RegistrationRequired
+
+
+class AsyncMqttClient:
+    """
+    Receive the sensor messages on an asyncio event loop instead of paho's network thread.
+    The paho socket is watched by the loop, detections are parsed and buffered on the loop itself,
+    the messages needing synchronous DB access (watering acks, greetings, detections of unknown plants) are handed to a thread pool.
+    """
+    # Methods handled on the loop as long as their plants are registered, they only touch in-memory state and the detection buffer
+    inline_methods = ("d", "d2", "b")
+
+    def __init__(self, config, log: logging, go, loop: asyncio.AbstractEventLoop):
+        self.logging = log
+        self.config = config
+        self.go = go
+        self.loop = loop
+        # Split the sensor messages with the other workers of the group, see [MQTT] shared_group
+        self.shared_group = self.config.get("shared_group", "")
+        # The coordinator of the group receives every message, the ingestion workers register the new plants
+        self.coordinator = bool(self.shared_group) and self.config.get("role") == "coordinator"
+        self.client = mqtt.Client()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, self.config.get("workers", 4)), thread_name_prefix="mqtt-worker")
+        self.min_delay = self.config.get("reconnect_min_delay", 1)
+        self.max_delay = self.config.get("reconnect_max_delay", 120)
+        self._misc = None
+        self._stats_lock = threading.Lock()
+        self._received = 0
+        self._handled = 0
+        self._failed = 0
+        self._offloaded = 0
+
+    def on_connect(self, client, userdata, flags, rc):
+        self.logging.info(f"MQTT client connected [{mqtt.connack_string(rc)}]")
+        if self.shared_group:
+            # The wildcard covers also the sensors not registered yet, no need to know them
+            prefix = "" if self.coordinator else f"$share/{self.shared_group}/"
+            for topic in (prefix + "greeting", prefix + "sensor/+", self.config.get("registry_topic", "garden/registry")):
+                client.subscribe(topic)
+                self.logging.info(f"Subscribed to topic : {topic}")
+            return
+        client.subscribe("greeting")
+        # Subscribe to all existing sensors
+        for sensor in self.go.get_all_sensor_id():
+            client.subscribe("sensor/" + str(sensor))
+            self.logging.info(f"Subscribed to topic : sensor/{sensor}")
+
+    def on_disconnect(self, client, userdata, rc):
+        if rc != 0:
+            self.logging.warning(f"MQTT client disconnected [{mqtt.error_string(rc)}] - Reconnecting")
+
+    def on_socket_open(self, client, userdata, sock):
+        self.loop.add_reader(sock, client.loop_read)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    def new_subscription(self, topic):
+        # paho is driven by the loop, the other threads must not touch the socket
+        self.loop.call_soon_threadsafe(self.client.subscribe, topic)
+
+    def on_message(self, client, userdata, msg):
+        """Handle a message on the loop, or in the thread pool if it blocks on the DB"""
+        self._received += 1
+        message = BinaryPayload.decode_payload(msg.payload)
+        if MessageHandler.method_of(message) in self.inline_methods:
+            try:
+                self.handle_message(message, msg.topic, register_unknown=False)
+                return
+            except RegistrationRequired:
+                if self.coordinator:
+                    # The worker receiving the same message registers the plant and announces it on the registry topic
+                    self.logging.debug(f"Skipping a message of an unregistered plant from {msg.topic}")
+                    return
+                self.logging.debug(f"Registering the plants of a message from {msg.topic} off the loop")
+        self._offloaded += 1
+        handled = self.loop.run_in_executor(self.executor, self.handle_message, message, msg.topic)
+        handled.add_done_callback(self._offload_done)
+
+    def _offload_done(self, handled):
+        self._offloaded -= 1
+
+    def handle_message(self, message, topic: str, register_unknown: bool = True):
+        """
+        Parse and apply a message
+        :param message: The decoded message
+        :param topic: The message topic
+        :param register_unknown: Register the unknown plants, otherwise raise RegistrationRequired before any side effect
+        :return:
+        """
+        try:
+            MessageHandler(self.logging, message, topic, self.go, register_unknown).run()
+            with self._stats_lock:
+                self._handled += 1
+        except RegistrationRequired:
+            raise
+        except Exception as e:
+            with self._stats_lock:
+                self._failed += 1
+            self.logging.error(f"Cannot handle message from {topic} [{e}]")
+
+    def stats(self) -> dict:
+        return {
+            'mode': "asyncio",
+            'received': self._received,
+            'handled': self._handled,
+            'failed': self._failed,
+            'queue_depth': self._offloaded
+        }
+
+    def start(self):
+        """
+        Connect to the broker from the loop and start watching the socket
+        :return:
+        """
+        try:
+            asyncio.run_coroutine_threadsafe(self._connect(), self.loop).result()
+            self.logging.info("MQTT client listening on the asyncio loop")
+        except ConnectionRefusedError:
+            self.logging.error("Cannot connect to MQTT host: " + str(self.config.get("host")) + ":" + str(self.config.get("port")))
+            print("Cannot connect to MQTT host: " + str(self.config.get("host")) + ":" + str(self.config.get("port")))
+            exit(1)
+        except gaierror:
+            self.logging.error("Host: [" + str(self.config.get("host")) + "] not found")
+            print("Host not found")
+            exit(1)
+
+    async def _connect(self):
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+        self.client.connect(self.config.get("host"), self.config.get("port"), self.config.get("keepalive"))
+        self._misc = self.loop.create_task(self._housekeeping())
+
+    async def _housekeeping(self):
+        """Send the keepalive pings and reconnect with an exponential backoff"""
+        delay = self.min_delay
+        while True:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                try:
+                    self.client.reconnect()
+                    delay = self.min_delay
+                except OSError as e:
+                    self.logging.warning(f"Cannot reconnect to MQTT host [{e}] - Retrying in {delay}s")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_delay)
+                    continue
+            await asyncio.sleep(1)
+
+    async def _disconnect(self):
+        if self._misc is not None:
+            self._misc.cancel()
+        self.client.disconnect()
+
+    def stop(self, timeout: float = None):
+        """
+        Close the session, the messages already handed to the thread pool are completed
+        :param timeout: Seconds to wait for the disconnection
+        :return:
+        """
+        if self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._disconnect(), self.loop).result(timeout)
+        self.executor.shutdown(wait=True)
+        self.logging.info("MQTT client stopped")
@@ -0,0 +1,213 @@
+import datetime
+import struct
+import threading
+
+
+class BinaryPayload:
+    """
+    Fixed-layout binary sensor messages, an alternative to the underscore text protocol.
+    Every message starts with a header, in network byte order:
+    - magic (B): 0xA5, never the first byte of a text message
+    - version (B): the layout version, currently 1
+    - method (B): 1 detection, 2 watering ack, 3 greeting, 4 batch of detections
+    - flags (B): bit 0 set when the detection carries the sensor timestamp
+    - sequence (H): per sensor message counter, wrapping at 65536
+    followed by the method body:
+    - detection: plant_num (B), humidity (H) and, if flagged, the sensor timestamp in UNIX seconds (I)
+    - watering ack: watering_id (I)
+    - greeting: sensor_id (I)
+    - batch: readings count (B), if flagged the sensor timestamp (I), then plant_num (B) and humidity (H) of each reading
+    """
+    MAGIC = b"\xa5"
+    VERSION = 1
+    DETECTION = 1
+    WATERING_ACK = 2
+    GREETING = 3
+    BATCH = 4
+    HAS_TIMESTAMP = 0x01
+    # The text protocol method of each binary method
+    method_names = {DETECTION: "d2", WATERING_ACK: "w", GREETING: "s", BATCH: "b"}
+    # One precompiled layout per (method, flags), so that each message is decoded by a single unpack
+    layouts = {
+        (DETECTION, 0): struct.Struct("!BBBBHBH"),
+        (DETECTION, HAS_TIMESTAMP): struct.Struct("!BBBBHBHI"),
+        (WATERING_ACK, 0): struct.Struct("!BBBBHI"),
+        (GREETING, 0): struct.Struct("!BBBBHI")
+    }
+    # The same layouts keyed by their version, method and flags bytes
+    fixed_layouts = {
+        bytes((VERSION, DETECTION, 0)): layouts[(DETECTION, 0)],
+        bytes((VERSION, DETECTION, HAS_TIMESTAMP)): layouts[(DETECTION, HAS_TIMESTAMP)],
+        bytes((VERSION, WATERING_ACK, 0)): layouts[(WATERING_ACK, 0)],
+        bytes((VERSION, GREETING, 0)): layouts[(GREETING, 0)]
+    }
+    # The batches have a fixed part followed by a variable number of readings
+    batch_layouts = {
+        0: struct.Struct("!BBBBHB"),
+        HAS_TIMESTAMP: struct.Struct("!BBBBHBI")
+    }
+    READING = struct.Struct("!BH")
+    HEADER = struct.Struct("!BBBBH")
+
+    SEQUENCE_SPACE = 65536
+    # Sequence numbers behind the last one remembered to recognize the repeated messages
+    SEQUENCE_WINDOW = 64
+    SEQUENCE_WINDOW_MASK = (1 << SEQUENCE_WINDOW) - 1
+
+    # Sensor ID -> (last sequence number, bitmap of the messages received behind it, bitmap of the messages sent since the first one)
+    _sequences = {}
+    _sequences_lock = threading.Lock()
+
+    @classmethod
+    def is_binary(cls, payload) -> bool:
+        return payload[:1] == cls.MAGIC
+
+    @classmethod
+    def decode_payload(cls, payload: bytes):
+        """
+        Keep the binary messages as bytes and decode the text ones
+        :param payload: The raw MQTT payload
+        :return: The bytes of a binary message or the text message
+        """
+        if cls.is_binary(payload):
+            return bytes(payload)
+        return payload.decode('utf-8')
+
+    @classmethod
+    def method_of(cls, payload: bytes) -> str:
+        """Peek the text protocol method of a binary message without decoding it"""
+        if len(payload) < cls.HEADER.size:
+            return "invalid"
+        return cls.method_names.get(payload[2], "unknown")
+
+    @classmethod
+    def decode(cls, payload: bytes) -> dict:
+        """
+        Decode a binary message
+        :param payload: The message bytes
+        :return: The method, in the text protocol naming, the sequence number and the method fields
+        """
+        # Version, method and flags select the layout with a single lookup, the checks are left to the uncommon messages
+        layout = cls.fixed_layouts.get(payload[1:4])
+        if layout is None or len(payload) != layout.size:
+            return cls.decode_other(payload)
+        fields = layout.unpack(payload)
+        method = fields[2]
+        if method == cls.DETECTION:
+            return {
+                'method': "d2",
+                'sequence': fields[4],
+                'plant_num': fields[5],
+                'humidity': fields[6],
+                'timestamp': datetime.datetime.fromtimestamp(fields[7]) if fields[3] & cls.HAS_TIMESTAMP else None
+            }
+        if method == cls.WATERING_ACK:
+            return {'method': "w", 'sequence': fields[4], 'watering_id': fields[5]}
+        return {'method': "s", 'sequence': fields[4], 'sensor_id': fields[5]}
+
+    @classmethod
+    def decode_other(cls, payload: bytes) -> dict:
+        """Decode a batch, or tell what is wrong with a message not matching any fixed layout"""
+        if len(payload) < cls.HEADER.size:
+            raise ValueError("Truncated binary message")
+        version, method, flags = payload[1], payload[2], payload[3]
+        if version != cls.VERSION:
+            raise ValueError(f"Unsupported binary message version [{version}]")
+        if method == cls.BATCH:
+            return cls.decode_batch(payload, flags)
+        layout = cls.layouts.get((method, flags))
+        if layout is None:
+            raise ValueError(f"Unknown binary message layout [method: {method} - flags: {flags}]")
+        raise ValueError(f"Invalid binary message length [{len(payload)} instead of {layout.size}]")
+
+    @classmethod
+    def decode_batch(cls, payload: bytes, flags: int) -> dict:
+        layout = cls.batch_layouts.get(flags)
+        if layout is None or len(payload) < layout.size:
+            raise ValueError(f"Invalid binary batch [flags: {flags} - length: {len(payload)}]")
+        fields = layout.unpack_from(payload)
+        count = fields[5]
+        if len(payload) != layout.size + count * cls.READING.size:
+            raise ValueError(f"Invalid binary batch length [{len(payload)} for {count} readings]")
+        return {
+            'method': "b",
+            'sequence': fields[4],
+            'readings': list(cls.READING.iter_unpack(payload[layout.size:])),
+            'timestamp': datetime.datetime.fromtimestamp(fields[6]) if flags & cls.HAS_TIMESTAMP else None
+        }
+
+    @classmethod
+    def encode_batch(cls, sequence: int, readings: list, timestamp: datetime.datetime = None) -> bytes:
+        """Build a batch message from a list of (plant_num, humidity) readings"""
+        if timestamp is None:
+            head = cls.batch_layouts[0].pack(cls.MAGIC[0], cls.VERSION, cls.BATCH, 0, sequence, len(readings))
+        else:
+            head = cls.batch_layouts[cls.HAS_TIMESTAMP].pack(
+                cls.MAGIC[0], cls.VERSION, cls.BATCH, cls.HAS_TIMESTAMP, sequence, len(readings), int(timestamp.timestamp())
+            )
+        return head + b"".join(cls.READING.pack(plant_num, humidity) for plant_num, humidity in readings)
+
+    @classmethod
+    def encode_detection(cls, sequence: int, plant_num: int, humidity: int, timestamp: datetime.datetime = None) -> bytes:
+        """Build a detection message, as sent by the sensors"""
+        if timestamp is None:
+            return cls.layouts[(cls.DETECTION, 0)].pack(cls.MAGIC[0], cls.VERSION, cls.DETECTION, 0, sequence, plant_num, humidity)
+        return cls.layouts[(cls.DETECTION, cls.HAS_TIMESTAMP)].pack(
+            cls.MAGIC[0], cls.VERSION, cls.DETECTION, cls.HAS_TIMESTAMP, sequence, plant_num, humidity, int(timestamp.timestamp())
+        )
+
+    @classmethod
+    def reset_sequence(cls, sensor_id: int) -> int:
+        """
+        Forget the sequence of a restarted sensor
+        :return: The number of messages still missing in the window, they will never arrive
+        """
+        with cls._sequences_lock:
+            tracked = cls._sequences.pop(sensor_id, None)
+        if tracked is None:
+            return 0
+        _, seen, sent = tracked
+        return cls._missing(sent & ~seen)
+
+    @classmethod
+    def track_sequence(cls, sensor_id: int, sequence: int) -> int:
+        """
+        Follow the sequence numbers of a sensor.
+        The parallel handlers and the shared subscriptions reorder the messages: a sequence number behind the last one,
+        by less than half the sequence space, is a late or a repeated message and never moves the last one back.
+        A skipped sequence number is a hole until it slides out of the window, only then it counts as missed.
+        :param sensor_id: The sending sensor
+        :param sequence: The sequence number of the received message
+        :return: 0 for the expected or a late message, -1 for a repeated one, otherwise the number of messages missed
+        """
+        with cls._sequences_lock:
+            tracked = cls._sequences.get(sensor_id)
+            if tracked is None:
+                cls._sequences[sensor_id] = (sequence, 1, 1)
+                return 0
+            # Bit n of seen is set once the message n places behind the last one has been received,
+            # bit n of sent once it is known to exist, the sequence starting at the first received message
+            last, seen, sent = tracked
+            ahead = (sequence - last) % cls.SEQUENCE_SPACE
+            if ahead == 0:
+                return -1
+            if ahead < cls.SEQUENCE_SPACE // 2:
+                holes = (sent & ~seen) << ahead | ((1 << ahead) - 2)
+                cls._sequences[sensor_id] = (
+                    sequence,
+                    ((seen << ahead) | 1) & cls.SEQUENCE_WINDOW_MASK,
+                    ((sent << ahead) | ((1 << ahead) - 1)) & cls.SEQUENCE_WINDOW_MASK
+                )
+                return cls._missing(holes >> cls.SEQUENCE_WINDOW)
+            behind = cls.SEQUENCE_SPACE - ahead
+            if behind >= cls.SEQUENCE_WINDOW:
+                # Too late to tell a repeated message from a late one, it was already counted as missed
+                return 0
+            if seen >> behind & 1:
+                return -1
+            cls._sequences[sensor_id] = (last, seen | 1 << behind, sent)
+            return 0
+
+    @staticmethod
+    def _missing(holes: int) -> int:
+        return bin(holes).count("1")
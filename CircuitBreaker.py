@@ -0,0 +1,62 @@
+import logging
+import threading
+import time
+
+
+class CircuitBreaker:
+    """
+    Track the health of a dependency and stop calling it while it is failing.
+    After failure_threshold consecutive failures (or calls slower than latency_budget) the circuit opens,
+    after reset_timeout seconds a single probe call is allowed: its outcome closes or reopens the circuit.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, log: logging, name: str, failure_threshold: int = 3, reset_timeout: float = 30, latency_budget: float = None):
+        self.logging = log
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.latency_budget = latency_budget
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Check if the dependency can be called, the caller must then record the outcome
+        :return: True when closed, or to the single probe call once the reset timeout is elapsed
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self, latency: float = 0):
+        """Record a completed call, a call over the latency budget counts as a failure"""
+        if self.latency_budget is not None and latency > self.latency_budget:
+            self.logging.warning(f"{self.name} over latency budget [{latency:.2f}s > {self.latency_budget}s]")
+            self.record_failure()
+            return
+        with self._lock:
+            if self.state != self.CLOSED:
+                self.logging.info(f"{self.name} circuit closed")
+            self.state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.logging.warning(f"{self.name} circuit open for {self.reset_timeout}s")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def is_closed(self) -> bool:
+        return self.state == self.CLOSED
@@ -0,0 +1,201 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes available within the acquire timeout"""
+
+
+class ConnectionPool:
+    """
+    A bounded, thread-safe pool of DB connections.
+    Idle connections are health checked before being handed out and recycled when unused for too long.
+    """
+
+    def __init__(self, factory, log: logging, min_size: int = 1, max_size: int = 5, idle_timeout: float = 300,
+                 health_check_interval: float = 30, acquire_timeout: float = 10, validator=None):
+        """
+        :param factory: Callable returning a new DB connection
+        :param log: The logger
+        :param min_size: The number of connections always kept open
+        :param max_size: The maximum number of connections open at the same time
+        :param idle_timeout: Seconds after which an unused connection (above min_size) is closed
+        :param health_check_interval: Seconds of idleness after which a connection is validated before reuse
+        :param acquire_timeout: Seconds to wait for a free connection before giving up
+        :param validator: Callable checking a connection is alive, by default calls connection.ping()
+        """
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f"Invalid pool size [min: {min_size} - max: {max_size}]")
+        self.factory = factory
+        self.logging = log
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.validator = validator or (lambda con: con.ping())
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._available = threading.Condition()
+        self.fill()
+
+    def fill(self):
+        """
+        Open connections until min_size is reached
+        :return:
+        """
+        while True:
+            with self._available:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                con = self.factory()
+            except Exception:
+                with self._available:
+                    self._size -= 1
+                    self._available.notify()
+                raise
+            with self._available:
+                self._idle.append((con, time.monotonic()))
+                self._available.notify()
+
+    def acquire(self):
+        """
+        Get a connection from the pool, opening a new one if the pool is not full
+        :return: A DB connection
+        """
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            with self._available:
+                if self._closed:
+                    raise PoolTimeoutError("Connection pool is closed")
+                self._recycle_idle()
+                if self._idle:
+                    con, last_used = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                    con, last_used = None, None
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.logging.warning(f"No DB connection available after {self.acquire_timeout}s")
+                        raise PoolTimeoutError(f"No DB connection available after {self.acquire_timeout}s")
+                    self._available.wait(remaining)
+                    continue
+            if con is None:
+                return self._open()
+            if time.monotonic() - last_used < self.health_check_interval or self._is_healthy(con):
+                return con
+            self.logging.info("Discarding broken DB connection")
+            self._discard(con)
+
+    def release(self, con, discard: bool = False):
+        """
+        Give a connection back to the pool
+        :param con: The connection to release
+        :param discard: Close the connection instead of reusing it
+        :return:
+        """
+        if discard or not self._reset(con):
+            self._discard(con)
+            return
+        with self._available:
+            if not self._closed:
+                self._idle.append((con, time.monotonic()))
+                self._available.notify()
+                return
+            self._size -= 1
+        self._close(con)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of the with block.
+        Connections that raised an error, or left while streaming results, are discarded since their state is unknown.
+        """
+        con = self.acquire()
+        try:
+            yield con
+        except BaseException:
+            self.release(con, discard=True)
+            raise
+        else:
+            self.release(con)
+
+    def close(self):
+        """
+        Close all the idle connections and refuse new requests
+        :return:
+        """
+        with self._available:
+            self._closed = True
+            idle = [con for con, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._available.notify_all()
+        for con in idle:
+            self._close(con)
+
+    def stats(self):
+        """
+        Retrieve the pool occupation
+        :return:
+        """
+        with self._available:
+            return {'size': self._size, 'idle': len(self._idle), 'in_use': self._size - len(self._idle),
+                    'max_size': self.max_size}
+
+    def _open(self):
+        try:
+            return self.factory()
+        except Exception:
+            with self._available:
+                self._size -= 1
+                self._available.notify()
+            raise
+
+    def _discard(self, con):
+        with self._available:
+            self._size -= 1
+            self._available.notify()
+        self._close(con)
+
+    def _recycle_idle(self):
+        """Close the connections unused for more than idle_timeout, keeping at least min_size open (lock held)"""
+        now = time.monotonic()
+        # The oldest connections sit on the left side of the deque
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            con, _ = self._idle.popleft()
+            self._size -= 1
+            self._close(con)
+
+    def _reset(self, con):
+        """
+        End the transaction left open by the last user, the drivers start one on the first read without autocommit.
+        A connection kept in an idle transaction would read a stale snapshot and hold the metadata locks of the tables it read.
+        """
+        try:
+            con.rollback()
+            return True
+        except Exception as e:
+            self.logging.debug(f"Cannot reset DB connection [{e}]")
+            return False
+
+    def _is_healthy(self, con):
+        try:
+            self.validator(con)
+            return True
+        except Exception as e:
+            self.logging.debug(f"DB connection health check failed [{e}]")
+            return False
+
+    def _close(self, con):
+        try:
+            con.close()
+        except Exception as e:
+            self.logging.debug(f"Cannot close DB connection [{e}]")
@@ -0,0 +1,43 @@
+import datetime
+import itertools
+import os
+import threading
+
+
+class DataVersion:
+    """
+    In-memory change counter of a data set, used to answer conditional HTTP requests without reading the data.
+    The tokens embed a random boot ID so that the ones issued before a restart are never matched again.
+    """
+
+    def __init__(self):
+        self._boot_id = os.urandom(4).hex()
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self.version = 0
+        self.last_modified = self.now()
+
+    def bump(self):
+        """Record a change of the data"""
+        with self._lock:
+            self.version = next(self._counter)
+            self.last_modified = self.now()
+
+    def validators(self, valid_from: datetime.datetime = None):
+        """
+        Build the cache validators of the current version
+        :param valid_from: Start of the time slot the response depends on, for data changing with the clock (UTC)
+        :return: The ETag and the Last-Modified time
+        """
+        with self._lock:
+            version, last_modified = self.version, self.last_modified
+        etag = f"{self._boot_id}-{version}"
+        if valid_from is not None:
+            etag += "-" + str(int(valid_from.timestamp()))
+            last_modified = max(last_modified, valid_from)
+        return etag, last_modified
+
+    @staticmethod
+    def now() -> datetime.datetime:
+        # HTTP dates have a one second resolution
+        return datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
@@ -1,150 +1,295 @@
+import datetime
 import logging
-import mariadb
 import threading
+import time
+from contextlib import contextmanager
+
+from Metrics import metrics
+from StorageBackend import StorageError, create_backend
+
+CONNECTION_WAIT = metrics.histogram("garden_db_connection_wait_seconds", "Time spent waiting for a DB connection", ("mode",))
+QUERY_LATENCY = metrics.histogram("garden_db_query_seconds", "DB query latency, connection wait included", ("operation",))
 
 
 class Database:
     plant_inventory = "plant_inventory"
     plant_history = "plant_history"
     plant_water = "plant_water"
+    plant_history_hourly = "plant_history_hourly"
+    plant_history_daily = "plant_history_daily"
+    schema_version = "schema_version"
+    # The numbered schema migrations, applied in order and recorded in schema_version.
+    # Each one must be idempotent, the DBs created before versioning replay all of them.
+    migrations = (
+        (1, "Create the plant tables", "create_plant_tables"),
+        (2, "Create the history rollup tables", "create_rollup_tables"),
+        (3, "Index the latest detection of each plant", "optimize_db"),
+        (4, "Partition the detection history by month", "partition_plant_history"),
+        (5, "Identify each plant by its sensor and plant number", "unique_plant_reference")
+    )
+    # Months of empty partitions kept ready ahead of the current one
+    partition_months_ahead = 2
+    # How the aggregates of a new batch are merged into the existing ones
+    rollup_merge = {'hum_sum': 'add', 'hum_count': 'add', 'hum_min': 'min', 'hum_max': 'max'}
 
     def __init__(self, config, log: logging):
         self.config = config
         self.logging = log
-        self._connection = None
         self.dbSemaphore = threading.Condition()
+        self.backend = create_backend(self.config, self.logging)
         self.test_connection()
 
-    def _connect(self):
+    def disconnect(self):
         """
-        Try to get DB connection
-        :return: The DB connection
+        Disconnect from DB closing all the connections
+        :return:
         """
-        try:
-            conn = mariadb.connect(
-                user=self.config.get('db_user'),
-                password=self.config.get('db_password'),
-                host=self.config.get('db_host'),
-                port=self.config.get('db_port'),
-                database=self.config.get('db_name')
-            )
-            return conn
-        except mariadb.Error as e:
-            print(f"Error connecting to MariaDB Platform: {e}")
-            self.logging.error("Cannot log in to MariaDB")
-            raise e
+        self.backend.close()
 
-    def disconnect(self):
+    @contextmanager
+    def get_connection(self):
         """
-        Disconnect from DB
+        Borrow a DB connection for writing, to be used in a with block
         :return:
         """
-        if self._connection is not None:
-            self._connection.close()
-            self._connection = None
+        start = time.perf_counter()
+        with self.backend.write_connection() as con:
+            CONNECTION_WAIT.observe(time.perf_counter() - start, "write")
+            yield con
 
-    def get_connection(self):
+    @contextmanager
+    def get_read_connection(self):
         """
-        Retrieve the DB connection
+        Borrow a DB connection for reading, to be used in a with block
         :return:
         """
-        if self._connection is None:
-            return self._connect()
-        else:
-            return self._connection
+        start = time.perf_counter()
+        with self.backend.read_connection() as con:
+            CONNECTION_WAIT.observe(time.perf_counter() - start, "read")
+            yield con
 
     def test_connection(self):
         """
-        Test the DB connection
+        Test the DB connection, checking the schema version
         :return:
         """
-        self.get_connection()
-        self.disconnect()
-        self.install()
-
-    def create_db(self):
-        """Initialize the DB creating tables and loading missing data"""
-        # Create table
-        outcome = True
-        outcome = outcome and self.create_plant_inventory()
-        outcome = outcome and self.create_plant_history()
-        outcome = outcome and self.create_plant_water_history()
-        outcome = outcome and self.optimize_db()
-        if outcome:
-            self.logging.info("DB setup completed")
-        else:
-            self.logging.warning("Cannot create DB tables")
-        return outcome
+        if not self.install():
+            # Going on would replay the failed migration at every start, on a schema the code does not expect
+            self.logging.error("Cannot bring the DB schema up to date")
+            raise StorageError(f"DB schema stuck at version {self.get_schema_version()}, a migration failed")
 
-    def create_table(self, sql: str):
-        con = self.get_connection()
-        c = con.cursor()
+    def get_schema_version(self) -> int:
+        """
+        Retrieve the last migration applied to the DB
+        :return: The schema version, 0 if the DB has never been migrated
+        """
         try:
-            c.execute(sql)
-            con.commit()
-            c.close()
-            return True
-        except mariadb.Error as e:
-            self.logging.warning("Cannot create database: " + str(e))
-            print(f"Error: {e}")
+            version = self.get_values_from_db("SELECT MAX(version) AS version FROM " + self.schema_version + ";")[0]['version']
+        except self.backend.Error:
+            # No schema_version table yet
+            return 0
+        return version or 0
+
+    def migrate(self):
+        """
+        Apply the missing migrations in order, recording each one as soon as it succeeds
+        :return: True if the schema is up to date
+        """
+        if not self.create_table(self.backend.schema[self.schema_version]):
             return False
+        # Another process may have migrated the DB while waiting for the lock
+        version = self.get_schema_version()
+        record_sql = """INSERT INTO """ + self.schema_version + """ (version, description, applied_at) VALUES (?, ?, ?)
+                """ + self.backend.upsert(("version",), {'description': 'replace', 'applied_at': 'replace'}) + ";"
+        for number, description, migration in self.migrations:
+            if number <= version:
+                continue
+            self.logging.info(f"Applying schema migration #{number} [{description}]")
+            if not getattr(self, migration)():
+                self.logging.warning(f"Schema migration #{number} failed [{description}]")
+                return False
+            self.insert_values(record_sql, (number, description, datetime.datetime.now()))
+        self.logging.info(f"DB schema migrated to version {self.migrations[-1][0]}")
+        return True
+
+    def create_plant_tables(self):
+        return self.create_plant_inventory() and self.create_plant_history() and self.create_plant_water_history()
+
+    def create_rollup_tables(self):
+        return self.create_plant_history_hourly() and self.create_plant_history_daily()
+
+    def create_table(self, sql: str):
+        with self.get_connection() as con:
+            c = con.cursor()
+            try:
+                c.execute(sql)
+                con.commit()
+                c.close()
+                return True
+            except self.backend.Error as e:
+                self.logging.warning("Cannot create database: " + str(e))
+                print(f"Error: {e}")
+                return False
 
     def create_plant_inventory(self):
         """Create a table containing all the known plant"""
-        sql = """CREATE TABLE IF NOT EXISTS """ + self.plant_inventory + """ (
-                    plant_id INT auto_increment NOT NULL,
-                    plant_name varchar(256) NULL,
-                    plant_num INT NULL,
-                    nodemcu_id INT NULL,
-                    owner varchar(256) NULL,
-                    plant_location varchar(256) NULL,
-                    plant_type varchar(256) NULL,
-                    default_watering int(11) NOT NULL DEFAULT 150 COMMENT 'The default watering value',
-                    CONSTRAINT plant_id_PK PRIMARY KEY (plant_id)
-                )
-                ENGINE=InnoDB
-                DEFAULT CHARSET=utf8mb4
-                COLLATE=utf8mb4_general_ci
-                COMMENT='The list of my plant';"""
-        return self.create_table(sql)
+        return self.create_table(self.backend.schema[self.plant_inventory])
 
     def create_plant_history(self):
         """Create a table containing all the plant status detection"""
-        sql = """CREATE TABLE IF NOT EXISTS """ + self.plant_history + """ (
-                    detection_id INT auto_increment NOT NULL,
-                    plant_id INT NOT NULL,
-                    plant_hum INT NOT NULL,
-                    nodemcu_id INT NULL,
-                    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    CONSTRAINT detection_id_PK PRIMARY KEY (detection_id)
-                )
-                ENGINE=InnoDB
-                DEFAULT CHARSET=utf8mb4
-                COLLATE=utf8mb4_general_ci
-                COMMENT='The last detections of plant soil humidity';"""
-        return self.create_table(sql)
+        return self.create_table(self.backend.schema[self.plant_history])
 
     def create_plant_water_history(self):
         """Create a table containing all the last watering done"""
-        sql = """CREATE TABLE IF NOT EXISTS """ + self.plant_water + """ (
-                    watering_id INT auto_increment NOT NULL,
-                    plant_id INT NOT NULL,
-                    water_quantity INT NOT NULL,
-                    watering_done BOOL NOT NULL DEFAULT FALSE,
-                    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    CONSTRAINT watering_id_PK PRIMARY KEY (watering_id)
-                )
-                ENGINE=InnoDB
-                DEFAULT CHARSET=utf8mb4
-                COLLATE=utf8mb4_general_ci
-                COMMENT='The last watering done';"""
-        return self.create_table(sql)
+        return self.create_table(self.backend.schema[self.plant_water])
+
+    def create_plant_history_hourly(self):
+        """Create a table containing the hourly aggregates of the plant status detection"""
+        return self.create_table(self.backend.schema[self.plant_history_hourly])
+
+    def create_plant_history_daily(self):
+        """Create a table containing the daily aggregates of the plant status detection older than the hourly retention"""
+        return self.create_table(self.backend.schema[self.plant_history_daily])
+
+    def partition_plant_history(self):
+        """
+        Partition the detection history by month, converting the tables created by older versions.
+        The partitioning key must be part of the primary key, so the key becomes (detection_id, timestamp).
+        :return:
+        """
+        if not self.backend.partitioning:
+            return True
+        if self.get_history_partitions():
+            return self.ensure_history_partitions()
+        self.logging.info("Partitioning " + self.plant_history + " by month")
+        sql = """SELECT MIN(timestamp) AS first_ts FROM """ + self.plant_history + ";"
+        first_ts = self.get_values_from_db(sql)[0]['first_ts'] or datetime.datetime.now()
+        outcome = self.create_table("""ALTER TABLE """ + self.plant_history + """
+                MODIFY detection_id BIGINT auto_increment NOT NULL,
+                DROP PRIMARY KEY,
+                ADD CONSTRAINT detection_id_PK PRIMARY KEY (detection_id, timestamp);""")
+        months = self.partition_months(first_ts, self.last_partition_month())
+        return outcome and self.create_table("""ALTER TABLE """ + self.plant_history + """
+                PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) (""" + self.partition_definitions(months) + ");")
+
+    def ensure_history_partitions(self):
+        """
+        Create the monthly partitions up to partition_months_ahead months from now
+        :return:
+        """
+        existing = {p['name'] for p in self.get_history_partitions()}
+        months = [m for m in self.partition_months(datetime.datetime.now(), self.last_partition_month())
+                  if self.partition_name(m) not in existing]
+        if not months:
+            return True
+        self.logging.info(f"Adding {len(months)} monthly partitions to " + self.plant_history)
+        return self.create_table("""ALTER TABLE """ + self.plant_history + """
+                REORGANIZE PARTITION pfuture INTO (""" + self.partition_definitions(months) + ");")
+
+    def get_history_partitions(self):
+        """
+        Retrieve the partitions of the detection history
+        :return: List of partitions with name, upper bound (None for pfuture), rows and bytes
+        """
+        if not self.backend.partitioning:
+            return []
+        sql = """SELECT PARTITION_NAME AS name, PARTITION_DESCRIPTION AS bound, TABLE_ROWS AS table_rows, DATA_LENGTH + INDEX_LENGTH AS bytes
+                FROM information_schema.PARTITIONS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ? AND PARTITION_NAME IS NOT NULL
+                ORDER BY PARTITION_ORDINAL_POSITION;"""
+        partitions = self.get_values_from_db(sql, (self.plant_history,))
+        for partition in partitions:
+            partition['bound'] = None if partition['bound'] == 'MAXVALUE' else int(partition['bound'])
+        return partitions
+
+    def last_partition_month(self):
+        month = datetime.date.today().replace(day=1)
+        for _ in range(self.partition_months_ahead):
+            month = self.next_month(month)
+        return month
+
+    @staticmethod
+    def next_month(month: datetime.date) -> datetime.date:
+        return (month.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+    @classmethod
+    def partition_months(cls, start, end: datetime.date) -> list:
+        """List the first day of each month between start and end (included)"""
+        month = datetime.date(start.year, start.month, 1)
+        months = []
+        while month <= end:
+            months.append(month)
+            month = cls.next_month(month)
+        return months
+
+    @staticmethod
+    def partition_name(month: datetime.date) -> str:
+        return month.strftime("p%Y%m")
+
+    @classmethod
+    def partition_definitions(cls, months: list) -> str:
+        """Build the definition of one partition per month, followed by the catch-all pfuture partition"""
+        definitions = [
+            "PARTITION " + cls.partition_name(month) + " VALUES LESS THAN (UNIX_TIMESTAMP('" + cls.next_month(month).isoformat() + " 00:00:00'))"
+            for month in months
+        ]
+        definitions.append("PARTITION pfuture VALUES LESS THAN MAXVALUE")
+        return ", ".join(definitions)
 
     def optimize_db(self):
         """Run the optimization procedure"""
         sql = """CREATE INDEX IF NOT EXISTS idx_plant_history_max_ts_plant_id ON plant_history(plant_id, timestamp DESC);"""
         return self.create_table(sql)
 
+    def unique_plant_reference(self):
+        """Forbid two plants with the same sensor and plant number, the workers may register the same new plant at once"""
+        if not self.merge_duplicate_plants():
+            return False
+        sql = """CREATE UNIQUE INDEX IF NOT EXISTS plant_inventory_reference_UN ON """ + self.plant_inventory + """(nodemcu_id, plant_num);"""
+        return self.create_table(sql)
+
+    def merge_duplicate_plants(self):
+        """
+        Merge the plants sharing sensor and plant number into the oldest one, moving their detections, waterings and aggregates
+        :return: True if no duplicate is left
+        """
+        sql = """SELECT pi2.plant_id, kept.plant_id AS kept_id
+                FROM """ + self.plant_inventory + """ pi2
+                JOIN (
+                    SELECT nodemcu_id, plant_num, MIN(plant_id) AS plant_id
+                    FROM """ + self.plant_inventory + """
+                    WHERE nodemcu_id IS NOT NULL AND plant_num IS NOT NULL
+                    GROUP BY nodemcu_id, plant_num
+                    HAVING COUNT(*) > 1
+                ) kept ON pi2.nodemcu_id = kept.nodemcu_id AND pi2.plant_num = kept.plant_num
+                WHERE pi2.plant_id <> kept.plant_id
+                ORDER BY pi2.plant_id;"""
+        duplicates = self.get_values_from_db(sql)
+        if not duplicates:
+            return True
+        statements = []
+        for duplicate in duplicates:
+            move = (duplicate['kept_id'], duplicate['plant_id'])
+            for table in (self.plant_history, self.plant_water):
+                statements.append(("""UPDATE """ + table + """ SET plant_id = ? WHERE plant_id = ?;""", move))
+            for table, key in ((self.plant_history_hourly, "hour_ts"), (self.plant_history_daily, "day")):
+                statements.append(("""INSERT INTO """ + table + """
+                        (plant_id, """ + key + """, hum_sum, hum_count, hum_min, hum_max)
+                        SELECT ?, """ + key + """, hum_sum, hum_count, hum_min, hum_max
+                        FROM """ + table + """
+                        WHERE plant_id = ?
+                        """ + self.backend.upsert(("plant_id", key), self.rollup_merge) + ";", move))
+                statements.append(("""DELETE FROM """ + table + """ WHERE plant_id = ?;""", (duplicate['plant_id'],)))
+            statements.append(("""DELETE FROM """ + self.plant_inventory + """ WHERE plant_id = ?;""", (duplicate['plant_id'],)))
+        try:
+            self.execute_transaction(statements)
+        except self.backend.Error as e:
+            self.logging.warning(f"Cannot merge the duplicate plants [{e}]")
+            return False
+        self.logging.warning(f"Merged {len(duplicates)} duplicate plants: " +
+                             ", ".join(f"#{d['plant_id']} into #{d['kept_id']}" for d in duplicates))
+        return True
+
     def get_all_plant_id(self):
         """
         Retrieve the list of all plant ID monitored
@@ -181,6 +326,36 @@ class Database:
             self.logging.warning("Cannot retrieve any plant")
             return None
 
+    def get_plant_inventory(self):
+        """
+        Retrieve the whole plant inventory
+        :return:
+        """
+        sql = """SELECT plant_id, plant_name, plant_num, nodemcu_id, owner, plant_location, plant_type, default_watering
+                FROM """ + self.plant_inventory + """
+                ORDER BY plant_id;
+                """
+        self.logging.debug("Getting plant inventory")
+        return self.get_values_from_db(sql)
+
+    def get_plant(self, plant_id):
+        """
+        Retrieve a single plant from the inventory
+        :param plant_id: The plant ID
+        :return: The plant or None if missing
+        """
+        sql = """SELECT plant_id, plant_name, plant_num, nodemcu_id, owner, plant_location, plant_type, default_watering
+                FROM """ + self.plant_inventory + """
+                WHERE plant_id = ?;
+                """
+        parameters = (plant_id,)
+        results = self.get_values_from_db(sql, parameters)
+        if len(results) > 0:
+            return results[0]
+        else:
+            self.logging.warning(f"This plant {plant_id} is not in the inventory")
+            return None
+
     def get_plant_id(self, sensor_id, plant_num):
         sql = """SELECT plant_id
                 FROM """ + self.plant_inventory + """
@@ -217,17 +392,16 @@ class Database:
         :return:
         """
         sql = """SELECT pi2.plant_id, pi2.plant_name, pi2.nodemcu_id, pi2.owner, pi2.plant_location, pi2.plant_type, ph.plant_hum, ph.timestamp as detection_ts, pw.water_quantity, pw.timestamp as watering_ts
-                FROM (
+                FROM """ + self.plant_inventory + """ pi2
+                LEFT JOIN (
                     SELECT ph.plant_id, ph.plant_hum, ph.timestamp
-                    FROM """ + self.plant_history + """ ph 
+                    FROM """ + self.plant_history + """ ph
                     JOIN (
                         SELECT ph_max.plant_id, MAX(ph_max.timestamp) AS max_ts
                         FROM """ + self.plant_history + """ ph_max
                         GROUP BY ph_max.plant_id
-                        ORDER BY ph_max.plant_id
                     ) tt on ph.timestamp = tt.max_ts AND ph.plant_id = tt.plant_id
-                    ORDER BY ph.plant_id 
-                ) ph                
+                ) ph ON ph.plant_id = pi2.plant_id
                 LEFT JOIN (
                     SELECT pw.plant_id, pw.timestamp, pw.water_quantity
                         FROM """ + self.plant_water + """ pw 
@@ -235,10 +409,8 @@ class Database:
                             SELECT pw_max.plant_id, MAX(pw_max.timestamp) AS max_ts
                             FROM """ + self.plant_water + """ pw_max
                             GROUP BY pw_max.plant_id
-                            ORDER BY pw_max.plant_id
                         ) tt on pw.timestamp = tt.max_ts AND pw.plant_id = tt.plant_id
-                    ) pw ON ph.plant_id = pw.plant_id
-                RIGHT JOIN """ + self.plant_inventory + """ pi2 ON ph.plant_id=pi2.plant_id 
+                    ) pw ON pw.plant_id = pi2.plant_id
                 GROUP BY pi2.plant_id
                 ORDER BY pi2.plant_id
         """
@@ -330,6 +502,79 @@ class Database:
         values = (plant_id, humidity, sensor_id)
         return self.insert_values(sql, values)
 
+    def insert_plant_detections(self, detections: list) -> list:
+        """
+        Save a batch of humidity detections with a single multi-row INSERT
+        :param detections: List of (plant_id, humidity, sensor_id, timestamp) tuples
+        :return: The detection IDs, in the same order of the given detections
+        """
+        if not detections:
+            return []
+        sql = """INSERT INTO """ + self.plant_history + """
+                (plant_id, plant_hum, nodemcu_id, timestamp)
+                VALUES """ + ", ".join(["(?, ?, ?, ?)"] * len(detections)) + ";"
+        values = tuple(value for detection in detections for value in detection)
+        aggregates = self.hourly_aggregates(detections)
+        rollup_sql = """INSERT INTO """ + self.plant_history_hourly + """
+                (plant_id, hour_ts, hum_sum, hum_count, hum_min, hum_max)
+                VALUES """ + ", ".join(["(?, ?, ?, ?, ?, ?)"] * len(aggregates)) + """
+                """ + self.backend.upsert(("plant_id", "hour_ts"), self.rollup_merge) + ";"
+        rollup_values = tuple(value for aggregate in aggregates for value in aggregate)
+        lastrowid = self.execute_transaction([(sql, values), (rollup_sql, rollup_values)])[0]
+        return self.backend.inserted_ids(lastrowid, len(detections))
+
+    @staticmethod
+    def hourly_aggregates(detections: list) -> list:
+        """
+        Aggregate a batch of detections by plant and hour
+        :param detections: List of (plant_id, humidity, sensor_id, timestamp) tuples
+        :return: List of (plant_id, hour_ts, hum_sum, hum_count, hum_min, hum_max) tuples
+        """
+        aggregates = {}
+        for plant_id, humidity, _, timestamp in detections:
+            key = (plant_id, timestamp.replace(minute=0, second=0, microsecond=0))
+            current = aggregates.get(key)
+            if current is None:
+                aggregates[key] = [humidity, 1, humidity, humidity]
+            else:
+                current[0] += humidity
+                current[1] += 1
+                current[2] = min(current[2], humidity)
+                current[3] = max(current[3], humidity)
+        return [key + tuple(values) for key, values in aggregates.items()]
+
+    def backfill_hourly_rollup(self, hourly_days: int = 0):
+        """
+        Rebuild the hourly aggregates of the past hours from the raw detections.
+        The current hour is left to the incremental update to not race with the running writer, the hours older than
+        the hourly retention and the days already folded in the daily aggregates are skipped to not count them twice.
+        :param hourly_days: Days of hourly aggregates to keep (0 keeps everything)
+        :return: The number of affected rows
+        """
+        sql = """INSERT INTO """ + self.plant_history_hourly + """
+                (plant_id, hour_ts, hum_sum, hum_count, hum_min, hum_max)
+                SELECT ph.plant_id, """ + self.backend.hour_start("ph.timestamp") + """ AS hour_ts, SUM(ph.plant_hum), COUNT(*), MIN(ph.plant_hum), MAX(ph.plant_hum)
+                FROM """ + self.plant_history + """ ph
+                WHERE ph.timestamp < ? """ + ("AND ph.timestamp >= ?" if hourly_days > 0 else "") + """
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM """ + self.plant_history_daily + """ phd
+                    WHERE phd.plant_id = ph.plant_id AND phd.day = DATE(ph.timestamp)
+                )
+                GROUP BY ph.plant_id, hour_ts
+                """ + self.backend.upsert(("plant_id", "hour_ts"), {column: 'replace' for column in self.rollup_merge}) + ";"
+        parameters = (datetime.datetime.now().replace(minute=0, second=0, microsecond=0),)
+        if hourly_days > 0:
+            parameters += (datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=hourly_days), datetime.time()),)
+        with self.get_connection() as con:
+            cur = con.cursor()
+            cur.execute(sql, parameters)
+            affected = cur.rowcount
+            con.commit()
+            cur.close()
+        self.logging.info(f"Hourly rollup backfilled [{affected} rows]")
+        return affected
+
     def insert_plant_watering(self, plant_id: int, water_quantity: int) -> int | None:
         """
         Insert a watering activity in the DB
@@ -353,6 +598,15 @@ class Database:
         values = (watering_id, )
         return self.insert_values(sql, values)
 
+    def ack_waterings(self, watering_ids: list):
+        """Register several watering confirmations with a single UPDATE"""
+        if not watering_ids:
+            return
+        sql = """UPDATE """ + self.plant_water + """
+                       SET watering_done = TRUE
+                       WHERE watering_id IN (""" + ", ".join(["?"] * len(watering_ids)) + ");"
+        return self.insert_values(sql, tuple(watering_ids))
+
     def insert_values(self, insert_query: str, values: tuple):
         """
         Insert the given values inside the DB
@@ -360,8 +614,7 @@ class Database:
         :param values: The values to insert
         :return: The generated ID
         """
-        with self.dbSemaphore:
-            con = self.get_connection()
+        with QUERY_LATENCY.time("insert_values"), self.get_connection() as con:
             cur = con.cursor()
             cur.execute(insert_query, tuple(values))
             insertion_id = cur.lastrowid
@@ -369,12 +622,29 @@ class Database:
 
             # Free DB resources
             cur.close()
-            self.disconnect()
             return insertion_id
 
+    def execute_transaction(self, statements: list) -> list:
+        """
+        Run several statements in a single transaction
+        :param statements: List of (query, values) tuples
+        :return: The generated ID of each statement
+        """
+        with QUERY_LATENCY.time("execute_transaction"), self.get_connection() as con:
+            cur = con.cursor()
+            ids = []
+            for query, values in statements:
+                cur.execute(query, tuple(values))
+                ids.append(cur.lastrowid)
+            con.commit()
+
+            # Free DB resources
+            cur.close()
+            return ids
+
     def get_values_from_db(self, sql, values=None):
-        with self.dbSemaphore:
-            c = self.get_connection().cursor()
+        with QUERY_LATENCY.time("get_values_from_db"), self.get_read_connection() as con:
+            c = con.cursor()
             if values:
                 c.execute(sql, values)
             else:
@@ -383,7 +653,6 @@ class Database:
             res = c.fetchall()
             # Free DB resources
             c.close()
-            self.disconnect()
 
         # Generate response
         result = []
@@ -394,50 +663,229 @@ class Database:
             result.append(out)
         return result
 
+    def get_columns_from_db(self, sql, values=None):
+        """
+        Run a query returning the values grouped by column, without building a dict per row
+        :param sql: The query to run
+        :param values: The query parameters
+        :return: Dict with the column names and a list of values per column
+        """
+        with QUERY_LATENCY.time("get_columns_from_db"), self.get_read_connection() as con:
+            c = con.cursor()
+            c.execute(sql, values or ())
+            columns = [item[0] for item in c.description]
+            res = c.fetchall()
+            # Free DB resources
+            c.close()
+        if res:
+            data = dict(zip(columns, map(list, zip(*res))))
+        else:
+            data = {column: [] for column in columns}
+        return {'columns': columns, 'data': data}
+
+    def stream_values_from_db(self, sql, values=None, batch_size: int = 1000):
+        """
+        Read a query result a batch at a time from an unbuffered cursor, keeping a connection busy until exhausted or closed
+        :param sql: The query to run
+        :param values: The query parameters
+        :param batch_size: The number of rows fetched at a time
+        :return: Generator of the column names followed by lists of row tuples
+        """
+        with self.get_read_connection() as con:
+            c = self.backend.stream_cursor(con)
+            try:
+                c.execute(sql, values or ())
+                yield [item[0] for item in c.description]
+                while True:
+                    rows = c.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                c.close()
+
+    def stream_plant_history(self, plant_id, since: datetime.datetime, until: datetime.datetime, batch_size: int = 1000):
+        """
+        Stream the raw detections of a time range
+        :param plant_id: The plant ID or None for all the plants
+        :param since: The first detection time (included)
+        :param until: The last detection time (excluded)
+        :param batch_size: The number of rows fetched at a time
+        :return: Generator of the column names followed by lists of row tuples
+        """
+        sql = """SELECT detection_id, plant_id, plant_hum, nodemcu_id, timestamp
+                FROM """ + self.plant_history + """
+                WHERE timestamp >= ? AND timestamp < ?"""
+        parameters = (since, until)
+        if plant_id is not None:
+            sql += " AND plant_id = ?"
+            parameters += (int(plant_id),)
+        sql += " ORDER BY plant_id, timestamp;"
+        return self.stream_values_from_db(sql, parameters, batch_size)
+
     def install(self):
         """
-        Install the DB in a single transaction
-        :return:
+        Bring the DB schema up to date, a single query when there is nothing to migrate
+        :return: True if the schema is up to date
         """
-        with self.dbSemaphore:
-            outcome = self.create_db()
-            self.disconnect()
-            return outcome
+        if self.get_schema_version() >= self.migrations[-1][0]:
+            return True
+        start = time.perf_counter()
+        with self.dbSemaphore, self.backend.schema_lock():
+            CONNECTION_WAIT.observe(time.perf_counter() - start, "install")
+            return self.migrate()
 
     def get_plant_action_summary(self):
         """Get the humidity status of each plant during last 15 minutes and the last watering"""
-        sql = """SELECT ph.plant_id, pi2.plant_name, ROUND(AVG(ph.plant_hum)) AS mean_value, t3.time_elapsed AS last_watering_req, t4.time_elapsed AS last_watering_successful, pi2.default_watering, pi2.plant_location 
+        sql = """SELECT ph.plant_id, pi2.plant_name, ROUND(AVG(ph.plant_hum)) AS mean_value, pw.last_watering_req, pw.last_watering_successful, pi2.default_watering, pi2.plant_location
                 FROM plant_history ph
-                LEFT JOIN plant_inventory pi2 ON ph.plant_id = pi2.plant_id 
+                LEFT JOIN plant_inventory pi2 ON ph.plant_id = pi2.plant_id
                 LEFT JOIN (
-                    SELECT t1.plant_id, t1.water_quantity, TIMEDIFF(NOW(), t1.timestamp) AS time_elapsed
-                    FROM plant_water t1
-                    JOIN (
-                        SELECT plant_id, MAX(timestamp) AS max_timestamp
-                        FROM plant_water 
-                        GROUP BY plant_id
-                    ) t2 ON t1.plant_id = t2.plant_id AND t1.timestamp = t2.max_timestamp
-                ) t3 ON t3.plant_id = ph.plant_id
-                LEFT JOIN (
-                    SELECT t1.plant_id, t1.water_quantity, TIMEDIFF(NOW(), t1.timestamp) AS time_elapsed
-                    FROM plant_water t1
-                    JOIN (
-                        SELECT plant_id, MAX(timestamp) AS max_timestamp
-                        FROM plant_water 
-                        WHERE watering_done = 1
-                        GROUP BY plant_id
-                    ) t2 ON t1.plant_id = t2.plant_id AND t1.timestamp = t2.max_timestamp
-                ) t4 ON t4.plant_id = ph.plant_id
-                WHERE timestamp >= NOW() - INTERVAL 15 MINUTE
+                    SELECT plant_id, MAX(timestamp) AS last_watering_req, MAX(CASE WHEN watering_done = 1 THEN timestamp END) AS last_watering_successful
+                    FROM plant_water
+                    GROUP BY plant_id
+                ) pw ON pw.plant_id = ph.plant_id
+                WHERE ph.timestamp >= ?
                 GROUP BY ph.plant_id;"""
+        # The elapsed times are computed here, the DB engines do not agree on date arithmetic
+        now = datetime.datetime.now()
+        results = self.get_values_from_db(sql, (now - datetime.timedelta(minutes=15),))
+        for result in results:
+            for column in ('last_watering_req', 'last_watering_successful'):
+                last = self.to_datetime(result[column])
+                result[column] = now - last if last is not None else None
+        return results
+
+    @staticmethod
+    def to_datetime(value):
+        """Convert the timestamps computed by an aggregate, returned as text by SQLite"""
+        if isinstance(value, str):
+            return datetime.datetime.fromisoformat(value)
+        return value
+
+    @staticmethod
+    def to_date(value):
+        """Convert the dates computed by DATE(), returned as text by SQLite"""
+        if isinstance(value, str):
+            return datetime.date.fromisoformat(value)
+        return value
+
+    def apply_retention(self, raw_days: int, hourly_days: int) -> dict:
+        """
+        Drop the raw detections older than raw_days and fold the hourly aggregates older than hourly_days in daily aggregates.
+        Raw detections are dropped a whole month partition at a time.
+        :param raw_days: Days of raw detections to keep (0 keeps everything)
+        :param hourly_days: Days of hourly aggregates to keep (0 keeps everything)
+        :return: Rows and bytes reclaimed
+        """
+        report = {'raw_partitions': [], 'raw_rows': 0, 'raw_bytes': 0, 'hourly_rows': 0, 'hourly_bytes': 0}
+        if raw_days > 0 and self.backend.partitioning:
+            cutoff = (datetime.datetime.now() - datetime.timedelta(days=raw_days)).timestamp()
+            expired = [p for p in self.get_history_partitions() if p['bound'] is not None and p['bound'] <= cutoff]
+            if expired:
+                names = [p['name'] for p in expired]
+                if self.create_table("ALTER TABLE " + self.plant_history + " DROP PARTITION " + ", ".join(names) + ";"):
+                    report['raw_partitions'] = names
+                    report['raw_rows'] = sum(int(p['table_rows'] or 0) for p in expired)
+                    report['raw_bytes'] = sum(int(p['bytes'] or 0) for p in expired)
+        elif raw_days > 0:
+            # Without partitions the expired detections are deleted row by row
+            cutoff = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=raw_days), datetime.time())
+            row_length = self.backend.row_bytes(self.plant_history)
+            with self.get_connection() as con:
+                cur = con.cursor()
+                cur.execute("""DELETE FROM """ + self.plant_history + """ WHERE timestamp < ?;""", (cutoff,))
+                report['raw_rows'] = cur.rowcount
+                con.commit()
+                cur.close()
+            report['raw_bytes'] = report['raw_rows'] * row_length
+        if hourly_days > 0:
+            cutoff = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=hourly_days), datetime.time())
+            row_length = self.backend.row_bytes(self.plant_history_hourly)
+            fold_sql = """INSERT INTO """ + self.plant_history_daily + """
+                    (plant_id, day, hum_sum, hum_count, hum_min, hum_max)
+                    SELECT plant_id, DATE(hour_ts) AS day, SUM(hum_sum), SUM(hum_count), MIN(hum_min), MAX(hum_max)
+                    FROM """ + self.plant_history_hourly + """
+                    WHERE hour_ts < ?
+                    GROUP BY plant_id, day
+                    """ + self.backend.upsert(("plant_id", "day"), self.rollup_merge) + ";"
+            delete_sql = """DELETE FROM """ + self.plant_history_hourly + """ WHERE hour_ts < ?;"""
+            with self.get_connection() as con:
+                cur = con.cursor()
+                cur.execute(fold_sql, (cutoff,))
+                cur.execute(delete_sql, (cutoff,))
+                report['hourly_rows'] = cur.rowcount
+                con.commit()
+                cur.close()
+            report['hourly_bytes'] = report['hourly_rows'] * int(row_length)
+        self.logging.info(f"Retention applied - Dropped partitions {report['raw_partitions']} "
+                          f"[{report['raw_rows']} rows - {report['raw_bytes']} bytes] - "
+                          f"Folded {report['hourly_rows']} hourly aggregates [{report['hourly_bytes']} bytes]")
+        return report
+
+    def get_plant_last_waterings(self):
+        """Get the time of the last watering request and of the last successful watering of each plant"""
+        sql = """SELECT plant_id, MAX(timestamp) AS last_watering_req, MAX(CASE WHEN watering_done = 1 THEN timestamp END) AS last_watering_successful
+                FROM """ + self.plant_water + """
+                GROUP BY plant_id;"""
         results = self.get_values_from_db(sql)
+        for result in results:
+            result['last_watering_req'] = self.to_datetime(result['last_watering_req'])
+            result['last_watering_successful'] = self.to_datetime(result['last_watering_successful'])
         return results
 
-    def get_plant_statistics(self, plant_id, duration):
-        sql = """SELECT plant_id, ROUND(AVG(plant_hum)) as 'Value', DATE( timestamp ) as 'Date', HOUR( timestamp ) as 'Hour'
-            FROM plant_history
-            WHERE plant_id = ? AND timestamp > NOW() - INTERVAL ? DAY
-            GROUP BY DATE( timestamp ), HOUR( timestamp )"""
-        parameters = (int(plant_id), int(duration))
+    def get_watering(self, watering_id: int):
+        """
+        Retrieve a watering request
+        :param watering_id: The watering ID
+        :return: The watering or None if missing
+        """
+        sql = """SELECT watering_id, plant_id, water_quantity, watering_done, timestamp
+                FROM """ + self.plant_water + """
+                WHERE watering_id = ?;"""
+        results = self.get_values_from_db(sql, (watering_id,))
+        if len(results) > 0:
+            return results[0]
+        else:
+            self.logging.warning(f"Unknown watering [{watering_id}]")
+            return None
+
+    def get_plant_statistics(self, plant_id, duration, granularity="hour", columnar: bool = False):
+        """
+        Retrieve the mean humidity of a plant from the hourly aggregates
+        :param plant_id: The plant ID
+        :param duration: The number of days to retrieve
+        :param granularity: Aggregate by hour or by day
+        :param columnar: Return the values grouped by column, see get_columns_from_db
+        :return:
+        """
+        since = (datetime.datetime.now() - datetime.timedelta(days=int(duration))).replace(minute=0, second=0, microsecond=0)
+        if granularity == "day":
+            # Days older than the hourly retention are only available in the daily aggregates
+            sql = """SELECT plant_id, ROUND(1.0 * SUM(hum_sum) / SUM(hum_count)) as 'Value', day as 'Date'
+                FROM (
+                    SELECT plant_id, day, hum_sum, hum_count
+                    FROM """ + self.plant_history_daily + """
+                    WHERE plant_id = ? AND day >= ?
+                    UNION ALL
+                    SELECT plant_id, DATE( hour_ts ) AS day, hum_sum, hum_count
+                    FROM """ + self.plant_history_hourly + """
+                    WHERE plant_id = ? AND hour_ts >= ?
+                ) aggregates
+                GROUP BY plant_id, day
+                ORDER BY day"""
+            parameters = (int(plant_id), since.date(), int(plant_id), since)
+        else:
+            sql = """SELECT plant_id, ROUND(1.0 * hum_sum / hum_count) as 'Value', DATE( hour_ts ) as 'Date', """ + self.backend.hour_of("hour_ts") + """ as 'Hour'
+                FROM """ + self.plant_history_hourly + """
+                WHERE plant_id = ? AND hour_ts >= ?
+                ORDER BY hour_ts"""
+            parameters = (int(plant_id), since)
+        if columnar:
+            results = self.get_columns_from_db(sql, parameters)
+            results['data']['Date'] = [self.to_date(value) for value in results['data']['Date']]
+            return results
         results = self.get_values_from_db(sql, parameters)
-        return results
\ No newline at end of file
+        for result in results:
+            result['Date'] = self.to_date(result['Date'])
+        return results
@@ -0,0 +1,118 @@
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+
+class DetectionWriter(threading.Thread):
+    """
+    Buffer the humidity detections and write them to the DB in batches.
+    A batch is flushed when batch_size detections are waiting or the oldest one waited more than max_latency seconds.
+    """
+
+    def __init__(self, log: logging, db, batch_size: int = 100, max_latency: float = 1.0, on_flush=None):
+        super().__init__(daemon=True)
+        self.logging = log
+        self.db = db
+        # Called after each batch is written
+        self.on_flush = on_flush
+        self.batch_size = max(1, batch_size)
+        self.max_latency = max_latency
+        self._buffer = []
+        self._oldest = None
+        self._stopping = False
+        self._condition = threading.Condition()
+
+    def submit(self, plant_id: int, humidity: int, sensor_id: int, timestamp: datetime.datetime = None) -> Future:
+        """
+        Queue a detection for writing
+        :param plant_id: The detected plant
+        :param humidity: The detected soil humidity
+        :param sensor_id: The detection sensor
+        :param timestamp: The detection time, by default the submission time
+        :return: A future resolving to the detection ID
+        """
+        return self.submit_many([(plant_id, humidity, sensor_id, timestamp)])[0]
+
+    def submit_many(self, rows: list) -> list:
+        """
+        Queue several detections, they are written in the same batch
+        :param rows: List of (plant_id, humidity, sensor_id, timestamp) tuples, timestamp may be None
+        :return: The futures resolving to the detection IDs
+        """
+        now = datetime.datetime.now()
+        batch = [((plant_id, humidity, sensor_id, timestamp or now), Future()) for plant_id, humidity, sensor_id, timestamp in rows]
+        with self._condition:
+            if not self._stopping:
+                if not self._buffer:
+                    # Wake up the writer to arm the max latency timer
+                    self._oldest = time.monotonic()
+                    self._condition.notify()
+                self._buffer.extend(batch)
+                if len(self._buffer) >= self.batch_size:
+                    self._condition.notify()
+                return [future for _, future in batch]
+        # Writer already stopped, write synchronously
+        self.flush(batch)
+        return [future for _, future in batch]
+
+    def run(self):
+        self.logging.info("Detection writer started")
+        while True:
+            with self._condition:
+                while not self._stopping and not self._batch_ready():
+                    self._condition.wait(self._time_to_deadline())
+                batch = self._buffer
+                self._buffer = []
+                self._oldest = None
+                stopping = self._stopping
+            if batch:
+                self.flush(batch)
+            if stopping:
+                self.logging.info("Detection writer stopped")
+                return
+
+    def flush(self, batch: list):
+        """
+        Write a batch of detections in a single transaction and resolve their futures
+        :param batch: List of (values, future) tuples
+        :return:
+        """
+        try:
+            ids = self.db.insert_plant_detections([values for values, _ in batch])
+        except Exception as e:
+            self.logging.error(f"Cannot write {len(batch)} detections [{e}]")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.logging.debug(f"Written {len(batch)} detections")
+        if self.on_flush is not None:
+            self.on_flush()
+        for (_, future), detection_id in zip(batch, ids):
+            future.set_result(detection_id)
+
+    def stop(self, timeout: float = None):
+        """
+        Flush the pending detections and stop the writer
+        :param timeout: Seconds to wait for the last flush
+        :return:
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self.is_alive():
+            self.join(timeout)
+
+    def pending(self) -> int:
+        """Number of detections waiting to be written"""
+        with self._condition:
+            return len(self._buffer)
+
+    def _batch_ready(self):
+        return len(self._buffer) >= self.batch_size or (self._buffer and self._time_to_deadline() <= 0)
+
+    def _time_to_deadline(self):
+        if self._oldest is None:
+            return None
+        return self._oldest + self.max_latency - time.monotonic()
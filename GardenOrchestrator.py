@@ -1,16 +1,39 @@
+import csv
 import datetime
+import io
+import json
 import logging
 import os
-import time
+import threading
 import tomllib
+from concurrent.futures import Future
 from unittest.mock import sentinel
 
-import mariadb
 import secrets
+from AsyncDetectionWriter import AsyncDetectionWriter
+from AsyncMqttClient import AsyncMqttClient
+from CircuitBreaker import CircuitBreaker
+from DataVersion import DataVersion
 from Database import Database
+from DetectionWriter import DetectionWriter
+from HumidityTracker import HumidityTracker
+from LatestState import LatestState
+from Metrics import metrics
 from MqttClient import MqttClient
+from MqttPublisher import MqttPublisher
+from PlantRegistry import PlantRegistry
 from Scheduler import Scheduler
-from astral import LocationInfo, sun
+from Spool import Spool
+from StorageBackend import StorageError
+from WateringDispatcher import WateringDispatcher
+from WateringTracker import WateringTracker
+from WateringWindows import WateringWindows
+
+WATERING_CYCLE = metrics.histogram("garden_watering_cycle_seconds", "Duration of the watering evaluation cycles",
+                                   buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600))
+WATERING_ACTIONS = metrics.counter("garden_watering_actions_total", "Watering actions requested by the evaluation cycles")
+WATERING_WATER = metrics.counter("garden_watering_water_ml_total", "Water requested by the evaluation cycles in ml")
+WATERING_SKIPPED = metrics.counter("garden_watering_cycles_skipped_total", "Evaluation cycles skipped while the previous one was running")
 
 
 class GardenOrchestrator:
@@ -36,21 +59,135 @@ class GardenOrchestrator:
         self.initialize_log()
         # Connect to DB
         self.db = self.connect_to_db()
+        self.registry = PlantRegistry(self.logging, self.db)
+        self.registry.load()
+        self.registration_lock = threading.RLock()
+        # Versions of the data behind the status and statistics routes, for conditional requests
+        self.status_version = DataVersion()
+        self.history_version = DataVersion()
+        self.latest_state = LatestState(self.logging, self.registry)
+        self.latest_state.seed(self.db.get_plant_last_detections())
+        self.humidity_tracker = HumidityTracker(self.logging, self.registry)
+        self.humidity_tracker.seed_waterings(self.db.get_plant_last_waterings())
+        self.watering_cycle_lock = threading.Lock()
+        self.watering_windows = WateringWindows(self.logging)
+        self.watering_dispatcher = WateringDispatcher(self.logging, self.transmit_action, self.config['Site'].get('wait_watering', 60))
+        # Detections and watering acks fall back to a local spool while the DB is down or slow
+        self.spool = None
+        if self.config['DB'].get('spool_path'):
+            self.spool = Spool(
+                self.logging,
+                self.db,
+                self.config['DB'].get('spool_path'),
+                CircuitBreaker(
+                    self.logging,
+                    "DB",
+                    failure_threshold=self.config['DB'].get('breaker_failures', 3),
+                    reset_timeout=self.config['DB'].get('breaker_reset', 30),
+                    latency_budget=self.config['DB'].get('latency_budget', 2.0)
+                ),
+                fsync_interval=self.config['DB'].get('spool_fsync_interval', 0.2),
+                fsync_batch=self.config['DB'].get('spool_fsync_batch', 100),
+                replay_batch=self.config['DB'].get('spool_replay_batch', 500),
+                on_replay=self.history_version.bump,
+                rejected_errors=self.db.backend.Rejected
+            )
+            self.spool.start()
+        # Where the ingestion path writes
+        self.ingestion_store = self.spool or self.db
+        self.watering_tracker = WateringTracker(
+            self.logging,
+            self.ingestion_store,
+            ack_timeout=self.config['Site'].get('watering_ack_timeout', 120),
+            batch_size=self.config['DB'].get('ack_batch_size', 50),
+            max_latency=self.config['DB'].get('ack_batch_max_latency', 1.0),
+            on_timeout=self.humidity_tracker.forget_watering
+        )
+        self.watering_tracker.start()
+        # threaded: paho network thread and a pool of handler threads - asyncio: a single event loop
+        self.ingestion = self.config['MQTT'].get('ingestion', 'threaded')
+        # With a shared subscription group the sensor messages are split among all the worker processes of the group
+        self.shared_group = self.config['MQTT'].get('shared_group', '')
+        # standalone: a single process does everything - In a shared group the 'ingestion' workers persist their share
+        # of the messages, while the one 'coordinator' observes all of them to run the watering decisions and the API
+        self.role = self.config['MQTT'].get('role', '') if self.shared_group else 'standalone'
+        if self.role not in ('standalone', 'coordinator', 'ingestion'):
+            self.logging.error(f"Invalid [MQTT] role [{self.role}] - Set 'coordinator' or 'ingestion' with a shared_group")
+            print(f"Invalid [MQTT] role [{self.role}] - Set 'coordinator' or 'ingestion' with a shared_group")
+            exit(1)
+        # Where the workers announce the plants they register, to keep the registries of the others in sync
+        self.registry_topic = self.config['MQTT'].get('registry_topic', 'garden/registry')
+        if self.ingestion == 'asyncio':
+            self.detection_writer = AsyncDetectionWriter(
+                self.logging,
+                self.ingestion_store,
+                batch_size=self.config['DB'].get('batch_size', 100),
+                max_latency=self.config['DB'].get('batch_max_latency', 1.0),
+                on_flush=self.history_version.bump,
+                writers=self.config['DB'].get('async_writers', 2)
+            )
+        else:
+            self.detection_writer = DetectionWriter(
+                self.logging,
+                self.ingestion_store,
+                batch_size=self.config['DB'].get('batch_size', 100),
+                max_latency=self.config['DB'].get('batch_max_latency', 1.0),
+                on_flush=self.history_version.bump
+            )
+        self.detection_writer.start()
         # Connect to MQTT
         try:
-            self.mqttc = MqttClient(self.config['MQTT'], self.logging, self)
-            self.mqttBroker = MqttClient(self.config['MQTT'], self.logging, self)
+            if self.ingestion == 'asyncio':
+                self.mqttc = AsyncMqttClient(self.config['MQTT'], self.logging, self, self.detection_writer.loop)
+            else:
+                self.mqttc = MqttClient(self.config['MQTT'], self.logging, self)
+            self.mqttBroker = MqttPublisher(self.config['MQTT'], self.logging)
             self.mqttc.start()
+            self.mqttBroker.start()
         except (TimeoutError, ValueError) as e:
             if self.config["Site"].get("is_test", False):
                 self.logging.info("Cannot reach MQTT Server - Continuing without MQTT Server ["+str(e)+"]")
             else:
                 self.logging.error("Cannot reach MQTT Server ["+str(e)+"]")
                 exit(1)
+        self.register_gauges()
+
+    def register_gauges(self):
+        """Expose the depth of the internal queues, read only when the metrics are scraped"""
+        metrics.gauge("garden_mqtt_queue_depth", "MQTT messages waiting to be handled", lambda: self.mqttc.stats()['queue_depth'])
+        metrics.gauge("garden_detection_writer_pending", "Detections waiting to be written", self.detection_writer.pending)
+        metrics.gauge("garden_watering_pending", "Watering actions waiting to be sent", lambda: sum(self.watering_dispatcher.pending().values()))
+        metrics.gauge("garden_watering_awaiting_ack", "Watering requests waiting for the sensor ack", self.watering_tracker.pending)
+        metrics.gauge("garden_plants", "Plants in the inventory", lambda: len(self.registry.get_plants()))
+        if self.spool is not None:
+            metrics.gauge("garden_spool_backlog_bytes", "Spooled bytes waiting to be replayed to the DB", self.spool.backlog)
+            metrics.gauge("garden_db_circuit_open", "1 while the DB writes go to the spool", lambda: 0 if self.spool.breaker.is_closed() else 1)
+
+    def get_metrics(self):
+        """Retrieve all the metrics in the Prometheus text format"""
+        return metrics.render()
+
+    def shutdown(self):
+        """
+        Flush the pending work before exiting
+        :return:
+        """
+        self.logging.info("Garden Sericloud - Shutting down")
+        # Stop receiving first, the last messages still produce detections
+        if hasattr(self, 'mqttc'):
+            self.mqttc.stop()
+        self.detection_writer.stop()
+        self.watering_tracker.stop()
+        if self.spool is not None:
+            self.spool.stop()
+        self.mqttBroker.stop()
 
     def setScheduler(self):
         recurrence = self.config['Site'].get('recurrence', 15)
-        return Scheduler(self.logging, recurrence, self)
+        registry_refresh = self.config['Site'].get('registry_refresh', 60)
+        maintenance_time = self.config.get('Retention', {}).get('run_at', "03:30")
+        max_idle = self.config['Site'].get('max_idle', 60)
+        return Scheduler(self.logging, recurrence, self, registry_refresh, maintenance_time, max_idle)
 
     def install(self):
         """
@@ -77,19 +214,109 @@ class GardenOrchestrator:
         :param plant_type: The plant type
         :return:
         """
-        return self.db.insert_new_plant(sensor_id, plant_name, plant_num, owner, plant_location, plant_type)
+        with self.registration_lock:
+            try:
+                plant_id = self.db.insert_new_plant(sensor_id, plant_name, plant_num, owner, plant_location, plant_type)
+            except self.db.backend.Error as e:
+                # Each sensor plant number is unique, another worker may have registered it first
+                self.logging.warning(f"Cannot insert plant [📡{sensor_id}#{plant_num}] [{e}]")
+                return None
+            self.register_plant(plant_id)
+        if self.shared_group and hasattr(self, 'mqttBroker'):
+            self.mqttBroker.send_message(self.registry_topic, f"r_{plant_id}")
+        return plant_id
 
-    def add_detection(self, plant_id: int, humidity: int, sensor_id: int):
+    def register_plant(self, plant_id: int):
+        """
+        Load a newly inserted plant in the registry
+        :param plant_id: The plant ID
+        :return:
+        """
+        plant = self.db.get_plant(plant_id)
+        if plant:
+            self.registry.add(plant)
+            self.status_version.bump()
+
+    def sync_plant(self, plant_id: int):
+        """
+        Load a plant registered by another worker
+        :param plant_id: The plant ID
+        :return:
+        """
+        if not self.registry.known_plant(plant_id):
+            self.logging.info(f"Plant #{plant_id} registered by another worker")
+        self.register_plant(plant_id)
+
+    def refresh_registry(self):
+        """Reload the whole plant inventory in the registry"""
+        # Avoid losing a plant registered while the inventory is being reloaded
+        with self.registration_lock:
+            plants = self.registry.load()
+        self.status_version.bump()
+        self.logging.info(f"Plant registry refreshed [{plants} plants]")
+
+    def add_detection(self, plant_id: int, humidity: int, sensor_id: int, timestamp: datetime.datetime = None):
         """
         Insert a humidity detection received from a sensor
         :param plant_id: The monitored plant
         :param humidity: The detected humidity
         :param sensor_id: The sensor that is sending the measure
-        :return:
+        :param timestamp: The detection time reported by the sensor, by default the reception time
+        :return: A future resolving to the detection ID once the detection is written
         """
         self.logging.debug("Adding detection")
+        if plant_id is None:
+            # A single invalid row would make the whole batch fail
+            self.logging.warning(f"Discarding detection without plant - sensor: {sensor_id}")
+            future = Future()
+            future.set_result(None)
+            return future
+        now = datetime.datetime.now()
+        # Sensor clocks may drift ahead, never store detections from the future
+        timestamp = min(timestamp, now) if timestamp is not None else now
+        self.latest_state.update_detection(plant_id, humidity, timestamp)
+        self.status_version.bump()
+        self.humidity_tracker.add_detection(plant_id, humidity, timestamp)
+        if self.role == 'coordinator':
+            return self.observed()
+        return self.detection_writer.submit(plant_id, humidity, sensor_id, timestamp)
+
+    def observed(self, count: int = None):
+        """
+        Skip the persistence of the detections observed by the coordinator, the ingestion workers write them
+        :param count: The number of detections, None for a single one
+        :return: The future, or list of futures, of a detection not written by this process
+        """
+        # No flush here bumps the history version, the statistics would keep answering 304
+        self.history_version.bump()
+        future = Future()
+        future.set_result(None)
+        return future if count is None else [future] * count
 
-        return self.db.insert_plant_detection(plant_id, humidity, sensor_id)
+    def add_detections(self, sensor_id: int, detections: list):
+        """
+        Insert the humidity detections of several plants received in a single sensor message
+        :param sensor_id: The sensor that is sending the measures
+        :param detections: List of (plant_id, humidity, timestamp) tuples, timestamp may be None
+        :return: The futures resolving to the detection IDs, written in the same transaction
+        """
+        now = datetime.datetime.now()
+        rows = []
+        futures = []
+        for plant_id, humidity, timestamp in detections:
+            if plant_id is None:
+                self.logging.warning(f"Discarding detection without plant - sensor: {sensor_id}")
+                continue
+            timestamp = min(timestamp, now) if timestamp is not None else now
+            self.latest_state.update_detection(plant_id, humidity, timestamp)
+            self.humidity_tracker.add_detection(plant_id, humidity, timestamp)
+            rows.append((plant_id, humidity, sensor_id, timestamp))
+        if rows:
+            self.status_version.bump()
+            if self.role == 'coordinator':
+                return self.observed(len(rows))
+            futures = self.detection_writer.submit_many(rows)
+        return futures
 
     def add_water(self, plant_id, water_quantity):
         """
@@ -111,22 +338,106 @@ class GardenOrchestrator:
             return None
 
     def add_sensor(self, sensor_id):
+        if self.shared_group:
+            # Already covered by the wildcard subscription
+            self.logging.info(f"New sensor #{sensor_id} connected")
+            return
         self.logging.info(f"Subscribing to the topic of the new sensor #{sensor_id}")
         print(f"Subscribing to the topic of the new sensor #{sensor_id}")
         self.mqttc.new_subscription(f"sensor/{sensor_id}")
 
     def ack_watering(self, watering_id: int):
-        return self.db.ack_watering(watering_id)
-
-    def get_plant_recap(self):
+        """
+        Confirm a watering, its persistence is batched by the watering tracker
+        :param watering_id: The acknowledged watering
+        :return:
+        """
+        request = self.watering_tracker.ack(watering_id)
+        if request is not None:
+            self.humidity_tracker.ack_watering(watering_id, request['plant_id'], request['requested_at'])
+        elif not self.humidity_tracker.ack_watering(watering_id) and (self.spool is None or self.spool.breaker.is_closed()):
+            # Watering requested before the last start, or timed out
+            watering = self.db.get_watering(watering_id)
+            if watering:
+                self.humidity_tracker.ack_watering(watering_id, watering['plant_id'], watering['timestamp'])
+        return True
+
+    def get_ingestion_stats(self):
+        """Retrieve the MQTT ingestion queue depth and handling latency"""
+        return self.mqttc.stats()
+
+    def get_plant_recap(self, columnar: bool = False):
         self.logging.debug("Getting recap")
-        status = self.db.get_plant_last_detections()
-        return status
+        if columnar:
+            return self.latest_state.recap_columns()
+        return self.latest_state.recap()
 
-    def get_plant_statistics(self, plant_id, duration):
-        status = self.db.get_plant_statistics(plant_id, duration)
+    def get_plant_statistics(self, plant_id, duration, granularity="hour", columnar: bool = False):
+        status = self.db.get_plant_statistics(plant_id, duration, granularity, columnar)
         return status
 
+    def export_history(self, plant_id, since: datetime.datetime, until: datetime.datetime, export_format: str = "csv"):
+        """
+        Export the raw detections of a time range, a DB batch at a time so that memory use does not grow with the range
+        :param plant_id: The plant ID or None for all the plants
+        :param since: The first detection time (included)
+        :param until: The last detection time (excluded)
+        :param export_format: csv or ndjson
+        :return: Generator of text chunks
+        """
+        if export_format not in ("csv", "ndjson"):
+            raise ValueError(f"Unsupported export format [{export_format}]")
+        batch_size = self.config['DB'].get('export_batch_size', 1000)
+        return self.format_export(self.db.stream_plant_history(plant_id, since, until, batch_size), export_format)
+
+    @staticmethod
+    def format_export(stream, export_format: str):
+        """
+        Serialize the streamed rows, a chunk per DB batch
+        :param stream: Generator of the column names followed by lists of row tuples
+        :param export_format: csv or ndjson
+        :return: Generator of text chunks
+        """
+        columns = next(stream)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        if export_format == "csv":
+            writer.writerow(columns)
+        for rows in stream:
+            for row in rows:
+                row = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in row]
+                if export_format == "csv":
+                    writer.writerow(row)
+                else:
+                    buffer.write(json.dumps(dict(zip(columns, row))) + "\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # Only the CSV header is left when there are no detections
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def maintain_history(self):
+        """
+        Prepare the next monthly partitions and apply the retention policy
+        :return: Rows and bytes reclaimed
+        """
+        retention = self.config.get('Retention', {})
+        self.db.ensure_history_partitions()
+        report = self.db.apply_retention(retention.get('raw_days', 0), retention.get('hourly_days', 0))
+        self.history_version.bump()
+        return report
+
+    def backfill_statistics(self):
+        """
+        Rebuild the hourly statistics from the detection history
+        :return: The number of hourly aggregates written
+        """
+        retention = self.config.get('Retention', {})
+        rows = self.db.backfill_hourly_rollup(retention.get('hourly_days', 0))
+        self.history_version.bump()
+        return rows
+
     def get_port(self):
         """Retrieve the port for the service"""
         port = self.config.get('Site').get('port') or 5000
@@ -161,7 +472,7 @@ class GardenOrchestrator:
         """Connect to backend DB"""
         try:
             return Database(self.config['DB'], self.logging)
-        except mariadb.Error as e:
+        except StorageError as e:
             self.logging.error("Cannot connect to DB [" + str(e) + "]")
             print("Cannot connect to DB [" + str(e) + "]")
             exit(1)
@@ -172,11 +483,22 @@ class GardenOrchestrator:
         return allowed
 
     def evaluate_watering(self):
-        # Get action to execute based on time, humidity, default humidity
-        actions = self.elaborate_watering()
-        # Communicate to sensors to water plant if needed
-        used_water = self.transmit_actions(actions)
-        return {'actions': len(actions), 'water': used_water}
+        # A single evaluation cycle at a time, the next one starts from the updated watering requests
+        if not self.watering_cycle_lock.acquire(blocking=False):
+            self.logging.warning("Previous watering cycle still running - Skipping evaluation")
+            WATERING_SKIPPED.inc()
+            return {'actions': 0, 'water': 0}
+        try:
+            with WATERING_CYCLE.time():
+                # Get action to execute based on time, humidity, default humidity
+                actions = self.elaborate_watering()
+                # Communicate to sensors to water plant if needed
+                used_water = self.transmit_actions(actions)
+            WATERING_ACTIONS.inc(amount=len(actions))
+            WATERING_WATER.inc(amount=used_water)
+            return {'actions': len(actions), 'water': used_water}
+        finally:
+            self.watering_cycle_lock.release()
 
     def elaborate_watering(self):
         """
@@ -184,7 +506,13 @@ class GardenOrchestrator:
         :return:
         """
         actions = []
-        summary = self.db.get_plant_action_summary()
+        if self.humidity_tracker.is_warm():
+            summary = self.humidity_tracker.summary()
+        else:
+            # Not enough detections received since the start
+            summary = self.db.get_plant_action_summary()
+            # The acks are written in batches, the DB may miss the latest ones
+            self.humidity_tracker.merge_waterings(summary)
         for plant_summary in summary:
             # Extract variables
             plant_id = plant_summary.get('plant_id')
@@ -218,58 +546,88 @@ class GardenOrchestrator:
         :param actions:
         :return:
         """
-        water = 0
-        for action in actions:
-            # Get parameters
-            plant_id = action['plant_id']
-            plant_name = action['plant_name']
-            water_quantity = action.get('water_quantity', 100)
-            # Request watering
-            self.logging.info("Requesting " + str(water_quantity) + "ml of water for plant [" + plant_name + "/#" + str(plant_id) + "]")
-            if not self.config["Site"].get("is_test", False):
-                self.add_water(plant_id, water_quantity)
-            else:
-                self.logging.info("TEST ENVIRONMENT - Watering not requested")
-            water += water_quantity
-            time.sleep(self.config['Site'].get('wait_watering', 60))
+        water = sum(action.get('water_quantity', 100) for action in actions)
+        # Plants sharing a sensor share the pump, so only they have to wait for each other
+        self.watering_dispatcher.dispatch(actions, lambda action: self.registry.get_reference(action['plant_id'])[0])
         return water
 
+    def transmit_action(self, action: dict):
+        """
+        Send a single watering request, executed by the watering dispatcher
+        :param action:
+        :return:
+        """
+        # Get parameters
+        plant_id = action['plant_id']
+        plant_name = action['plant_name']
+        water_quantity = action.get('water_quantity', 100)
+        # Request watering
+        self.logging.info("Requesting " + str(water_quantity) + "ml of water for plant [" + plant_name + "/#" + str(plant_id) + "]")
+        if not self.config["Site"].get("is_test", False):
+            self.add_water(plant_id, water_quantity)
+        else:
+            self.logging.info("TEST ENVIRONMENT - Watering not requested")
+
     def get_all_plant_id(self):
         """
         Retrieve all the plant id in the inventory
         :return:
         """
-        values = self.db.get_all_plant_id()
-        if not values:
-            return []
-        else:
-            return [d['plant_id'] for d in values]
+        return [plant['plant_id'] for plant in self.registry.get_plants()]
 
     def get_all_sensor_id(self):
         """
-        Retrieve all the plant id in the inventory
+        Retrieve all the sensor id in the inventory
         :return:
         """
-        values = self.db.get_all_sensor_id()
-        if not values:
-            return []
-        else:
-            return [d['nodemcu_id'] for d in values]
+        return self.registry.get_sensor_ids()
 
     def get_plant_id(self, sensor_id, plant_num):
-        plant_id = self.db.get_plant_id(sensor_id, plant_num)
+        plant_id = self.registry.get_plant_id(sensor_id, plant_num)
         if not plant_id:
-            self.logging.info(f"Registering a new plant [📡{sensor_id}#{plant_num}]")
-            print(f"Registering a new plant [📡{sensor_id}#{plant_num}]")
-            plant_id = self.db.insert_new_plant(sensor_id, f"New Plant [📡{sensor_id}#{plant_num}]", plant_num, "", "", "")
+            with self.registration_lock:
+                # Another thread may have registered the plant in the meantime
+                plant_id = self.registry.get_plant_id(sensor_id, plant_num)
+                if not plant_id:
+                    self.logging.info(f"Registering a new plant [📡{sensor_id}#{plant_num}]")
+                    print(f"Registering a new plant [📡{sensor_id}#{plant_num}]")
+                    plant_id = self.add_plant(f"New Plant [📡{sensor_id}#{plant_num}]", sensor_id, plant_num, "", "", "")
+                    if not plant_id:
+                        # Registered by another worker in the meantime
+                        plant_id = self.db.get_plant_id(sensor_id, plant_num)
+                        if plant_id:
+                            self.register_plant(plant_id)
         return plant_id
 
+    def get_plant_ids(self, sensor_id, plant_nums):
+        """
+        Resolve several plants of a sensor at once, registering the unknown ones
+        :return: A dict plant_num -> plant ID
+        """
+        plant_ids = self.registry.get_plant_ids(sensor_id, plant_nums)
+        for plant_num, plant_id in plant_ids.items():
+            if not plant_id:
+                plant_ids[plant_num] = self.get_plant_id(sensor_id, plant_num)
+        return plant_ids
+
     def request_watering(self, plant_id: int, water_quantity: int):
         """Register the watering request and send the MQTT message"""
-        sensor_id, plant_num = self.db.get_plant_id_reference(plant_id)
+        sensor_id, plant_num = self.registry.get_reference(plant_id)
         watering_id = self.db.insert_plant_watering(plant_id, water_quantity)
+        requested_at = datetime.datetime.now()
+        self.latest_state.update_watering(plant_id, water_quantity, requested_at)
+        self.status_version.bump()
+        self.humidity_tracker.add_watering_request(plant_id, watering_id, requested_at)
         water_time = self.elaborate_water_time(water_quantity)
-        return self.mqttBroker.send_message("water2/" + str(sensor_id), "w_"+str(watering_id)+"_"+str(water_time)+"_"+str(plant_num))
+        self.watering_tracker.request(watering_id, plant_id, water_time, requested_at)
+        sent = self.mqttBroker.send_message(
+            "water2/" + str(sensor_id),
+            "w_"+str(watering_id)+"_"+str(water_time)+"_"+str(plant_num),
+            wait_for_ack=self.config['MQTT'].get('publish_ack_timeout')
+        )
+        if sent:
+            self.watering_tracker.published(watering_id)
+        return sent
 
     @staticmethod
     def elaborate_water_time(water_quantity):
@@ -289,35 +647,26 @@ class GardenOrchestrator:
 
     def is_watering_time(self, current_location):
         """Check if it's night"""
-        start_watering, end_watering = self.get_current_location_times(current_location)
-        # self.logging.debug("Watering time starts:" + str(start_watering) + "- Watering time ends:" + str(end_watering))
-        return self.time_in_range(start_watering, end_watering, datetime.datetime.now().time())
-
-    @staticmethod
-    def time_in_range(start, end, x):
-        """Return true if x is in the range [start, end]"""
-        if start <= end:
-            return start <= x <= end
-        else:
-            return start <= x or x <= end
+        return self.watering_windows.is_watering_time(current_location)
 
     def get_current_location_times(self, current_location):
         """From geolocation get information on today sunrise and sunset"""
-        default_sunset = datetime.time(23, 0, 0)
-        default_sunrise = datetime.time(7, 0, 0)
-        if not current_location:
-            self.logging.info("Missing plant location - Using default time")
-            return default_sunset, default_sunrise
-        else:
-            try:
-                city = LocationInfo(current_location)
-                s = sun.sun(city.observer, date=datetime.datetime.now().astimezone())
-                sunrise = s['sunrise'].astimezone().time()
-                sunset = s['sunset'].astimezone().time()
-                return sunset, sunrise
-            except:
-                self.logging.warning("Cannot retrieve info base on current location - Default value provided")
-                return default_sunset, default_sunrise
+        return self.watering_windows.get(current_location)
+
+    def next_watering_time(self, now: datetime.datetime = None):
+        """
+        Retrieve when the first watering window of the plant locations opens
+        :param now: The local time, by default the current time
+        :return: now if a window is already open, None without plants
+        """
+        now = now or datetime.datetime.now()
+        starts = [self.watering_windows.next_start(location, now) for location in {plant['plant_location'] for plant in self.registry.get_plants()}]
+        return min(starts, default=None)
+
+    def prefetch_watering_windows(self):
+        """Compute tomorrow watering windows of all the plant locations ahead of midnight"""
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        self.watering_windows.prefetch([plant['plant_location'] for plant in self.registry.get_plants()], tomorrow)
 
     @staticmethod
     def time_to_water(last_watering, last_request):
@@ -0,0 +1,141 @@
+import datetime
+import logging
+import threading
+from collections import deque
+
+
+class HumidityTracker:
+    """
+    Rolling window of the humidity detections and last watering times of each plant, fed by the ingestion path.
+    It provides the same summary of Database.get_plant_action_summary without querying the DB,
+    once it has been running for a whole window.
+    """
+
+    def __init__(self, log: logging, registry, window_minutes: int = 15):
+        self.logging = log
+        self.registry = registry
+        self.window = datetime.timedelta(minutes=window_minutes)
+        self.started_at = datetime.datetime.now()
+        self._lock = threading.Lock()
+        self._readings = {}
+        self._totals = {}
+        self._last_request = {}
+        self._last_watering = {}
+        self._waterings = {}
+
+    def seed_waterings(self, waterings: list):
+        """
+        Load the last watering times from the DB
+        :param waterings: Rows with plant_id, last_watering_req and last_watering_successful timestamps
+        :return:
+        """
+        with self._lock:
+            for row in waterings or []:
+                if row['last_watering_req'] is not None:
+                    self._last_request[row['plant_id']] = row['last_watering_req']
+                if row['last_watering_successful'] is not None:
+                    self._last_watering[row['plant_id']] = row['last_watering_successful']
+
+    def is_warm(self, now: datetime.datetime = None) -> bool:
+        """Check if the tracker has seen a whole window of detections"""
+        return (now or datetime.datetime.now()) >= self.started_at + self.window
+
+    def add_detection(self, plant_id: int, humidity: int, timestamp: datetime.datetime):
+        with self._lock:
+            readings = self._readings.get(plant_id)
+            if readings is None:
+                readings = self._readings[plant_id] = deque()
+                self._totals[plant_id] = [0, 0]
+            if readings and timestamp < readings[-1][0]:
+                # Sensor timestamps and spool replays arrive out of order, the readings are kept sorted for _expire
+                if timestamp < readings[-1][0] - self.window:
+                    return
+                position = len(readings) - 1
+                while position > 0 and readings[position - 1][0] > timestamp:
+                    position -= 1
+                readings.insert(position, (timestamp, humidity))
+            else:
+                readings.append((timestamp, humidity))
+            totals = self._totals[plant_id]
+            totals[0] += humidity
+            totals[1] += 1
+            self._expire(plant_id, readings[-1][0] - self.window)
+
+    def add_watering_request(self, plant_id: int, watering_id: int, timestamp: datetime.datetime):
+        with self._lock:
+            self._waterings[watering_id] = (plant_id, timestamp)
+            self._last_request[plant_id] = max(timestamp, self._last_request.get(plant_id, timestamp))
+
+    def forget_watering(self, watering_id: int):
+        """Drop a watering request that timed out, a late ack is resolved like the requests made before the start"""
+        with self._lock:
+            self._waterings.pop(watering_id, None)
+
+    def ack_watering(self, watering_id: int, plant_id: int = None, requested_at: datetime.datetime = None):
+        """
+        Register a successful watering, identified by the time it was requested
+        :param watering_id: The acknowledged watering
+        :param plant_id: The watered plant, needed only for requests made before the start
+        :param requested_at: The request time, needed only for requests made before the start
+        :return: False if the watering request is unknown
+        """
+        with self._lock:
+            request = self._waterings.pop(watering_id, None)
+            if request is None:
+                if plant_id is None or requested_at is None:
+                    return False
+                request = (plant_id, requested_at)
+            plant_id, requested_at = request
+            self._last_watering[plant_id] = max(requested_at, self._last_watering.get(plant_id, requested_at))
+            return True
+
+    def merge_waterings(self, summary: list, now: datetime.datetime = None):
+        """
+        Update the elapsed watering times of a summary read from the DB with the more recent ones known here
+        :param summary: Rows of Database.get_plant_action_summary, updated in place
+        :return:
+        """
+        now = now or datetime.datetime.now()
+        with self._lock:
+            for row in summary:
+                for column, last_times in (('last_watering_req', self._last_request), ('last_watering_successful', self._last_watering)):
+                    last = last_times.get(row['plant_id'])
+                    if last is not None and (row[column] is None or now - last < row[column]):
+                        row[column] = now - last
+
+    def summary(self, now: datetime.datetime = None) -> list:
+        """
+        Retrieve the mean humidity of the last window and the time elapsed from the last watering of each plant
+        :return: The same rows of Database.get_plant_action_summary
+        """
+        now = now or datetime.datetime.now()
+        results = []
+        with self._lock:
+            for plant_id in list(self._readings):
+                self._expire(plant_id, now - self.window)
+                humidity_sum, count = self._totals[plant_id]
+                plant = self.registry.get_plant(plant_id)
+                if count == 0 or plant is None:
+                    continue
+                last_request = self._last_request.get(plant_id)
+                last_watering = self._last_watering.get(plant_id)
+                results.append({
+                    'plant_id': plant_id,
+                    'plant_name': plant['plant_name'],
+                    # Round half up like SQL ROUND
+                    'mean_value': int(humidity_sum / count + 0.5),
+                    'last_watering_req': now - last_request if last_request is not None else None,
+                    'last_watering_successful': now - last_watering if last_watering is not None else None,
+                    'default_watering': plant['default_watering'],
+                    'plant_location': plant['plant_location']
+                })
+        return results
+
+    def _expire(self, plant_id: int, oldest: datetime.datetime):
+        """Remove the readings older than the window (lock held)"""
+        readings = self._readings[plant_id]
+        totals = self._totals[plant_id]
+        while readings and readings[0][0] < oldest:
+            _, humidity = readings.popleft()
+            totals[0] -= humidity
+            totals[1] -= 1
@@ -0,0 +1,94 @@
+import datetime
+import logging
+import threading
+
+
+class LatestState:
+    """
+    Materialized view of the last detection and the last watering of each plant.
+    It is seeded once from the DB and then kept up to date by the ingestion and watering paths.
+    """
+
+    def __init__(self, log: logging, registry):
+        self.logging = log
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def seed(self, recap: list):
+        """
+        Load the initial state from the DB recap
+        :param recap: The rows returned by Database.get_plant_last_detections
+        :return:
+        """
+        state = {}
+        for row in recap or []:
+            state[row['plant_id']] = {
+                'plant_hum': row['plant_hum'],
+                'detection_ts': row['detection_ts'],
+                'water_quantity': row['water_quantity'],
+                'watering_ts': row['watering_ts']
+            }
+        with self._lock:
+            self._state = state
+        self.logging.debug(f"Latest state seeded for {len(state)} plants")
+
+    def update_detection(self, plant_id: int, humidity: int, timestamp: datetime.datetime):
+        """Register a new humidity detection, older detections are ignored"""
+        with self._lock:
+            current = self._plant_state(plant_id)
+            if current['detection_ts'] is None or current['detection_ts'] <= timestamp:
+                current['plant_hum'] = humidity
+                current['detection_ts'] = timestamp
+
+    def update_watering(self, plant_id: int, water_quantity: int, timestamp: datetime.datetime):
+        """Register a new watering request, older requests are ignored"""
+        with self._lock:
+            current = self._plant_state(plant_id)
+            if current['watering_ts'] is None or current['watering_ts'] <= timestamp:
+                current['water_quantity'] = water_quantity
+                current['watering_ts'] = timestamp
+
+    def recap(self):
+        """
+        Retrieve the recap of all plants, with the same fields of Database.get_plant_last_detections
+        :return:
+        """
+        plants = self.registry.get_plants()
+        if not plants:
+            return None
+        empty = {'plant_hum': None, 'detection_ts': None, 'water_quantity': None, 'watering_ts': None}
+        with self._lock:
+            states = [dict(self._state.get(plant['plant_id'], empty)) for plant in plants]
+        return [{
+            'plant_id': plant['plant_id'],
+            'plant_name': plant['plant_name'],
+            'nodemcu_id': plant['nodemcu_id'],
+            'owner': plant['owner'],
+            'plant_location': plant['plant_location'],
+            'plant_type': plant['plant_type'],
+            **state
+        } for plant, state in zip(plants, states)]
+
+    def recap_columns(self):
+        """
+        Retrieve the recap of all plants grouped by column, without building a dict per plant
+        :return: Dict with the column names and a list of values per column
+        """
+        plants = self.registry.get_plants() or []
+        inventory_columns = ['plant_id', 'plant_name', 'nodemcu_id', 'owner', 'plant_location', 'plant_type']
+        state_columns = ['plant_hum', 'detection_ts', 'water_quantity', 'watering_ts']
+        data = {column: [plant[column] for plant in plants] for column in inventory_columns}
+        with self._lock:
+            states = [self._state.get(plant['plant_id']) for plant in plants]
+            for column in state_columns:
+                data[column] = [state[column] if state is not None else None for state in states]
+        return {'columns': inventory_columns + state_columns, 'data': data}
+
+    def _plant_state(self, plant_id: int):
+        """Get the state of a plant creating it if missing (lock held)"""
+        current = self._state.get(plant_id)
+        if current is None:
+            current = {'plant_hum': None, 'detection_ts': None, 'water_quantity': None, 'watering_ts': None}
+            self._state[plant_id] = current
+        return current
@@ -0,0 +1,204 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+import mariadb
+
+from ConnectionPool import ConnectionPool
+from StorageBackend import StorageBackend, StorageError
+
+
+class MariaDBBackend(StorageBackend):
+    """MariaDB server accessed through a pool of connections shared by readers and writers"""
+    name = "mariadb"
+    partitioning = True
+    Error = mariadb.Error
+    Rejected = (mariadb.DataError, mariadb.IntegrityError)
+    schema = {
+        "plant_inventory": """CREATE TABLE IF NOT EXISTS plant_inventory (
+                    plant_id INT auto_increment NOT NULL,
+                    plant_name varchar(256) NULL,
+                    plant_num INT NULL,
+                    nodemcu_id INT NULL,
+                    owner varchar(256) NULL,
+                    plant_location varchar(256) NULL,
+                    plant_type varchar(256) NULL,
+                    default_watering int(11) NOT NULL DEFAULT 150 COMMENT 'The default watering value',
+                    CONSTRAINT plant_id_PK PRIMARY KEY (plant_id)
+                )
+                ENGINE=InnoDB
+                DEFAULT CHARSET=utf8mb4
+                COLLATE=utf8mb4_general_ci
+                COMMENT='The list of my plant';""",
+        "plant_history": """CREATE TABLE IF NOT EXISTS plant_history (
+                    detection_id BIGINT auto_increment NOT NULL,
+                    plant_id INT NOT NULL,
+                    plant_hum INT NOT NULL,
+                    nodemcu_id INT NULL,
+                    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    CONSTRAINT detection_id_PK PRIMARY KEY (detection_id, timestamp)
+                )
+                ENGINE=InnoDB
+                DEFAULT CHARSET=utf8mb4
+                COLLATE=utf8mb4_general_ci
+                COMMENT='The last detections of plant soil humidity';""",
+        "plant_water": """CREATE TABLE IF NOT EXISTS plant_water (
+                    watering_id INT auto_increment NOT NULL,
+                    plant_id INT NOT NULL,
+                    water_quantity INT NOT NULL,
+                    watering_done BOOL NOT NULL DEFAULT FALSE,
+                    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    CONSTRAINT watering_id_PK PRIMARY KEY (watering_id)
+                )
+                ENGINE=InnoDB
+                DEFAULT CHARSET=utf8mb4
+                COLLATE=utf8mb4_general_ci
+                COMMENT='The last watering done';""",
+        "plant_history_hourly": """CREATE TABLE IF NOT EXISTS plant_history_hourly (
+                    plant_id INT NOT NULL,
+                    hour_ts DATETIME NOT NULL,
+                    hum_sum BIGINT NOT NULL,
+                    hum_count INT NOT NULL,
+                    hum_min INT NOT NULL,
+                    hum_max INT NOT NULL,
+                    CONSTRAINT plant_history_hourly_PK PRIMARY KEY (plant_id, hour_ts)
+                )
+                ENGINE=InnoDB
+                DEFAULT CHARSET=utf8mb4
+                COLLATE=utf8mb4_general_ci
+                COMMENT='The hourly aggregates of plant soil humidity';""",
+        "plant_history_daily": """CREATE TABLE IF NOT EXISTS plant_history_daily (
+                    plant_id INT NOT NULL,
+                    day DATE NOT NULL,
+                    hum_sum BIGINT NOT NULL,
+                    hum_count INT NOT NULL,
+                    hum_min INT NOT NULL,
+                    hum_max INT NOT NULL,
+                    CONSTRAINT plant_history_daily_PK PRIMARY KEY (plant_id, day)
+                )
+                ENGINE=InnoDB
+                DEFAULT CHARSET=utf8mb4
+                COLLATE=utf8mb4_general_ci
+                COMMENT='The daily aggregates of plant soil humidity';""",
+        "schema_version": """CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT NOT NULL,
+                    description varchar(256) NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+                    CONSTRAINT schema_version_PK PRIMARY KEY (version)
+                )
+                ENGINE=InnoDB
+                DEFAULT CHARSET=utf8mb4
+                COLLATE=utf8mb4_general_ci
+                COMMENT='The applied schema migrations';"""
+    }
+    # Named lock shared by all the processes connected to the server
+    schema_lock_name = "garden_schema_migration"
+    merge_functions = {
+        'add': "{column} = {column} + VALUES({column})",
+        'min': "{column} = LEAST({column}, VALUES({column}))",
+        'max': "{column} = GREATEST({column}, VALUES({column}))",
+        'replace': "{column} = VALUES({column})"
+    }
+
+    def __init__(self, config, log: logging):
+        super().__init__(config, log)
+        self.pool = ConnectionPool(
+            self._connect,
+            self.logging,
+            min_size=self.config.get('pool_min_size', 1),
+            max_size=self.config.get('pool_max_size', 5),
+            idle_timeout=self.config.get('pool_idle_timeout', 300),
+            health_check_interval=self.config.get('pool_health_check_interval', 30),
+            acquire_timeout=self.config.get('pool_acquire_timeout', 10)
+        )
+        # The connection holding the schema lock, reused by the migrations of the same thread
+        self._pinned = threading.local()
+
+    def _connect(self):
+        """
+        Try to get DB connection
+        :return: The DB connection
+        """
+        try:
+            conn = mariadb.connect(
+                user=self.config.get('db_user'),
+                password=self.config.get('db_password'),
+                host=self.config.get('db_host'),
+                port=self.config.get('db_port'),
+                database=self.config.get('db_name')
+            )
+            return conn
+        except mariadb.Error as e:
+            print(f"Error connecting to MariaDB Platform: {e}")
+            self.logging.error("Cannot log in to MariaDB")
+            raise StorageError(str(e)) from e
+
+    def read_connection(self):
+        return self._borrow()
+
+    def write_connection(self):
+        return self._borrow()
+
+    def _borrow(self):
+        con = getattr(self._pinned, 'con', None)
+        if con is not None:
+            return self._reuse(con)
+        return self.pool.connection()
+
+    @staticmethod
+    @contextmanager
+    def _reuse(con):
+        """Lend the pinned connection, it goes back to the pool only when the schema lock is released"""
+        yield con
+
+    def close(self):
+        self.pool.close()
+
+    @contextmanager
+    def schema_lock(self):
+        """
+        Hold the server named lock while migrating. The migrations run on the connection holding it,
+        borrowing a second one would deadlock a pool of a single connection.
+        """
+        with self.pool.connection() as con:
+            cur = con.cursor()
+            cur.execute("SELECT GET_LOCK(?, ?);", (self.schema_lock_name, self.config.get('schema_lock_timeout', 60)))
+            if cur.fetchone()[0] != 1:
+                cur.close()
+                raise StorageError("Timeout waiting for the schema migration lock")
+            self._pinned.con = con
+            try:
+                yield
+            finally:
+                self._pinned.con = None
+                cur.execute("SELECT RELEASE_LOCK(?);", (self.schema_lock_name,))
+                cur.fetchone()
+                cur.close()
+
+    def stream_cursor(self, con):
+        return con.cursor(buffered=False)
+
+    def upsert(self, keys: tuple, updates: dict) -> str:
+        return "ON DUPLICATE KEY UPDATE " + ", ".join(
+            self.merge_functions[merge].format(column=column) for column, merge in updates.items()
+        )
+
+    def hour_start(self, column: str) -> str:
+        return f"TIMESTAMP(DATE({column}), MAKETIME(HOUR({column}), 0, 0))"
+
+    def hour_of(self, column: str) -> str:
+        return f"HOUR({column})"
+
+    def inserted_ids(self, lastrowid: int, count: int) -> list:
+        # InnoDB assigns consecutive IDs to the rows of a single multi-row INSERT and reports the first one
+        return list(range(lastrowid, lastrowid + count))
+
+    def row_bytes(self, table: str) -> int:
+        sql = """SELECT AVG_ROW_LENGTH FROM information_schema.TABLES
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ?;"""
+        with self.read_connection() as con:
+            cur = con.cursor()
+            cur.execute(sql, (table,))
+            row = cur.fetchone()
+            cur.close()
+        return int(row[0] or 0) if row else 0
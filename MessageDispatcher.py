@@ -0,0 +1,134 @@
+import logging
+import queue
+import threading
+import time
+
+
+class MessageDispatcher:
+    """
+    Hand the received MQTT messages to a fixed pool of worker threads through a bounded queue.
+    When the queue is full the overload policy decides what happens:
+    - block: wait for a free slot (back pressure on the MQTT network loop)
+    - drop_oldest: discard the oldest queued message to make room
+    - drop_newest: discard the incoming message
+    """
+    policies = ("block", "drop_oldest", "drop_newest")
+
+    def __init__(self, log: logging, handler, workers: int = 4, queue_size: int = 1000, overload_policy: str = "block"):
+        """
+        :param log: The logger
+        :param handler: Callable invoked as handler(message, topic) by the workers
+        :param workers: The number of worker threads
+        :param queue_size: The maximum number of messages waiting to be handled
+        :param overload_policy: One of block, drop_oldest, drop_newest
+        """
+        if overload_policy not in self.policies:
+            raise ValueError(f"Unknown overload policy [{overload_policy}]")
+        self.logging = log
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.overload_policy = overload_policy
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self._threads = []
+        self._stats_lock = threading.Lock()
+        self._received = 0
+        self._handled = 0
+        self._failed = 0
+        self._dropped = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def start(self):
+        for i in range(self.workers):
+            worker = threading.Thread(target=self._work, name=f"mqtt-worker-{i}", daemon=True)
+            worker.start()
+            self._threads.append(worker)
+        self.logging.info(f"Message dispatcher started with {self.workers} workers")
+
+    def stop(self, timeout: float = None):
+        """
+        Stop the workers once the queued messages have been handled
+        :param timeout: Seconds to wait for each worker
+        :return:
+        """
+        for _ in self._threads:
+            self.queue.put(None)
+        for worker in self._threads:
+            worker.join(timeout)
+        self._threads = []
+
+    def submit(self, message, topic: str) -> bool:
+        """
+        Queue a message for handling
+        :param message: The message payload
+        :param topic: The topic the message was received on
+        :return: False if the message has been dropped
+        """
+        item = (time.monotonic(), message, topic)
+        with self._stats_lock:
+            self._received += 1
+        if self.overload_policy == "block":
+            self.queue.put(item)
+            return True
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except queue.Full:
+                if self.overload_policy == "drop_newest":
+                    self._drop(topic)
+                    return False
+            try:
+                _, _, dropped_topic = self.queue.get_nowait()
+                self.queue.task_done()
+                self._drop(dropped_topic)
+            except queue.Empty:
+                pass
+
+    def stats(self) -> dict:
+        """
+        Retrieve queue depth and handling latency (from reception to handling completion)
+        :return:
+        """
+        with self._stats_lock:
+            completed = self._handled + self._failed
+            return {
+                'workers': self.workers,
+                'queue_depth': self.queue.qsize(),
+                'queue_size': self.queue.maxsize,
+                'overload_policy': self.overload_policy,
+                'received': self._received,
+                'handled': self._handled,
+                'failed': self._failed,
+                'dropped': self._dropped,
+                'latency_avg_ms': round(self._latency_total / completed * 1000, 3) if completed else 0.0,
+                'latency_max_ms': round(self._latency_max * 1000, 3)
+            }
+
+    def _drop(self, topic: str):
+        with self._stats_lock:
+            self._dropped += 1
+        self.logging.warning(f"Message queue full - Dropped message from topic {topic}")
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            received, message, topic = item
+            failed = False
+            try:
+                self.handler(message, topic)
+            except Exception as e:
+                failed = True
+                self.logging.error(f"Cannot handle message from topic {topic} [{e}]")
+            latency = time.monotonic() - received
+            with self._stats_lock:
+                if failed:
+                    self._failed += 1
+                else:
+                    self._handled += 1
+                self._latency_total += latency
+                self._latency_max = max(self._latency_max, latency)
+            self.queue.task_done()
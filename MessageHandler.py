@@ -1,11 +1,24 @@
 import logging
-from threading import Thread
 
+from BinaryPayload import BinaryPayload
+from Metrics import metrics
 
-class MessageHandler(Thread):
+MESSAGES_RECEIVED = metrics.counter("garden_mqtt_messages_received_total", "MQTT messages handled, by method", ("method",))
+MESSAGES_PARSED = metrics.counter("garden_mqtt_messages_parsed_total", "MQTT messages parsed successfully, by method", ("method",))
+MESSAGES_REJECTED = metrics.counter("garden_mqtt_messages_rejected_total", "MQTT messages rejected as invalid, by method", ("method",))
+SEQUENCE_GAPS = metrics.counter("garden_mqtt_sequence_gaps_total", "Binary messages missed according to the sensor sequence numbers")
+SEQUENCE_DUPLICATES = metrics.counter("garden_mqtt_sequence_duplicates_total", "Binary messages discarded as repeated")
 
-    def __init__(self, log: logging, message: str, topic: str, go):
-        super().__init__()
+
+class RegistrationRequired(Exception):
+    """Raised, before any side effect, when a message refers to an unknown plant and the handler must not register it"""
+
+
+class MessageHandler:
+    methods = ("d", "d2", "w", "s", "b", "r")
+
+    def __init__(self, log: logging, message, topic: str, go, register_unknown: bool = True):
+        self.method = "invalid"
         self.message_values = 0
         self.plant_id = None
         self.sensor_id = None
@@ -13,19 +26,42 @@ class MessageHandler(Thread):
         self.topic = topic
         self.message = message
         self.go = go
+        # Registering a plant blocks on the DB and the broker, the event loop leaves it to a thread
+        self.register_unknown = register_unknown
 
     def run(self):
+        deferred = False
         try:
             self.parse_topic()
             self.parse_message()
+            MESSAGES_PARSED.inc(self.method)
+        except RegistrationRequired:
+            # The message is handled again by a handler allowed to register, and counted there
+            deferred = True
+            raise
         except ValueError as e:
+            MESSAGES_REJECTED.inc(self.method)
             self.logging.warning("Cannot parse this message [" + str(e) + "]")
+        finally:
+            if not deferred:
+                MESSAGES_RECEIVED.inc(self.method)
+
+    @staticmethod
+    def method_of(message) -> str:
+        """Peek the method of a text or binary message without parsing it"""
+        if isinstance(message, bytes):
+            return BinaryPayload.method_of(message)
+        return message.split('_', 1)[0].lower()
 
     def parse_message(self):
-        print("Parso il messaggio dal topic: " + str(self.topic) + ": " + str(self.message))
+        if isinstance(self.message, bytes):
+            self.parse_binary()
+            return
         tokens = self.message.split('_')
         if self.valid_tokens(tokens):
             method = tokens[0]
+            # Unknown methods share a label to keep the metrics bounded
+            self.method = method.lower() if method.lower() in self.methods else "unknown"
             if method.lower() == "d":
                 self.manage_plant_detection(tokens)
             elif method.lower() == "d2":
@@ -34,6 +70,10 @@ class MessageHandler(Thread):
                 self.manage_watering_ack(tokens)
             elif method.lower() == "s":
                 self.manage_greeting(tokens)
+            elif method.lower() == "b":
+                self.manage_batch_detection(tokens)
+            elif method.lower() == "r":
+                self.manage_registry_event(tokens)
             else:
                 self.logging.warning("Unkown method [" + str(method) + "]")
                 raise ValueError("Unkown method")
@@ -41,12 +81,42 @@ class MessageHandler(Thread):
             self.logging.warning("Invalid message received [" + str(self.message) + "]")
             raise ValueError("Invalid message received")
 
+    def parse_binary(self):
+        """Apply a binary message, see BinaryPayload for the layout"""
+        message = BinaryPayload.decode(self.message)
+        self.method = message['method']
+        if self.method == "s":
+            self.greet(message['sensor_id'])
+            return
+        if self.method == "d2":
+            self.require_known([message['plant_num']])
+        elif self.method == "b":
+            self.require_known([plant_num for plant_num, _ in message['readings']])
+        if self.sensor_id is not None:
+            missed = BinaryPayload.track_sequence(self.sensor_id, message['sequence'])
+            if missed < 0:
+                SEQUENCE_DUPLICATES.inc()
+                self.logging.info(f"Discarding repeated message #{message['sequence']} - sensor: {self.sensor_id}")
+                return
+            if missed:
+                SEQUENCE_GAPS.inc(amount=missed)
+                self.logging.warning(f"Missed {missed} messages, still missing {BinaryPayload.SEQUENCE_WINDOW} behind #{message['sequence']} - sensor: {self.sensor_id}")
+        if self.method == "d2":
+            self.detect(message['plant_num'], message['humidity'], message['timestamp'])
+        elif self.method == "b":
+            self.detect_batch(message['readings'], message['timestamp'])
+        else:
+            self.go.ack_watering(message['watering_id'])
+            self.logging.debug(f"Confirmed watering #{message['watering_id']}")
+
     def parse_topic(self):
         try:
             if self.topic.startswith("sensor/"):
                 self.sensor_id = int(self.topic.replace('sensor/', ''))
             elif self.topic.startswith("greeting"):
                 self.logging.info("Greeting message")
+            elif self.topic == self.go.registry_topic:
+                self.logging.debug("Registry message")
             else:
                 self.logging.warning(f"Unexpected topic {self.topic}")
                 print(f"Unexpected topic {self.topic}")
@@ -60,30 +130,108 @@ class MessageHandler(Thread):
 
     def manage_greeting(self, tokens):
         if self.message_values == 2:
-            self.sensor_id = int(tokens[1])
-            if self.sensor_id in self.go.get_all_sensor_id():
-                self.logging.info(f"Sensor #{self.sensor_id} restarted")
-            else:
-                self.logging.info(f"New sensor [#{self.sensor_id}] connected. Start listening on its topic")
-                self.go.add_sensor(self.sensor_id)
+            self.greet(int(tokens[1]))
         else:
             self.logging.warning("Cannot manage this message as a watering ack: [" + str(self.message) + "]")
             raise ValueError("Cannot manage this message as a watering ack")
 
     def manage_sensor_detection(self, tokens):
         if self.message_values == 3:
-            humidity = int(tokens[1])
-            plant_num = int(tokens[2])
-            self.plant_id = self.go.get_plant_id(self.sensor_id, plant_num)
-            if humidity < 140:
-                det_id = self.go.add_detection(self.plant_id, humidity, self.sensor_id)
-                self.logging.debug(f"Added detection [{det_id}] - plant_id {self.plant_id} - hum: {humidity} - sensor: {self.sensor_id}")
-            else:
-                self.logging.warning(f"Cable disconnected? Invalid humidity value [{humidity}] for plant_num [{self.plant_id}] - sensor [{self.sensor_id}]")
+            self.detect(int(tokens[2]), int(tokens[1]))
         else:
             self.logging.warning(f"Cannot manage this message as a watering ack: [{self.message}]")
             raise ValueError("Cannot manage this message as a watering ack")
 
+    def greet(self, sensor_id: int):
+        self.sensor_id = sensor_id
+        # A restarted sensor counts its messages from scratch, whichever protocol it greets with
+        missed = BinaryPayload.reset_sequence(sensor_id)
+        if missed:
+            SEQUENCE_GAPS.inc(amount=missed)
+            self.logging.warning(f"Missed {missed} messages before the restart - sensor: {sensor_id}")
+        if self.sensor_id in self.go.get_all_sensor_id():
+            self.logging.info(f"Sensor #{self.sensor_id} restarted")
+        else:
+            self.logging.info(f"New sensor [#{self.sensor_id}] connected. Start listening on its topic")
+            self.go.add_sensor(self.sensor_id)
+
+    def require_known(self, plant_nums: list):
+        """
+        Stop before any side effect if a plant of the sending sensor is not registered yet and the handler must not register it
+        :param plant_nums: The plant numbers on the sensor
+        :return:
+        """
+        if self.register_unknown:
+            return
+        plant_ids = self.go.registry.get_plant_ids(self.sensor_id, plant_nums)
+        if not all(plant_ids.values()):
+            raise RegistrationRequired(f"Unknown plant of sensor {self.sensor_id}")
+
+    def detect(self, plant_num: int, humidity: int, timestamp=None):
+        """
+        Queue the detection of a plant of the sending sensor
+        :param plant_num: The plant number on the sensor
+        :param humidity: The detected humidity
+        :param timestamp: The detection time reported by the sensor, if any
+        :return:
+        """
+        self.require_known([plant_num])
+        self.plant_id = self.go.get_plant_id(self.sensor_id, plant_num)
+        if 0 <= humidity < 140:
+            self.go.add_detection(self.plant_id, humidity, self.sensor_id, timestamp)
+            self.logging.debug(f"Queued detection - plant_id {self.plant_id} - hum: {humidity} - sensor: {self.sensor_id}")
+        else:
+            self.logging.warning(f"Cable disconnected? Invalid humidity value [{humidity}] for plant_num [{self.plant_id}] - sensor [{self.sensor_id}]")
+
+    def detect_batch(self, readings: list, timestamp=None):
+        """
+        Queue the detections of several plants of the sending sensor, resolved and written together
+        :param readings: List of (plant_num, humidity) tuples
+        :param timestamp: The detection time reported by the sensor, if any
+        :return:
+        """
+        self.require_known([plant_num for plant_num, _ in readings])
+        plant_ids = self.go.get_plant_ids(self.sensor_id, [plant_num for plant_num, _ in readings])
+        detections = []
+        for plant_num, humidity in readings:
+            if 0 <= humidity < 140:
+                detections.append((plant_ids[plant_num], humidity, timestamp))
+            else:
+                self.logging.warning(f"Cable disconnected? Invalid humidity value [{humidity}] for plant_num [{plant_num}] - sensor [{self.sensor_id}]")
+        if detections:
+            self.go.add_detections(self.sensor_id, detections)
+            self.logging.debug(f"Queued {len(detections)} detections - sensor: {self.sensor_id}")
+
+    def manage_batch_detection(self, tokens):
+        """
+        Queue the detections sent as b_<plant_num>:<humidity>,<plant_num>:<humidity>,...
+        :param tokens:
+        :return:
+        """
+        if self.message_values == 2 and tokens[1]:
+            readings = []
+            for reading in tokens[1].split(','):
+                plant_num, separator, humidity = reading.partition(':')
+                if not separator:
+                    raise ValueError(f"Invalid batch reading [{reading}]")
+                readings.append((int(plant_num), int(humidity)))
+            self.detect_batch(readings)
+        else:
+            self.logging.warning(f"Cannot manage this message as a batch of detections: [{self.message}]")
+            raise ValueError("Cannot manage this message as a batch of detections")
+
+    def manage_registry_event(self, tokens):
+        """
+        Load a plant registered by another worker, announced as r_<plant_id> on the registry topic
+        :param tokens:
+        :return:
+        """
+        if self.message_values == 2 and self.topic == self.go.registry_topic:
+            self.go.sync_plant(int(tokens[1]))
+        else:
+            self.logging.warning(f"Cannot manage this message as a registry event: [{self.message}]")
+            raise ValueError("Cannot manage this message as a registry event")
+
     def manage_watering_ack(self, tokens):
         """
         Confirm a watering action
@@ -103,8 +251,8 @@ class MessageHandler(Thread):
         if self.message_values == 3:
             humidity = int(tokens[1])
             sensor_id = int(tokens[2])
-            det_id = self.go.add_detection(self.plant_id, humidity, sensor_id)
-            self.logging.debug("Added detection [" + str(det_id) + "] - plant_id " + str(self.plant_id) + " - hum: " + str(humidity) + " - sensor: " + str(sensor_id))
+            self.go.add_detection(self.plant_id, humidity, sensor_id)
+            self.logging.debug("Queued detection - plant_id " + str(self.plant_id) + " - hum: " + str(humidity) + " - sensor: " + str(sensor_id))
         else:
             self.logging.warning("Cannot manage this message as a detection: [" + str(self.message) + "]")
             raise ValueError("Cannot manage this message as a detection")
@@ -0,0 +1,156 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Counter:
+    """Monotonic counter, one value per combination of label values"""
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in sorted(values):
+            yield self.name, self.label_pairs(label_values), value
+
+    def label_pairs(self, label_values: tuple) -> list:
+        return list(zip(self.labels, label_values))
+
+
+class Histogram(Counter):
+    """Distribution of observed values over fixed buckets, one per combination of label values"""
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values):
+        # Only the bucket containing the value is increased, the cumulative counts are built on scrape
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observe the duration of the with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def count(self, *label_values) -> int:
+        series = self._values.get(label_values)
+        return series[2] if series else 0
+
+    def samples(self):
+        with self._lock:
+            values = [(label_values, (list(series[0]), series[1], series[2])) for label_values, series in self._values.items()]
+        for label_values, (buckets, total, count) in sorted(values):
+            pairs = self.label_pairs(label_values)
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), buckets):
+                cumulative += bucket
+                yield self.name + "_bucket", pairs + [("le", format_value(bound))], cumulative
+            yield self.name + "_sum", pairs, total
+            yield self.name + "_count", pairs, count
+
+
+class Gauge(Counter):
+    """Current value read from a callback when scraped, so that keeping it updated costs nothing"""
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, callback):
+        super().__init__(name, description)
+        self.callback = callback
+
+    def samples(self):
+        yield self.name, [], self.callback()
+
+
+class Metrics:
+    """Registry of the metrics exposed in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def counter(self, name: str, description: str, labels: tuple = ()) -> Counter:
+        return self._register(Counter(name, description, labels))
+
+    def histogram(self, name: str, description: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def gauge(self, name: str, description: str, callback) -> Gauge:
+        """Register a gauge, replacing the previous one with the same name"""
+        gauge = Gauge(name, description, callback)
+        with self._lock:
+            self._metrics[name] = gauge
+        return gauge
+
+    def _register(self, metric):
+        with self._lock:
+            # Instruments are shared by all the instances of the class declaring them
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        """
+        Serialize all the metrics
+        :return: The Prometheus text exposition
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                for name, pairs, value in metric.samples():
+                    lines.append(name + format_labels(pairs) + " " + format_value(value))
+            except Exception:
+                # A failing gauge callback must not break the whole scrape
+                continue
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(pairs: list) -> str:
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+# Registry shared by the whole application
+metrics = Metrics()
@@ -2,7 +2,9 @@ import logging
 
 import paho.mqtt.client as mqtt
 from socket import gaierror
-from MessageHandler import MessageHandler
+from MessageDispatcher import MessageDispatcher
+from BinaryPayload import BinaryPayload
+from MessageHandler import MessageHandler, RegistrationRequired
 
 
 class MqttClient:
@@ -11,10 +13,28 @@ class MqttClient:
         self.logging = log
         self.config = config
         self.go = go
+        # Split the sensor messages with the other workers of the group, see [MQTT] shared_group
+        self.shared_group = self.config.get("shared_group", "")
+        # The coordinator of the group receives every message, the ingestion workers register the new plants
+        self.coordinator = bool(self.shared_group) and self.config.get("role") == "coordinator"
         self.client = mqtt.Client()
+        self.dispatcher = MessageDispatcher(
+            self.logging,
+            self.handle_message,
+            workers=self.config.get("workers", 4),
+            queue_size=self.config.get("queue_size", 1000),
+            overload_policy=self.config.get("overload_policy", "block")
+        )
 
     def on_connect(self, client, userdata, flags, rc):
         print("Connected with result code " + str(rc))
+        if self.shared_group:
+            # The wildcard covers also the sensors not registered yet, no need to know them
+            prefix = "" if self.coordinator else f"$share/{self.shared_group}/"
+            self.subscribe(client, prefix + "greeting")
+            self.subscribe(client, prefix + "sensor/+")
+            self.subscribe(client, self.config.get("registry_topic", "garden/registry"))
+            return
         # Subscribe
         client.subscribe("greeting")
         # Subscribe to all existing sensors
@@ -31,12 +51,34 @@ class MqttClient:
 
     def on_message(self, client, userdata, msg):
         self.logging.info("Received message")
-        m = MessageHandler(self.logging, msg.payload.decode('utf-8'), msg.topic, self.go)
-        m.start()
+        self.dispatcher.submit(BinaryPayload.decode_payload(msg.payload), msg.topic)
+
+    def handle_message(self, message, topic: str):
+        """Parse and apply a message, executed by the dispatcher workers"""
+        try:
+            MessageHandler(self.logging, message, topic, self.go, register_unknown=not self.coordinator).run()
+        except RegistrationRequired:
+            # The worker receiving the same message registers the plant and announces it on the registry topic
+            self.logging.debug(f"Skipping a message of an unregistered plant from {topic}")
+
+    def stats(self) -> dict:
+        return {'mode': "threaded", **self.dispatcher.stats()}
+
+    def stop(self, timeout: float = None):
+        """
+        Stop receiving and handle the queued messages
+        :param timeout: Seconds to wait for each worker
+        :return:
+        """
+        self.client.disconnect()
+        self.client.loop_stop()
+        self.dispatcher.stop(timeout)
+        self.logging.info("MQTT client stopped")
 
     def start(self):
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        self.dispatcher.start()
         try:
             self.client.connect(self.config.get("host"), self.config.get("port"), self.config.get("keepalive"))
             self.logging.info("MQTT client connected")
@@ -50,19 +92,3 @@ class MqttClient:
             self.logging.error("Host: [" + str(self.config.get("host")) + "] not found")
             print("Host not found")
             exit(1)
-
-    def send_message(self, topic: str, payload: str):
-        try:
-            self.client.connect(self.config.get("host"), self.config.get("port"), self.config.get("keepalive"))
-            self.logging.info("MQTT broker connected")
-            self.client.publish(topic, payload)
-            self.client.disconnect()
-            self.logging.info("Disconnect after message send")
-            return True
-        except ConnectionRefusedError as e:
-            self.logging.warning("Cannot connect to MQTT host: " + str(self.config.get("host")) + ":" + str(self.config.get("port")))
-            print("Cannot connect to MQTT host: " + str(self.config.get("host")) + ":" + str(self.config.get("port")) + " - Message probably not sent")
-        except gaierror:
-            self.logging.error("Host: [" + str(self.config.get("host")) + "] not found")
-            print("Host not found - Message probably not sent")
-        return False
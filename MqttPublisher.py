@@ -0,0 +1,93 @@
+import logging
+import threading
+
+import paho.mqtt.client as mqtt
+
+
+class MqttPublisher:
+    """
+    Long-lived MQTT session used to send the commands to the sensors.
+    The session runs its own network loop and reconnects with an exponential backoff,
+    publishing never waits for the broker unless an ack timeout is requested.
+    """
+
+    def __init__(self, config, log: logging):
+        self.logging = log
+        self.config = config
+        self.qos = self.config.get("publish_qos", 1)
+        self.connected = threading.Event()
+        self._inflight = {}
+        self._lock = threading.RLock()
+        self.client = mqtt.Client()
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_publish = self.on_publish
+        self.client.reconnect_delay_set(
+            min_delay=self.config.get("reconnect_min_delay", 1),
+            max_delay=self.config.get("reconnect_max_delay", 120)
+        )
+
+    def start(self):
+        """
+        Open the session in background, the network loop keeps retrying until the broker is reachable
+        :return:
+        """
+        self.client.connect_async(self.config.get("host"), self.config.get("port"), self.config.get("keepalive"))
+        self.client.loop_start()
+        self.logging.info("MQTT publisher started")
+
+    def stop(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+        self.logging.info("MQTT publisher stopped")
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.connected.set()
+            self.logging.info("MQTT publisher connected")
+        else:
+            self.logging.warning(f"MQTT publisher connection refused [{mqtt.connack_string(rc)}]")
+
+    def on_disconnect(self, client, userdata, rc):
+        self.connected.clear()
+        if rc != 0:
+            self.logging.warning(f"MQTT publisher disconnected [{mqtt.error_string(rc)}] - Reconnecting")
+
+    def on_publish(self, client, userdata, mid):
+        with self._lock:
+            delivered = self._inflight.pop(mid, None)
+        if delivered is not None:
+            delivered.set()
+
+    def send_message(self, topic: str, payload: str, wait_for_ack: float = None):
+        """
+        Publish a message on the persistent session
+        :param topic: The destination topic
+        :param payload: The message
+        :param wait_for_ack: Seconds to wait for the broker PUBACK, by default do not wait
+        :return: True if the message has been queued (or acknowledged when waiting for the PUBACK)
+        """
+        with self._lock:
+            info = self.client.publish(topic, payload, qos=self.qos)
+            # With QoS > 0 paho keeps the message and sends it once the session is back
+            queued = info.rc == mqtt.MQTT_ERR_SUCCESS or (info.rc == mqtt.MQTT_ERR_NO_CONN and self.qos > 0)
+            if not queued:
+                self.logging.warning(f"Cannot publish message on {topic} [{mqtt.error_string(info.rc)}]")
+                return False
+            delivered = None
+            if self.qos > 0:
+                delivered = threading.Event()
+                self._inflight[info.mid] = delivered
+        if info.rc == mqtt.MQTT_ERR_NO_CONN:
+            self.logging.info(f"MQTT broker not connected - Message on {topic} will be sent on reconnection")
+        if wait_for_ack is None or delivered is None:
+            return True
+        if delivered.wait(wait_for_ack):
+            return True
+        self.logging.warning(f"No PUBACK received for message on {topic} after {wait_for_ack}s")
+        return False
+
+    def inflight(self) -> int:
+        """Number of QoS > 0 messages not yet acknowledged by the broker"""
+        with self._lock:
+            return len(self._inflight)
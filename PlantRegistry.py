@@ -0,0 +1,97 @@
+import logging
+import threading
+
+
+class PlantRegistry:
+    """
+    In-memory copy of the plant inventory, used to resolve plants without querying the DB.
+    The whole inventory is reloaded by load(), new plants are added with add().
+    """
+
+    def __init__(self, log: logging, db):
+        self.logging = log
+        self.db = db
+        self._lock = threading.Lock()
+        self._plants = {}
+        self._by_reference = {}
+        self._sensors = set()
+
+    def load(self):
+        """
+        Reload the whole plant inventory from the DB
+        :return: The number of plants loaded
+        """
+        plants = {}
+        by_reference = {}
+        sensors = set()
+        for plant in self.db.get_plant_inventory() or []:
+            self._index(plant, plants, by_reference, sensors)
+        with self._lock:
+            self._plants = plants
+            self._by_reference = by_reference
+            self._sensors = sensors
+        self.logging.debug(f"Plant registry loaded with {len(plants)} plants")
+        return len(plants)
+
+    def add(self, plant: dict):
+        """
+        Add or update a single plant
+        :param plant: The plant_inventory row
+        :return:
+        """
+        with self._lock:
+            previous = self._plants.get(plant['plant_id'])
+            if previous is not None:
+                self._by_reference.pop((previous['nodemcu_id'], previous['plant_num']), None)
+            self._index(plant, self._plants, self._by_reference, self._sensors)
+            if previous is not None and previous['nodemcu_id'] != plant['nodemcu_id'] \
+                    and all(other['nodemcu_id'] != previous['nodemcu_id'] for other in self._plants.values()):
+                # The plant moved away from the last one it had on its previous sensor
+                self._sensors.discard(previous['nodemcu_id'])
+
+    def get_plant_id(self, sensor_id, plant_num):
+        """
+        Retrieve the plant monitored by a sensor
+        :return: The plant ID or None if the plant is unknown
+        """
+        return self._by_reference.get((sensor_id, plant_num))
+
+    def get_plant_ids(self, sensor_id, plant_nums):
+        """
+        Retrieve several plants monitored by a sensor
+        :return: A dict plant_num -> plant ID, None for the unknown plants
+        """
+        by_reference = self._by_reference
+        return {plant_num: by_reference.get((sensor_id, plant_num)) for plant_num in plant_nums}
+
+    def get_reference(self, plant_id):
+        """
+        Retrieve sensor and plant number of a plant
+        :return: The (sensor_id, plant_num) tuple or (None, None) if the plant is unknown
+        """
+        plant = self._plants.get(plant_id)
+        if plant is None:
+            return None, None
+        return plant['nodemcu_id'], plant['plant_num']
+
+    def get_plant(self, plant_id):
+        return self._plants.get(plant_id)
+
+    def get_plants(self):
+        """Retrieve all the plants ordered by plant ID"""
+        with self._lock:
+            return [self._plants[plant_id] for plant_id in sorted(self._plants)]
+
+    def get_sensor_ids(self):
+        with self._lock:
+            return sorted(self._sensors)
+
+    def known_plant(self, plant_id) -> bool:
+        return plant_id in self._plants
+
+    @staticmethod
+    def _index(plant: dict, plants: dict, by_reference: dict, sensors: set):
+        plants[plant['plant_id']] = plant
+        by_reference[(plant['nodemcu_id'], plant['plant_num'])] = plant['plant_id']
+        if plant['nodemcu_id'] is not None:
+            sensors.add(plant['nodemcu_id'])
@@ -0,0 +1,170 @@
+import datetime
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from ConnectionPool import ConnectionPool
+from StorageBackend import StorageBackend, StorageError
+
+# Store timestamps as local time ISO strings, the same values MariaDB returns
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(" "))
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.datetime.fromisoformat(value.decode()))
+sqlite3.register_converter("DATETIME", lambda value: datetime.datetime.fromisoformat(value.decode()))
+sqlite3.register_converter("DATE", lambda value: datetime.date.fromisoformat(value.decode()))
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Embedded SQLite database in WAL mode: a single writer connection serialized by a lock
+    and a pool of read-only connections reading concurrently with the writer.
+    """
+    name = "sqlite"
+    partitioning = False
+    Error = sqlite3.Error
+    Rejected = (sqlite3.DataError, sqlite3.IntegrityError)
+    schema = {
+        "plant_inventory": """CREATE TABLE IF NOT EXISTS plant_inventory (
+                    plant_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    plant_name VARCHAR(256) NULL,
+                    plant_num INT NULL,
+                    nodemcu_id INT NULL,
+                    owner VARCHAR(256) NULL,
+                    plant_location VARCHAR(256) NULL,
+                    plant_type VARCHAR(256) NULL,
+                    default_watering INT NOT NULL DEFAULT 150
+                );""",
+        "plant_history": """CREATE TABLE IF NOT EXISTS plant_history (
+                    detection_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    plant_id INT NOT NULL,
+                    plant_hum INT NOT NULL,
+                    nodemcu_id INT NULL,
+                    timestamp TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime'))
+                );""",
+        "plant_water": """CREATE TABLE IF NOT EXISTS plant_water (
+                    watering_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    plant_id INT NOT NULL,
+                    water_quantity INT NOT NULL,
+                    watering_done BOOL NOT NULL DEFAULT FALSE,
+                    timestamp TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime'))
+                );""",
+        "plant_history_hourly": """CREATE TABLE IF NOT EXISTS plant_history_hourly (
+                    plant_id INT NOT NULL,
+                    hour_ts DATETIME NOT NULL,
+                    hum_sum BIGINT NOT NULL,
+                    hum_count INT NOT NULL,
+                    hum_min INT NOT NULL,
+                    hum_max INT NOT NULL,
+                    PRIMARY KEY (plant_id, hour_ts)
+                );""",
+        "plant_history_daily": """CREATE TABLE IF NOT EXISTS plant_history_daily (
+                    plant_id INT NOT NULL,
+                    day DATE NOT NULL,
+                    hum_sum BIGINT NOT NULL,
+                    hum_count INT NOT NULL,
+                    hum_min INT NOT NULL,
+                    hum_max INT NOT NULL,
+                    PRIMARY KEY (plant_id, day)
+                );""",
+        "schema_version": """CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    description VARCHAR(256) NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );"""
+    }
+    merge_functions = {
+        'add': "{column} = {column} + excluded.{column}",
+        'min': "{column} = MIN({column}, excluded.{column})",
+        'max': "{column} = MAX({column}, excluded.{column})",
+        'replace': "{column} = excluded.{column}"
+    }
+
+    def __init__(self, config, log: logging):
+        super().__init__(config, log)
+        self.path = self.config.get('sqlite_path', 'Config/garden.db')
+        self._write_lock = threading.Lock()
+        self._writer = self._connect(read_only=False)
+        if self.path == ":memory:":
+            # A private in-memory DB is visible only to its own connection
+            self.pool = None
+        else:
+            self._writer.execute("PRAGMA journal_mode = WAL;")
+            self.pool = ConnectionPool(
+                lambda: self._connect(read_only=True),
+                self.logging,
+                min_size=self.config.get('pool_min_size', 1),
+                max_size=self.config.get('pool_max_size', 5),
+                idle_timeout=self.config.get('pool_idle_timeout', 300),
+                health_check_interval=self.config.get('pool_health_check_interval', 30),
+                acquire_timeout=self.config.get('pool_acquire_timeout', 10),
+                validator=lambda con: con.execute("SELECT 1;")
+            )
+
+    def _connect(self, read_only: bool):
+        """
+        Open a connection to the DB file
+        :param read_only: Refuse any write on this connection
+        :return: The DB connection
+        """
+        try:
+            con = sqlite3.connect(
+                self.path,
+                detect_types=sqlite3.PARSE_DECLTYPES,
+                check_same_thread=False,
+                timeout=self.config.get('sqlite_busy_timeout', 5),
+                # Prepared statements kept by each connection
+                cached_statements=self.config.get('sqlite_cached_statements', 256)
+            )
+            con.execute("PRAGMA synchronous = NORMAL;")
+            if read_only:
+                con.execute("PRAGMA query_only = ON;")
+            return con
+        except sqlite3.Error as e:
+            self.logging.error(f"Cannot open SQLite DB [{self.path}]")
+            raise StorageError(str(e)) from e
+
+    @contextmanager
+    def write_connection(self):
+        with self._write_lock:
+            try:
+                yield self._writer
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    def read_connection(self):
+        if self.pool is None:
+            return self.write_connection()
+        return self.pool.connection()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+        with self._write_lock:
+            self._writer.close()
+
+    def upsert(self, keys: tuple, updates: dict) -> str:
+        return "ON CONFLICT (" + ", ".join(keys) + ") DO UPDATE SET " + ", ".join(
+            self.merge_functions[merge].format(column=column) for column, merge in updates.items()
+        )
+
+    def hour_start(self, column: str) -> str:
+        return f"strftime('%Y-%m-%d %H:00:00', {column})"
+
+    def hour_of(self, column: str) -> str:
+        return f"CAST(strftime('%H', {column}) AS INTEGER)"
+
+    def inserted_ids(self, lastrowid: int, count: int) -> list:
+        # The writer is alone, the rows of a multi-row INSERT get consecutive IDs and lastrowid is the last one
+        return list(range(lastrowid - count + 1, lastrowid + 1))
+
+    def row_bytes(self, table: str) -> int:
+        sql = """SELECT (SELECT SUM(pgsize) FROM dbstat WHERE name = ?) / MAX(COUNT(*), 1) FROM """ + table + ";"
+        try:
+            with self.read_connection() as con:
+                row = con.execute(sql, (table,)).fetchone()
+            return int(row[0] or 0)
+        except sqlite3.OperationalError:
+            # SQLite built without the dbstat table
+            return 0
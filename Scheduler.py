@@ -1,40 +1,139 @@
+import datetime
+import heapq
+import itertools
 import logging
 import threading
-import time
-import schedule
+
+from Metrics import metrics
+
+JOB_DURATION = metrics.histogram("garden_scheduler_job_seconds", "Duration of the scheduled jobs", ("job",),
+                                 buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600))
+JOB_LATENESS = metrics.histogram("garden_scheduler_job_lateness_seconds", "Delay between the deadline and the start of the scheduled jobs", ("job",),
+                                 buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300))
+JOB_FAILURES = metrics.counter("garden_scheduler_job_failures_total", "Scheduled jobs ended with an exception", ("job",))
 
 
 class Scheduler(threading.Thread):
+    """
+    Run the periodic jobs from a heap of deadlines, sleeping until the earliest one.
+    Jobs are single-flight: the next run is planned only once the current one ends, so a slow run delays the next
+    instead of overlapping with it.
+    """
 
-    def __init__(self, log: logging, recurrence: int, go):
+    def __init__(self, log: logging, recurrence: int, go, registry_refresh: int = 60, maintenance_time: str = "03:30", max_idle: int = 60):
         super().__init__()
         self.recurrence = recurrence
+        self.registry_refresh = registry_refresh
+        self.maintenance_time = maintenance_time
+        # Longest pause of the watering evaluation outside the watering windows, in minutes
+        self.max_idle = max_idle
         self.logging = log
         self.go = go
-        schedule.every(self.recurrence).minutes.do(self.run_threaded, self.job)
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopping = False
+        now = datetime.datetime.now()
+        # The first watering evaluation runs at startup
+        self.add_job(self.job, self.next_evaluation, now)
+        self.add_job(self.go.refresh_registry, self.every(self.registry_refresh), now + datetime.timedelta(minutes=self.registry_refresh))
+        self.add_job(self.maintenance_job, self.daily(self.maintenance_time))
+        self.add_job(self.go.prefetch_watering_windows, self.daily("23:50"))
         self.logging.info("Scheduler setupped")
         print("Scheduler setupped")
 
+    @staticmethod
+    def every(minutes: int):
+        """Plan a job every given minutes from the end of its previous run"""
+        return lambda now: now + datetime.timedelta(minutes=minutes)
+
+    @staticmethod
+    def daily(at: str):
+        """Plan a job every day at the given HH:MM time"""
+        at = datetime.time.fromisoformat(at)
+
+        def next_run(now: datetime.datetime) -> datetime.datetime:
+            deadline = datetime.datetime.combine(now.date(), at)
+            return deadline if deadline > now else deadline + datetime.timedelta(days=1)
+        return next_run
+
+    def next_evaluation(self, now: datetime.datetime) -> datetime.datetime:
+        """
+        Plan the next watering evaluation, stretching the recurrence while all the watering windows are closed
+        :param now: The end of the previous evaluation
+        :return: The next deadline
+        """
+        deadline = now + datetime.timedelta(minutes=self.recurrence)
+        try:
+            opening = self.go.next_watering_time(now)
+        except Exception as e:
+            self.logging.warning(f"Cannot retrieve the next watering window [{e}]")
+            return deadline
+        if opening is None or opening <= deadline:
+            return deadline
+        deadline = min(opening, now + datetime.timedelta(minutes=max(self.max_idle, self.recurrence)))
+        self.logging.debug(f"Watering windows closed - Next evaluation at {deadline}")
+        return deadline
+
+    def add_job(self, job_func, next_run, deadline: datetime.datetime = None):
+        """
+        Schedule a job
+        :param job_func: The function to run
+        :param next_run: Function returning the next deadline given the end time of a run
+        :param deadline: The first deadline, by default planned by next_run
+        :return:
+        """
+        deadline = deadline or next_run(datetime.datetime.now())
+        with self._condition:
+            heapq.heappush(self._heap, (deadline, next(self._sequence), job_func, next_run))
+            self._condition.notify()
+
     def run(self):
         self.logging.info("Scheduler started")
         print("Scheduler started")
+        while True:
+            with self._condition:
+                while not self._stopping and not self._due():
+                    self._condition.wait(self._time_to_deadline())
+                if self._stopping:
+                    self.logging.info("Scheduler stopped")
+                    return
+                deadline, _, job_func, next_run = heapq.heappop(self._heap)
+            threading.Thread(target=self.run_job, args=(job_func, next_run, deadline), daemon=True).start()
 
-        ## TODO Remove this testing function
-        self.run_threaded(self.job)#
+    def _due(self) -> bool:
+        return bool(self._heap) and self._heap[0][0] <= datetime.datetime.now()
 
-        while True:
-            try:
-                schedule.run_pending()
-                time.sleep(1)
-            except Exception as e:
-                self.logging.warning("Unknow exception: [" + str(e) + "]")
+    def _time_to_deadline(self):
+        if not self._heap:
+            return None
+        return max(0.0, (self._heap[0][0] - datetime.datetime.now()).total_seconds())
 
-    @staticmethod
-    def run_threaded(job_func):
-        job_thread = threading.Thread(target=job_func)
-        job_thread.start()
+    def stop(self):
+        """Stop planning new runs, the running jobs are completed"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+
+    def run_job(self, job_func, next_run, deadline: datetime.datetime):
+        """Run a job tracking its lateness, duration and failures, then plan its next run"""
+        name = job_func.__name__
+        JOB_LATENESS.observe((datetime.datetime.now() - deadline).total_seconds(), name)
+        try:
+            with JOB_DURATION.time(name):
+                job_func()
+        except Exception as e:
+            JOB_FAILURES.inc(name)
+            self.logging.error(f"Scheduled job {name} failed [{e}]")
+        finally:
+            self.add_job(job_func, next_run, next_run(datetime.datetime.now()))
 
     def job(self):
         self.logging.debug("Starting threaded job")
         recap = self.go.evaluate_watering()
         self.logging.info("Requested " + str(recap.get('actions')) + " watering using " + str(recap.get('water')) + "ml")
+
+    def maintenance_job(self):
+        self.logging.debug("Starting maintenance job")
+        report = self.go.maintain_history()
+        self.logging.info("Retention reclaimed " + str(report.get('raw_rows', 0) + report.get('hourly_rows', 0)) + " rows and " + str(report.get('raw_bytes', 0) + report.get('hourly_bytes', 0)) + " bytes")
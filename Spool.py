@@ -0,0 +1,333 @@
+import datetime
+import logging
+import os
+import struct
+import threading
+import time
+
+from CircuitBreaker import CircuitBreaker
+from Metrics import metrics
+
+SPOOLED = metrics.counter("garden_spool_records_total", "Records written to the local spool instead of the DB, by kind", ("kind",))
+REPLAYED = metrics.counter("garden_spool_replayed_total", "Spooled records replayed to the DB, by kind", ("kind",))
+DEAD_LETTERS = metrics.counter("garden_spool_dead_letters_total", "Spooled records refused by the DB and moved to the dead-letter file, by kind", ("kind",))
+DISCARDED = metrics.counter("garden_spool_discarded_total", "Detections with values outside the spool layout, never written")
+
+
+class RejectedWrite(Exception):
+    """Raised when the DB refuses the written data itself, as opposed to being unavailable"""
+
+
+class Spool(threading.Thread):
+    """
+    Stand-in for the DB writes of the ingestion path: detections and watering acks go to the DB while it is healthy,
+    to an append-only local file while the circuit breaker is open. The file is replayed in bulk, oldest first,
+    once the DB recovers. The records the DB keeps refusing are moved to a dead-letter file, in the same format,
+    instead of blocking the ones behind them.
+    Each record is a type byte followed by a fixed layout, in little endian:
+    - detection: plant_id (I), humidity (h), sensor_id (I, 0xFFFFFFFF for none), timestamp in microseconds (q)
+    - watering ack: watering_id (I)
+    """
+    DETECTION = 1
+    WATERING_ACK = 2
+    layouts = {
+        DETECTION: struct.Struct("<BIhIq"),
+        WATERING_ACK: struct.Struct("<BI")
+    }
+    NO_SENSOR = 0xFFFFFFFF
+    # Timestamps are stored as naive local times
+    EPOCH = datetime.datetime(1970, 1, 1)
+
+    def __init__(self, log: logging, db, path: str, breaker: CircuitBreaker, fsync_interval: float = 0.2,
+                 fsync_batch: int = 100, replay_batch: int = 500, replay_interval: float = 5, on_replay=None,
+                 rejected_errors: tuple = ()):
+        super().__init__(daemon=True, name="spool")
+        self.logging = log
+        self.db = db
+        self.path = path
+        self.replay_path = path + ".replay"
+        self.offset_path = path + ".offset"
+        self.dead_letter_path = path + ".dead"
+        self.breaker = breaker
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = max(1, fsync_batch)
+        self.replay_batch = max(1, replay_batch)
+        self.replay_interval = replay_interval
+        # Called after each replayed batch
+        self.on_replay = on_replay
+        # The driver exceptions of a write refused by the DB, see StorageBackend.Rejected
+        self.rejected_errors = rejected_errors
+        self._lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._truncate_torn_tail()
+        self._file = open(self.path, "ab")
+        self._unsynced = 0
+        self._stopping = threading.Event()
+
+    def insert_plant_detections(self, detections: list) -> list:
+        """
+        Save a batch of detections to the DB, or to the spool while the DB is unavailable
+        :param detections: List of (plant_id, humidity, sensor_id, timestamp) tuples
+        :return: The detection IDs, None for the spooled detections
+        """
+        try:
+            ids = self._call(self.db.insert_plant_detections, detections)
+        except RejectedWrite as e:
+            # The replay isolates the refused detections from the valid ones of the batch
+            self.logging.warning(f"DB refused a batch of {len(detections)} detections, spooling [{e}]")
+            ids = None
+        if ids is not None:
+            return ids
+        records = []
+        for detection in detections:
+            try:
+                records.append(self.encode_detection(*detection))
+            except (struct.error, OverflowError) as e:
+                DISCARDED.inc()
+                self.logging.error(f"Discarding detection not fitting the spool {detection} [{e}]")
+        self.append(records)
+        SPOOLED.inc("detection", amount=len(records))
+        return [None] * len(detections)
+
+    def ack_waterings(self, watering_ids: list):
+        """Confirm several waterings on the DB with a single UPDATE, or on the spool while the DB is unavailable"""
+        try:
+            outcome = self._call(self.db.ack_waterings, watering_ids)
+        except RejectedWrite as e:
+            self.logging.warning(f"DB refused a batch of {len(watering_ids)} watering acks, spooling [{e}]")
+            outcome = None
+        if outcome is not None:
+            return outcome
+        self.append([self.layouts[self.WATERING_ACK].pack(self.WATERING_ACK, watering_id) for watering_id in watering_ids])
+        SPOOLED.inc("ack", amount=len(watering_ids))
+        return None
+
+    def _call(self, write, *args):
+        """
+        Run a DB write through the circuit breaker
+        :return: The write result, None when the DB is unavailable
+        :raise RejectedWrite: The DB refused the data, it is healthy and the same write would fail again
+        """
+        if not self.breaker.allow():
+            return None
+        start = time.perf_counter()
+        try:
+            result = write(*args)
+        except self.rejected_errors as e:
+            self.breaker.record_success(time.perf_counter() - start)
+            raise RejectedWrite(str(e)) from e
+        except Exception as e:
+            self.breaker.record_failure()
+            self.logging.warning(f"DB write failed, spooling [{e}]")
+            return None
+        self.breaker.record_success(time.perf_counter() - start)
+        # Some writes return nothing on success
+        return result if result is not None else True
+
+    @classmethod
+    def encode_detection(cls, plant_id: int, humidity: int, sensor_id: int, timestamp: datetime.datetime) -> bytes:
+        micros = (timestamp - cls.EPOCH) // datetime.timedelta(microseconds=1)
+        sensor_id = cls.NO_SENSOR if sensor_id is None else sensor_id
+        return cls.layouts[cls.DETECTION].pack(cls.DETECTION, plant_id, humidity, sensor_id, micros)
+
+    @classmethod
+    def decode(cls, data: bytes, offset: int):
+        """
+        Decode the record at the given offset
+        :return: The record type, its values and the offset of the next record, None at the end or on a torn or corrupt record
+        """
+        layout = cls.layouts.get(data[offset]) if offset < len(data) else None
+        if layout is None or offset + layout.size > len(data):
+            return None
+        fields = layout.unpack_from(data, offset)
+        if fields[0] == cls.DETECTION:
+            plant_id, humidity, sensor_id, micros = fields[1:]
+            try:
+                timestamp = cls.EPOCH + datetime.timedelta(microseconds=micros)
+            except OverflowError:
+                return None
+            values = (plant_id, humidity, None if sensor_id == cls.NO_SENSOR else sensor_id, timestamp)
+        else:
+            values = fields[1]
+        return fields[0], values, offset + layout.size
+
+    def append(self, records: list):
+        """Append some records, they are fsynced every fsync_batch records or fsync_interval seconds"""
+        with self._lock:
+            self._file.write(b"".join(records))
+            self._file.flush()
+            self._unsynced += len(records)
+            if self._unsynced >= self.fsync_batch:
+                self._sync()
+
+    def sync(self):
+        with self._lock:
+            if self._unsynced:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def backlog(self) -> int:
+        """Bytes waiting to be replayed"""
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if os.path.exists(self.replay_path):
+            size += os.path.getsize(self.replay_path) - self._read_offset()
+        return size
+
+    def run(self):
+        self.logging.info("Spool started")
+        next_replay = time.monotonic()
+        while not self._stopping.wait(self.fsync_interval):
+            self.sync()
+            if time.monotonic() >= next_replay:
+                next_replay = time.monotonic() + self.replay_interval
+                try:
+                    self.replay()
+                except (OSError, ValueError, OverflowError) as e:
+                    self.logging.error(f"Cannot replay the spool [{e}]")
+        self.logging.info("Spool stopped")
+
+    def replay(self) -> int:
+        """
+        Write the spooled records to the DB, oldest first, a batch at a time
+        :return: The number of replayed records
+        """
+        with self._replay_lock:
+            if not os.path.exists(self.replay_path) and not self._rotate():
+                return 0
+            with open(self.replay_path, "rb") as f:
+                data = f.read()
+            offset = self._read_offset()
+            replayed = 0
+            while True:
+                kind, values, end = self._next_group(data, offset)
+                if not values:
+                    break
+                try:
+                    if self._call(self.write_function(kind), values) is None:
+                        return replayed
+                except RejectedWrite as e:
+                    self.logging.warning(f"DB refused {len(values)} spooled records, replaying them one at a time [{e}]")
+                    written, offset = self._replay_one_by_one(data, offset, end)
+                    replayed += written
+                    if offset < end:
+                        return replayed
+                    continue
+                REPLAYED.inc(self.kind_name(kind), amount=len(values))
+                replayed += len(values)
+                offset = end
+                self._write_offset(offset)
+                if self.on_replay is not None:
+                    self.on_replay()
+            if offset < len(data):
+                self.logging.error(f"Discarding {len(data) - offset} unreadable bytes at the end of the spool")
+            os.remove(self.replay_path)
+            if os.path.exists(self.offset_path):
+                os.remove(self.offset_path)
+            self.logging.info(f"Replayed {replayed} spooled records")
+            return replayed
+
+    def _replay_one_by_one(self, data: bytes, offset: int, end: int) -> tuple:
+        """
+        Write the records of a refused group one at a time, moving the ones the DB refuses to the dead-letter file
+        :return: The number of records written and the offset reached, before end when the DB became unavailable
+        """
+        written = 0
+        while offset < end:
+            kind, value, next_offset = self.decode(data, offset)
+            try:
+                if self._call(self.write_function(kind), [value]) is None:
+                    break
+                REPLAYED.inc(self.kind_name(kind))
+                written += 1
+            except RejectedWrite as e:
+                self.logging.error(f"DB refused spooled record {value}, moving it to {self.dead_letter_path} [{e}]")
+                self._dead_letter(data[offset:next_offset])
+                DEAD_LETTERS.inc(self.kind_name(kind))
+            offset = next_offset
+            self._write_offset(offset)
+        if written and self.on_replay is not None:
+            self.on_replay()
+        return written, offset
+
+    def _dead_letter(self, record: bytes):
+        """Keep a refused record aside, it is synced before the replay moves past it"""
+        with open(self.dead_letter_path, "ab") as f:
+            f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write_function(self, kind: int):
+        """The DB write of a group of records of the given type"""
+        return self.db.insert_plant_detections if kind == self.DETECTION else self.db.ack_waterings
+
+    def kind_name(self, kind: int) -> str:
+        return "detection" if kind == self.DETECTION else "ack"
+
+    def _next_group(self, data: bytes, offset: int):
+        """Collect up to replay_batch consecutive records of the same type"""
+        kind = None
+        values = []
+        while len(values) < self.replay_batch:
+            record = self.decode(data, offset)
+            if record is None or (kind is not None and record[0] != kind):
+                break
+            kind, value, offset = record
+            values.append(value)
+        return kind, values, offset
+
+    def _truncate_torn_tail(self):
+        """Cut a record torn by a crash at the end of the spool, the new records would be appended misaligned after it"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r+b") as f:
+            data = f.read()
+            offset = 0
+            while True:
+                record = self.decode(data, offset)
+                if record is None:
+                    break
+                offset = record[2]
+            if offset < len(data):
+                self.logging.warning(f"Discarding {len(data) - offset} unreadable bytes at the end of the spool")
+                f.truncate(offset)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _rotate(self) -> bool:
+        """Move the spooled records aside for the replay, the new ones go to a fresh file"""
+        with self._lock:
+            if self._file.tell() == 0:
+                return False
+            self._sync()
+            self._file.close()
+            os.replace(self.path, self.replay_path)
+            self._file = open(self.path, "ab")
+        self._write_offset(0)
+        return True
+
+    def _read_offset(self) -> int:
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_offset(self, offset: int):
+        # Replaced atomically, a crash never leaves a half written offset
+        with open(self.offset_path + ".tmp", "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.offset_path + ".tmp", self.offset_path)
+
+    def stop(self, timeout: float = None):
+        """Sync the spooled records and stop the background replay"""
+        self._stopping.set()
+        if self.is_alive():
+            self.join(timeout)
+        with self._lock:
+            self._sync()
+            self._file.close()
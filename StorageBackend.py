@@ -0,0 +1,92 @@
+import logging
+from contextlib import contextmanager
+
+
+class StorageError(Exception):
+    """Raised when the storage backend cannot be reached"""
+
+
+class StorageBackend:
+    """
+    The connection handling and the SQL dialect of a DB engine.
+    The queries are shared by all the backends, only the table definitions and
+    the few non-portable fragments returned by the methods below differ.
+    """
+    name = None
+    # Whether plant_history is partitioned by month
+    partitioning = False
+    # The driver base exception
+    Error = Exception
+    # The driver exceptions raised when the DB refuses the data itself, the same write would fail again
+    Rejected = ()
+    # The CREATE TABLE statement of each table
+    schema = {}
+
+    def __init__(self, config, log: logging):
+        self.config = config
+        self.logging = log
+
+    def read_connection(self):
+        """Borrow a connection for reading, to be used in a with block"""
+        raise NotImplementedError
+
+    def write_connection(self):
+        """Borrow a connection for writing, to be used in a with block"""
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    @contextmanager
+    def schema_lock(self):
+        """
+        Hold the lock serializing the schema migrations of the processes sharing the DB, to be used in a with block.
+        By default there is no such lock, the migrations are idempotent and recorded with an upsert.
+        """
+        yield
+
+    def stream_cursor(self, con):
+        """Open a cursor fetching the rows from the server while they are read, instead of all at once"""
+        return con.cursor()
+
+    def upsert(self, keys: tuple, updates: dict) -> str:
+        """
+        Build the clause turning an INSERT into an upsert
+        :param keys: The columns of the unique key
+        :param updates: Column to merge function, one of add, min, max or replace
+        :return: The clause to append to the INSERT
+        """
+        raise NotImplementedError
+
+    def hour_start(self, column: str) -> str:
+        """Expression truncating a timestamp column to the hour"""
+        raise NotImplementedError
+
+    def hour_of(self, column: str) -> str:
+        """Expression extracting the hour of a timestamp column"""
+        raise NotImplementedError
+
+    def inserted_ids(self, lastrowid: int, count: int) -> list:
+        """IDs generated by a multi-row INSERT of count rows, given the cursor lastrowid"""
+        raise NotImplementedError
+
+    def row_bytes(self, table: str) -> int:
+        """Estimated storage used by a single row of the table"""
+        raise NotImplementedError
+
+
+def create_backend(config, log: logging) -> StorageBackend:
+    """
+    Create the backend selected in the [DB] config, the drivers are imported only when used
+    :param config: The [DB] config section
+    :param log: The logger
+    :return:
+    """
+    backend = config.get('backend', 'mariadb')
+    if backend == 'mariadb':
+        from MariaDBBackend import MariaDBBackend
+        return MariaDBBackend(config, log)
+    elif backend == 'sqlite':
+        from SQLiteBackend import SQLiteBackend
+        return SQLiteBackend(config, log)
+    raise ValueError(f"Unknown DB backend [{backend}]")
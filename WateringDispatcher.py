@@ -0,0 +1,72 @@
+import logging
+import queue
+import threading
+import time
+
+
+class WateringDispatcher:
+    """
+    Send the watering requests through one queue per water line (the sensor driving the pump).
+    Requests on the same line are spaced by wait_watering seconds, different lines water in parallel.
+    """
+
+    def __init__(self, log: logging, send, wait_watering: float = 60):
+        """
+        :param log: The logger
+        :param send: Callable invoked as send(action) to request a watering
+        :param wait_watering: Seconds between two waterings on the same line
+        """
+        self.logging = log
+        self.send = send
+        self.wait_watering = wait_watering
+        self._lines = {}
+        self._lock = threading.Lock()
+
+    def dispatch(self, actions: list, line_of, timeout: float = None) -> bool:
+        """
+        Queue the actions on their lines and wait until all of them have been sent
+        :param actions: The watering actions
+        :param line_of: Callable returning the line (sensor ID) of an action
+        :param timeout: Seconds to wait for the actions to be sent, by default wait forever
+        :return: False if the timeout expired before all the actions were sent
+        """
+        done = []
+        for action in actions:
+            event = threading.Event()
+            self._line(line_of(action)).put((action, event))
+            done.append(event)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for event in done:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not event.wait(remaining):
+                return False
+        return True
+
+    def pending(self) -> dict:
+        """Number of queued actions per line"""
+        with self._lock:
+            return {line: q.qsize() for line, q in self._lines.items()}
+
+    def _line(self, line) -> queue.Queue:
+        with self._lock:
+            line_queue = self._lines.get(line)
+            if line_queue is None:
+                line_queue = queue.Queue()
+                self._lines[line] = line_queue
+                threading.Thread(target=self._work, args=(line, line_queue), name=f"water-line-{line}", daemon=True).start()
+            return line_queue
+
+    def _work(self, line, line_queue: queue.Queue):
+        last_sent = None
+        while True:
+            action, done = line_queue.get()
+            if last_sent is not None:
+                wait = last_sent + self.wait_watering - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+            try:
+                self.send(action)
+            except Exception as e:
+                self.logging.error(f"Cannot send watering on line {line} [{e}]")
+            last_sent = time.monotonic()
+            done.set()
@@ -0,0 +1,186 @@
+import datetime
+import heapq
+import logging
+import threading
+import time
+
+from Metrics import metrics
+
+WATERING_OUTCOMES = metrics.counter("garden_watering_outcomes_total", "Watering requests by final state", ("state",))
+ACK_BATCHES = metrics.counter("garden_watering_ack_batches_total", "Batched watering ack updates written to the DB")
+
+
+class WateringTracker(threading.Thread):
+    """
+    Follow each watering request through requested -> published -> acked or timed_out.
+    The acks are persisted in batches with a single UPDATE, the timeouts are kept in a heap of deadlines
+    and expire without reading the DB.
+    """
+    REQUESTED = "requested"
+    PUBLISHED = "published"
+    ACKED = "acked"
+    TIMED_OUT = "timed_out"
+
+    def __init__(self, log: logging, store, ack_timeout: float = 120, batch_size: int = 50, max_latency: float = 1.0,
+                 on_timeout=None):
+        """
+        :param log: The logger
+        :param store: Where the acks are persisted, through ack_waterings(watering_ids)
+        :param ack_timeout: Seconds to wait for the ack once the watering should be over
+        :param batch_size: Acks written together
+        :param max_latency: Maximum seconds an ack waits before being written
+        :param on_timeout: Called with the ID of each watering timed out
+        """
+        super().__init__(daemon=True, name="watering-tracker")
+        self.logging = log
+        self.store = store
+        self.ack_timeout = ack_timeout
+        self.batch_size = max(1, batch_size)
+        self.max_latency = max_latency
+        self.on_timeout = on_timeout
+        self._waterings = {}
+        self._deadlines = []
+        self._acks = []
+        self._oldest_ack = None
+        self._stopping = False
+        self._condition = threading.Condition()
+
+    def request(self, watering_id: int, plant_id: int, water_time: float, requested_at: datetime.datetime = None):
+        """
+        Track a new watering request
+        :param watering_id: The watering ID
+        :param plant_id: The plant to water
+        :param water_time: Seconds the sensor needs to water the plant
+        :param requested_at: The request time, by default now
+        :return:
+        """
+        with self._condition:
+            self._waterings[watering_id] = {
+                'plant_id': plant_id,
+                'state': self.REQUESTED,
+                'requested_at': requested_at or datetime.datetime.now(),
+                'water_time': water_time
+            }
+            self._schedule_timeout(watering_id)
+
+    def published(self, watering_id: int):
+        """The request reached the broker, the timeout restarts from now"""
+        with self._condition:
+            watering = self._waterings.get(watering_id)
+            if watering is not None and watering['state'] == self.REQUESTED:
+                watering['state'] = self.PUBLISHED
+                self._schedule_timeout(watering_id)
+
+    def ack(self, watering_id: int):
+        """
+        Register the ack of a watering and queue its persistence
+        :param watering_id: The acknowledged watering
+        :return: The tracked request, with plant_id and requested_at, None if requested before the start or timed out
+        """
+        with self._condition:
+            watering = self._waterings.pop(watering_id, None)
+            if watering is not None:
+                watering['state'] = self.ACKED
+                WATERING_OUTCOMES.inc(self.ACKED)
+            if not self._stopping:
+                if not self._acks:
+                    # Wake up the tracker to arm the max latency timer
+                    self._oldest_ack = time.monotonic()
+                    self._condition.notify()
+                self._acks.append(watering_id)
+                if len(self._acks) >= self.batch_size:
+                    self._condition.notify()
+                return watering
+        # Tracker already stopped, write synchronously
+        self.flush([watering_id])
+        return watering
+
+    def state(self, watering_id: int):
+        """The state of a watering waiting for its ack, None once acked, timed out or unknown"""
+        watering = self._waterings.get(watering_id)
+        return watering['state'] if watering is not None else None
+
+    def pending(self) -> int:
+        """Waterings waiting for the ack"""
+        return len(self._waterings)
+
+    def _schedule_timeout(self, watering_id: int):
+        """Push the ack deadline of a watering (lock held), the previous deadline becomes stale"""
+        watering = self._waterings[watering_id]
+        watering['deadline'] = time.monotonic() + watering['water_time'] + self.ack_timeout
+        heapq.heappush(self._deadlines, (watering['deadline'], watering_id))
+        self._condition.notify()
+
+    def run(self):
+        self.logging.info("Watering tracker started")
+        while True:
+            with self._condition:
+                while not self._stopping and not self._acks_ready() and not self._timeout_due():
+                    self._condition.wait(self._time_to_deadline())
+                timed_out = self._expire()
+                acks = []
+                if self._acks_ready() or self._stopping:
+                    acks = self._acks
+                    self._acks = []
+                    self._oldest_ack = None
+                stopping = self._stopping
+            if acks:
+                self.flush(acks)
+            if self.on_timeout is not None:
+                for watering_id in timed_out:
+                    self.on_timeout(watering_id)
+            if stopping:
+                self.logging.info("Watering tracker stopped")
+                return
+
+    def flush(self, acks: list):
+        """Persist a batch of acks with a single UPDATE"""
+        try:
+            self.store.ack_waterings(acks)
+            ACK_BATCHES.inc()
+            self.logging.debug(f"Written {len(acks)} watering acks")
+        except Exception as e:
+            self.logging.error(f"Cannot write {len(acks)} watering acks [{e}]")
+
+    def stop(self, timeout: float = None):
+        """Write the pending acks and stop the tracker"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self.is_alive():
+            self.join(timeout)
+
+    def _expire(self) -> list:
+        """
+        Time out the waterings past their deadline (lock held)
+        :return: The timed out watering IDs
+        """
+        now = time.monotonic()
+        timed_out = []
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, watering_id = heapq.heappop(self._deadlines)
+            watering = self._waterings.get(watering_id)
+            if watering is None or watering['deadline'] != deadline:
+                # Acked or rescheduled
+                continue
+            # A late ack is still persisted, through the DB lookup of requests made before the start
+            del self._waterings[watering_id]
+            watering['state'] = self.TIMED_OUT
+            WATERING_OUTCOMES.inc(self.TIMED_OUT)
+            self.logging.warning(f"No ack received for watering #{watering_id} of plant #{watering['plant_id']}")
+            timed_out.append(watering_id)
+        return timed_out
+
+    def _acks_ready(self):
+        return len(self._acks) >= self.batch_size or (self._acks and time.monotonic() - self._oldest_ack >= self.max_latency)
+
+    def _timeout_due(self):
+        return bool(self._deadlines) and self._deadlines[0][0] <= time.monotonic()
+
+    def _time_to_deadline(self):
+        deadlines = [self._deadlines[0][0]] if self._deadlines else []
+        if self._oldest_ack is not None:
+            deadlines.append(self._oldest_ack + self.max_latency)
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.monotonic())
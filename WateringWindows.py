@@ -0,0 +1,97 @@
+import datetime
+import logging
+import threading
+
+from astral import LocationInfo, sun
+
+
+class WateringWindows:
+    """
+    Cache of the watering windows (sunset to sunrise) keyed by location and local date.
+    Each window is computed once per day, failed lookups are remembered to not retry them on every cycle.
+    """
+    default_sunset = datetime.time(23, 0, 0)
+    default_sunrise = datetime.time(7, 0, 0)
+
+    def __init__(self, log: logging):
+        self.logging = log
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def get(self, location, day: datetime.date = None):
+        """
+        Retrieve the watering window of a location
+        :param location: The plant location
+        :param day: The local date, by default today
+        :return: The (sunset, sunrise) tuple
+        """
+        if not location:
+            self.logging.info("Missing plant location - Using default time")
+            return self.default_sunset, self.default_sunrise
+        day = day or datetime.date.today()
+        key = (location, day)
+        try:
+            window = self._windows[key]
+        except KeyError:
+            window = self._compute(location, day)
+            with self._lock:
+                self._windows[key] = window
+        if window is None:
+            return self.default_sunset, self.default_sunrise
+        return window
+
+    def is_watering_time(self, location, now: datetime.datetime = None) -> bool:
+        """Check if it's night in the given location"""
+        now = now or datetime.datetime.now()
+        start_watering, end_watering = self.get(location, now.date())
+        return self.time_in_range(start_watering, end_watering, now.time())
+
+    def next_start(self, location, now: datetime.datetime = None) -> datetime.datetime:
+        """
+        Retrieve when the next watering window of a location opens
+        :param location: The plant location
+        :param now: The local time, by default the current time
+        :return: now if the window is already open, otherwise the next sunset
+        """
+        now = now or datetime.datetime.now()
+        start_watering, end_watering = self.get(location, now.date())
+        if self.time_in_range(start_watering, end_watering, now.time()):
+            return now
+        if now.time() < start_watering:
+            return datetime.datetime.combine(now.date(), start_watering)
+        tomorrow = now.date() + datetime.timedelta(days=1)
+        return datetime.datetime.combine(tomorrow, self.get(location, tomorrow)[0])
+
+    def prefetch(self, locations, day: datetime.date):
+        """
+        Compute in advance the windows of a day and forget the expired ones
+        :param locations: The locations to compute
+        :param day: The local date
+        :return:
+        """
+        for location in set(locations):
+            if location:
+                self.get(location, day)
+        with self._lock:
+            for key in [key for key in self._windows if key[1] < day - datetime.timedelta(days=1)]:
+                del self._windows[key]
+
+    def _compute(self, location, day: datetime.date):
+        """From geolocation get information on sunrise and sunset, None if not available"""
+        try:
+            city = LocationInfo(location)
+            s = sun.sun(city.observer, date=day)
+            sunrise = s['sunrise'].astimezone().time()
+            sunset = s['sunset'].astimezone().time()
+            return sunset, sunrise
+        except Exception as e:
+            self.logging.warning(f"Cannot retrieve info base on location [{location}] - Default value provided until tomorrow [{e}]")
+            return None
+
+    @staticmethod
+    def time_in_range(start, end, x):
+        """Return true if x is in the range [start, end]"""
+        if start <= end:
+            return start <= x <= end
+        else:
+            return start <= x or x <= end
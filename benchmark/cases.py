@@ -0,0 +1,251 @@
+"""Benchmark cases, each setup function returns the callable to measure"""
+import asyncio
+import contextlib
+import datetime
+import io
+import os
+import random
+import tempfile
+from types import SimpleNamespace
+
+from AsyncDetectionWriter import AsyncDetectionWriter
+from AsyncMqttClient import AsyncMqttClient
+from BinaryPayload import BinaryPayload
+from CircuitBreaker import CircuitBreaker
+from Database import Database
+from DetectionWriter import DetectionWriter
+from MessageDispatcher import MessageDispatcher
+from MessageHandler import MessageHandler
+from Spool import Spool
+from fakes import fake_database, fake_orchestrator, log
+from main import create_app
+
+cases = []
+
+
+def benchmark(name: str, number: int):
+    """
+    Register a benchmark case
+    :param name: The case name, used as key in the baseline
+    :param number: The calls of the measured callable in each timed run
+    """
+    def register(setup):
+        cases.append((name, number, setup))
+        return setup
+    return register
+
+
+def quiet(function):
+    """Drop the stdout output of the measured callable"""
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+    return run
+
+
+@benchmark("parse_topic", number=200000)
+def parse_topic():
+    handler = MessageHandler(log, "d2_55_3", "sensor/42", None)
+    return handler.parse_topic
+
+
+@benchmark("parse_message_detection", number=5000)
+def parse_message_detection():
+    go = fake_orchestrator(64)
+    messages = [(f"d2_{random.randint(20, 90)}_{random.randint(0, 7)}", f"sensor/{random.randint(0, 7)}") for _ in range(1000)]
+    index = iter(range(10 ** 9))
+
+    def handle():
+        message, topic = messages[next(index) % len(messages)]
+        MessageHandler(log, message, topic, go).run()
+    return quiet(handle)
+
+
+@benchmark("parse_message_detection_binary", number=5000)
+def parse_message_detection_binary():
+    go = fake_orchestrator(64)
+    # Consecutive sequence numbers for each sensor, as sent by a healthy fleet
+    messages = [
+        (BinaryPayload.encode_detection(sequence // 8, random.randint(0, 7), random.randint(20, 90)), f"sensor/{sequence % 8}")
+        for sequence in range(1000)
+    ]
+    index = iter(range(10 ** 9))
+
+    def handle():
+        position = next(index) % len(messages)
+        if position == 0:
+            # The sequence numbers start over with the messages, as after a restart of the fleet
+            BinaryPayload._sequences.clear()
+        message, topic = messages[position]
+        MessageHandler(log, message, topic, go).run()
+    return quiet(handle)
+
+
+@benchmark("parse_message_batch_8_readings", number=5000)
+def parse_message_batch():
+    go = fake_orchestrator(64)
+    messages = [
+        ("b_" + ",".join(f"{plant_num}:{random.randint(20, 90)}" for plant_num in range(8)), f"sensor/{random.randint(0, 7)}")
+        for _ in range(1000)
+    ]
+    index = iter(range(10 ** 9))
+
+    def handle():
+        message, topic = messages[next(index) % len(messages)]
+        MessageHandler(log, message, topic, go).run()
+    return quiet(handle)
+
+
+@benchmark("parse_message_watering_ack", number=5000)
+def parse_message_watering_ack():
+    go = fake_orchestrator(8)
+    go.ack_watering = lambda watering_id: True
+    return quiet(lambda: MessageHandler(log, "w_1234", "sensor/1", go).run())
+
+
+@benchmark("parse_message_watering_ack_tracked", number=5000)
+def parse_message_watering_ack_tracked():
+    # The ack of a request made by this process: no DB access, its persistence is only queued
+    go = fake_orchestrator(8)
+    watering_ids = iter(range(10 ** 9))
+
+    def handle():
+        watering_id = next(watering_ids)
+        go.watering_tracker.request(watering_id, 1, 300)
+        MessageHandler(log, f"w_{watering_id}", "sensor/1", go).run()
+    return quiet(handle)
+
+
+def rows_to_dict(rows: int):
+    columns = ['plant_id', 'Value', 'Date', 'Hour']
+    today = datetime.date.today()
+    result = [(1, 50, today, hour % 24) for hour in range(rows)]
+    db = fake_database(lambda sql, values: (columns, result))
+    return lambda: db.get_values_from_db("SELECT plant_id, Value, Date, Hour FROM plant_history_hourly")
+
+
+@benchmark("get_values_from_db_10k", number=20)
+def get_values_from_db_10k():
+    return rows_to_dict(10_000)
+
+
+@benchmark("get_values_from_db_100k", number=3)
+def get_values_from_db_100k():
+    return rows_to_dict(100_000)
+
+
+@benchmark("get_values_from_db_1m", number=1)
+def get_values_from_db_1m():
+    return rows_to_dict(1_000_000)
+
+
+@benchmark("database_startup_migrated", number=50)
+def database_startup_migrated():
+    # A restart on an up to date SQLite file, only the schema version is checked
+    config = {'backend': 'sqlite', 'sqlite_path': os.path.join(tempfile.mkdtemp(), "garden.db")}
+    Database(config, log).disconnect()
+    return lambda: Database(config, log).disconnect()
+
+
+@benchmark("spool_1k_detections", number=20)
+def spool_detections():
+    # The DB is down, each batch of 100 detections goes to the spool with one fsync
+    db = SimpleNamespace(insert_plant_detections=None)
+    breaker = CircuitBreaker(log, "DB", reset_timeout=3600)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_failure()
+    spool = Spool(log, db, os.path.join(tempfile.mkdtemp(), "spool.bin"), breaker, fsync_batch=100)
+    now = datetime.datetime.now()
+    batches = [[(plant, 40, plant // 8, now) for plant in range(start, start + 100)] for start in range(0, 1000, 100)]
+
+    def run():
+        for batch in batches:
+            spool.insert_plant_detections(batch)
+    return run
+
+
+@benchmark("elaborate_watering_1k_plants", number=20)
+def elaborate_watering_1k():
+    return fake_orchestrator(1_000).elaborate_watering
+
+
+@benchmark("elaborate_watering_10k_plants", number=3)
+def elaborate_watering_10k():
+    return fake_orchestrator(10_000).elaborate_watering
+
+
+@benchmark("http_status_1k_plants", number=50)
+def http_status():
+    client = create_app(fake_orchestrator(1_000)).test_client()
+    return lambda: client.get("/status")
+
+
+def weekly_statistics_client():
+    columns = ['plant_id', 'Value', 'Date', 'Hour']
+    today = datetime.date.today()
+    rows = [(1, 50, today - datetime.timedelta(days=hour // 24), hour % 24) for hour in range(7 * 24)]
+    return create_app(fake_orchestrator(8, lambda sql, values: (columns, rows))).test_client()
+
+
+@benchmark("http_statistic_weekly", number=200)
+def http_statistic_weekly():
+    client = weekly_statistics_client()
+    return lambda: client.get("/statistic/weekly/1")
+
+
+@benchmark("http_statistic_weekly_columnar", number=200)
+def http_statistic_weekly_columnar():
+    client = weekly_statistics_client()
+    return lambda: client.get("/statistic/weekly/1?format=columnar")
+
+
+@benchmark("http_status_1k_plants_columnar", number=50)
+def http_status_columnar():
+    client = create_app(fake_orchestrator(1_000)).test_client()
+    return lambda: client.get("/status?format=columnar")
+
+
+@benchmark("http_status_not_modified", number=500)
+def http_status_not_modified():
+    client = create_app(fake_orchestrator(1_000)).test_client()
+    etag = client.get("/status").headers["ETag"]
+    return lambda: client.get("/status", headers={"If-None-Match": etag})
+
+
+def ingestion_fleet(writer_class):
+    """Orchestrator over 1k plants with a real detection writer, the DB accepting every batch instantly"""
+    go = fake_orchestrator(1_000)
+    go.db.insert_plant_detections = lambda detections: list(range(len(detections)))
+    go.detection_writer = writer_class(log, go.db, batch_size=100, max_latency=0.05)
+    go.detection_writer.start()
+    messages = [(f"d2_{random.randint(20, 90)}_{plant % 8}", f"sensor/{plant // 8}") for plant in range(1_000)]
+    return go, messages
+
+
+@benchmark("ingest_1k_detections_threaded", number=5)
+def ingest_threaded():
+    go, messages = ingestion_fleet(DetectionWriter)
+    dispatcher = MessageDispatcher(log, lambda message, topic: MessageHandler(log, message, topic, go).run(), workers=4)
+    dispatcher.start()
+
+    def run():
+        for message, topic in messages:
+            dispatcher.submit(message, topic)
+        dispatcher.queue.join()
+    return quiet(run)
+
+
+@benchmark("ingest_1k_detections_asyncio", number=5)
+def ingest_asyncio():
+    go, messages = ingestion_fleet(AsyncDetectionWriter)
+    client = AsyncMqttClient({}, log, go, go.detection_writer.loop)
+    frames = [SimpleNamespace(payload=message.encode('utf-8'), topic=topic) for message, topic in messages]
+
+    async def deliver():
+        for frame in frames:
+            client.on_message(None, None, frame)
+
+    def run():
+        asyncio.run_coroutine_threadsafe(deliver(), client.loop).result()
+    return quiet(run)
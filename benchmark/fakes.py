@@ -0,0 +1,163 @@
+"""Local stand-ins for MariaDB and the MQTT broker used by the benchmarks"""
+import datetime
+import logging
+import random
+import threading
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from ConnectionPool import ConnectionPool
+from DataVersion import DataVersion
+from Database import Database
+from GardenOrchestrator import GardenOrchestrator
+from HumidityTracker import HumidityTracker
+from LatestState import LatestState
+from PlantRegistry import PlantRegistry
+from SQLiteBackend import SQLiteBackend
+from WateringTracker import WateringTracker
+from WateringWindows import WateringWindows
+
+log = logging.getLogger("benchmark")
+log.setLevel(logging.WARNING)
+log.addHandler(logging.NullHandler())
+log.propagate = False
+
+
+class FakeCursor:
+    """DB-API cursor returning canned rows, whatever the query"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.lastrowid = None
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, sql, values=None):
+        columns, rows = self.connection.results(sql, values)
+        self.description = [(column,) for column in columns]
+        self._rows = rows
+        self.rowcount = len(rows)
+        self.connection.last_id += 1
+        self.lastrowid = self.connection.last_id
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchmany(self, size=1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """DB-API connection answering every query with the results of the given callable"""
+
+    def __init__(self, results):
+        self.results = results
+        self.last_id = 0
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def ping(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeBackend(SQLiteBackend):
+    """Backend speaking the SQLite dialect over a pool of fake connections"""
+
+    def __init__(self, results):
+        self.config = {}
+        self.logging = log
+        self.pool = ConnectionPool(lambda: FakeConnection(results), log, min_size=1, max_size=4, validator=lambda con: None)
+
+    def write_connection(self):
+        return self.pool.connection()
+
+    def close(self):
+        self.pool.close()
+
+
+def fake_database(results) -> Database:
+    """
+    Build a Database whose backend hands out fake connections
+    :param results: Callable invoked as results(sql, values) returning (columns, rows)
+    :return:
+    """
+    db = Database.__new__(Database)
+    db.config = {}
+    db.logging = log
+    db.dbSemaphore = threading.Condition()
+    db.backend = FakeBackend(results)
+    return db
+
+
+def synthetic_inventory(plants: int, plants_per_sensor: int = 8) -> list:
+    return [{
+        'plant_id': plant_id,
+        'plant_name': f"Plant {plant_id}",
+        'plant_num': (plant_id - 1) % plants_per_sensor,
+        'nodemcu_id': (plant_id - 1) // plants_per_sensor,
+        'owner': "",
+        'plant_location': random.choice(["Roma", "Milano", "Torino", ""]),
+        'plant_type': "",
+        'default_watering': 150
+    } for plant_id in range(1, plants + 1)]
+
+
+def fake_orchestrator(plants: int, results=None) -> GardenOrchestrator:
+    """
+    Build an orchestrator over a synthetic fleet, without DB server, MQTT broker nor background threads
+    :param plants: The number of plants in the fleet
+    :param results: Callable answering the DB queries, see fake_database
+    :return:
+    """
+    inventory = synthetic_inventory(plants)
+    db = fake_database(results or (lambda sql, values: ([], [])))
+    db.get_plant_inventory = lambda: inventory
+    go = GardenOrchestrator.__new__(GardenOrchestrator)
+    go.config = {"Site": {"is_test": True, "wait_watering": 0}, "DB": {}, "MQTT": {}}
+    go.logging = log
+    go.db = db
+    go.registry = PlantRegistry(log, db)
+    go.registry.load()
+    go.registration_lock = threading.RLock()
+    go.status_version = DataVersion()
+    go.history_version = DataVersion()
+    go.latest_state = LatestState(log, go.registry)
+    go.humidity_tracker = HumidityTracker(log, go.registry)
+    go.humidity_tracker.started_at = datetime.datetime.now() - datetime.timedelta(hours=1)
+    go.watering_windows = WateringWindows(log)
+    go.watering_cycle_lock = threading.Lock()
+    # A plain stub, a MagicMock recording every call would cost more than the parsing being measured
+    go.detection_writer = SimpleNamespace(submit=lambda plant_id, humidity, sensor_id, timestamp=None: None,
+                                          submit_many=lambda rows: [None] * len(rows))
+    go.spool = None
+    go.ingestion_store = db
+    # Not started, the acks are only queued
+    go.watering_tracker = WateringTracker(log, db)
+    go.mqttc = MagicMock()
+    go.mqttBroker = MagicMock()
+    go.shared_group = ""
+    go.role = "standalone"
+    go.registry_topic = "garden/registry"
+    now = datetime.datetime.now()
+    for plant in inventory:
+        for minutes in range(0, 15, 3):
+            timestamp = now - datetime.timedelta(minutes=minutes)
+            humidity = random.randint(20, 90)
+            go.latest_state.update_detection(plant['plant_id'], humidity, timestamp)
+            go.humidity_tracker.add_detection(plant['plant_id'], humidity, timestamp)
+    return go
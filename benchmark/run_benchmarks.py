@@ -0,0 +1,95 @@
+"""
+Microbenchmarks of the ingestion and query layers, using local stand-ins for MariaDB and MQTT.
+
+    python benchmark/run_benchmarks.py --save benchmark/baseline.json
+    python benchmark/run_benchmarks.py --compare benchmark/baseline.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from cases import cases
+
+
+def measure(number: int, function, repeat: int) -> float:
+    """
+    Time the callable
+    :return: The best time per call, in seconds
+    """
+    function()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(selected: str, repeat: int) -> dict:
+    results = {}
+    for name, number, setup in cases:
+        if selected and selected not in name:
+            continue
+        per_call = measure(number, setup(), repeat)
+        results[name] = {'seconds_per_call': per_call, 'calls_per_second': 1 / per_call if per_call else None}
+        print(f"{name:<36} {per_call * 1e6:>14.2f} us/call")
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Compare the results with a baseline
+    :return: The names of the regressed benchmarks
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get('results', {}).get(name)
+        if not reference:
+            continue
+        ratio = result['seconds_per_call'] / reference['seconds_per_call']
+        status = "REGRESSION" if ratio > 1 + threshold else "ok"
+        if status != "ok":
+            regressions.append(name)
+        print(f"{name:<36} {ratio:>8.2f}x baseline  {status}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="Run only the benchmarks containing this text")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs of each benchmark, the best one is kept")
+    parser.add_argument("--save", help="Save the results as JSON baseline")
+    parser.add_argument("--compare", help="Compare the results with a JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Slowdown tolerated before reporting a regression")
+    args = parser.parse_args()
+
+    results = run(args.filter, args.repeat)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': results
+            }, f, indent=2)
+        print(f"Baseline saved in {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmarks regressed more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
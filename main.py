@@ -1,18 +1,25 @@
+import datetime
 import logging
+import signal
+import threading
+import time
 
-from flask import Flask, url_for, redirect, jsonify, request
+from flask import Flask, url_for, redirect, jsonify, request, g, Response, stream_with_context
 from flask_cors import CORS
 from waitress import serve
 
 from GardenOrchestrator import GardenOrchestrator
+from Metrics import metrics
 
+HTTP_LATENCY = metrics.histogram("garden_http_request_seconds", "HTTP request latency, by route", ("route", "method", "status"))
 
-def main():
-    go = GardenOrchestrator()
-    #Start scheduler
-    scheduler = go.setScheduler()
-    scheduler.start()
-    #Start website
+
+def create_app(go):
+    """
+    Build the API application on top of the orchestrator
+    :param go: The garden orchestrator
+    :return: The Flask application
+    """
     app = Flask(__name__)
     app.config['SECRET_KEY'] = go.getAppSecret()
     app.config['CORS_HEADERS'] = 'Content-Type'
@@ -23,26 +30,111 @@ def main():
          methods=['GET', 'POST', 'OPTIONS']
          )
 
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_latency(response):
+        # The route template keeps the label bounded, whatever the plant ID
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_LATENCY.observe(time.perf_counter() - g.request_start, route, request.method, str(response.status_code))
+        return response
+
     @app.route("/")
     def home():
         return redirect(url_for('show_status'))
 
+    def conditional(version, build, valid_from=None):
+        """
+        Answer 304 when the client already has the current version of the data, otherwise build the JSON response
+        :param version: The DataVersion of the data behind the route
+        :param build: Callable returning the response content
+        :param valid_from: Start of the time slot the response depends on
+        :return:
+        """
+        etag, last_modified = version.validators(valid_from)
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+        if not_modified:
+            response = Response(status=304)
+        else:
+            response = jsonify(build())
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # Let the clients cache the data but always revalidate it
+        response.cache_control.no_cache = True
+        return response
+
+    def statistics(plant_id, duration, granularity="hour"):
+        # The statistics window moves forward every hour
+        current_hour = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+        is_columnar = columnar()
+        return conditional(go.history_version,
+                           lambda: go.get_plant_statistics(plant_id, duration, granularity, is_columnar),
+                           current_hour)
+
+    def columnar():
+        """Check if the client asked for the values grouped by column with ?format=columnar"""
+        return request.args.get('format') == 'columnar'
+
     @app.route("/status")
     def show_status():
-        res = go.get_plant_recap()
-        return jsonify(res)
+        is_columnar = columnar()
+        return conditional(go.status_version, lambda: go.get_plant_recap(is_columnar))
 
     @app.route("/statistic/daily/<plant_id>", methods=['GET'])
     def get_daily_statistics(plant_id):
         duration = 1
-        res = go.get_plant_statistics(plant_id, duration)
-        return jsonify(res)
+        return statistics(plant_id, duration)
 
     @app.route("/statistic/weekly/<plant_id>", methods=['GET'])
     def get_weekly_statistics(plant_id):
         duration = 7
-        res = go.get_plant_statistics(plant_id, duration)
-        return jsonify(res)
+        return statistics(plant_id, duration)
+
+    @app.route("/statistic/monthly/<plant_id>", methods=['GET'])
+    def get_monthly_statistics(plant_id):
+        duration = 30
+        return statistics(plant_id, duration)
+
+    @app.route("/statistic/yearly/<plant_id>", methods=['GET'])
+    def get_yearly_statistics(plant_id):
+        duration = 365
+        return statistics(plant_id, duration, "day")
+
+    @app.route("/export", methods=['GET'])
+    def export_all_history():
+        return export_history(None)
+
+    @app.route("/export/<plant_id>", methods=['GET'])
+    def export_history(plant_id):
+        """Stream the raw detections between ?from= and ?to= (ISO dates, default last 7 days) as ?format=csv or ndjson"""
+        export_format = request.args.get('format', 'csv')
+        try:
+            until = datetime.datetime.fromisoformat(request.args['to']) if 'to' in request.args else datetime.datetime.now()
+            since = datetime.datetime.fromisoformat(request.args['from']) if 'from' in request.args else until - datetime.timedelta(days=7)
+            plant_id = int(plant_id) if plant_id is not None else None
+            chunks = go.export_history(plant_id, since, until, export_format)
+        except ValueError as e:
+            return jsonify("Cannot export history [" + str(e) + "]"), 400
+        if export_format == "csv":
+            mimetype, extension = "text/csv", "csv"
+        else:
+            mimetype, extension = "application/x-ndjson", "ndjson"
+        filename = "history_" + (str(plant_id) if plant_id is not None else "all") + "." + extension
+        return Response(stream_with_context(chunks), mimetype=mimetype,
+                        headers={"Content-Disposition": "attachment; filename=" + filename})
+
+    @app.route("/stats/ingestion")
+    def get_ingestion_stats():
+        return jsonify(go.get_ingestion_stats())
+
+    @app.route("/metrics")
+    def get_metrics():
+        return Response(go.get_metrics(), mimetype="text/plain; version=0.0.4")
 
     @app.route("/install")
     def install():
@@ -51,6 +143,11 @@ def main():
         else:
             return jsonify("KO - Cannot setup database")
 
+    @app.route("/install/rollup")
+    def backfill_rollup():
+        rows = go.backfill_statistics()
+        return jsonify("OK - Hourly statistics backfilled [" + str(rows) + " rows]")
+
     @app.route("/add/plant")
     def add_plant():
         plant_name = "test222"
@@ -98,13 +195,50 @@ def main():
         plant_id = 1
         sensor_id = 1
         humidity = 56
-        if go.add_detection(plant_id, humidity, sensor_id):
+        if go.add_detection(plant_id, humidity, sensor_id).result():
             return jsonify("Added detection [" + str(plant_id) + "]")
         else:
             return jsonify("Cannot add detection for plant [" + str(plant_id) + "]")
 
+    return app
+
+
+def run_ingestion_worker(go):
+    """
+    Only ingest the share of the sensor messages of this worker, the coordinator of the group runs the watering
+    decisions and the API
+    :param go: The garden orchestrator
+    :return:
+    """
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    go.logging.info("Ingestion worker started - No scheduler nor API in this process")
+    try:
+        stopping.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        go.shutdown()
+
+
+def main():
+    go = GardenOrchestrator()
+    if go.role == 'ingestion':
+        run_ingestion_worker(go)
+        return
+    #Start scheduler
+    scheduler = go.setScheduler()
+    scheduler.start()
+    #Start website
+    app = create_app(go)
     #Start webserver
-    serve(app, host='0.0.0.0', port=go.get_port())
+    try:
+        serve(app, host='0.0.0.0', port=go.get_port())
+    finally:
+        # No new watering evaluation while the pending work is flushed
+        scheduler.stop()
+        scheduler.join()
+        go.shutdown()
 
 
 if __name__ == '__main__':
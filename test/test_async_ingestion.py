@@ -0,0 +1,102 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import threading
+import pytest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from AsyncDetectionWriter import AsyncDetectionWriter
+from AsyncMqttClient import AsyncMqttClient
+
+
+@pytest.fixture
+def mock_db():
+    db = MagicMock()
+    db.insert_plant_detections.side_effect = lambda rows: list(range(1, len(rows) + 1))
+    return db
+
+
+@pytest.fixture
+def writer(mock_db):
+    writer = AsyncDetectionWriter(MagicMock(), mock_db, batch_size=3, max_latency=0.05)
+    writer.start()
+    yield writer
+    writer.stop(1)
+
+
+def test_flush_on_batch_size(writer, mock_db):
+    writer.max_latency = 60
+    futures = [writer.submit(plant, 40, 7) for plant in (1, 2, 3)]
+
+    assert [f.result(timeout=1) for f in futures] == [1, 2, 3]
+    rows = mock_db.insert_plant_detections.call_args[0][0]
+    assert [row[:3] for row in rows] == [(1, 40, 7), (2, 40, 7), (3, 40, 7)]
+
+
+def test_flush_on_max_latency(writer):
+    assert writer.submit(1, 40, 7).result(timeout=1) == 1
+
+
+def test_stop_flushes_pending_detections(mock_db):
+    writer = AsyncDetectionWriter(MagicMock(), mock_db, batch_size=100, max_latency=60)
+    writer.start()
+    future = writer.submit(1, 40, 7)
+
+    writer.stop(1)
+
+    assert future.result(timeout=0) == 1
+    assert not writer.is_alive()
+    assert writer.submit(2, 40, 7).result(timeout=0) == 1
+
+
+def test_db_error_is_propagated_to_futures(writer, mock_db):
+    mock_db.insert_plant_detections.side_effect = RuntimeError("DB down")
+
+    future = writer.submit(1, 40, 7)
+
+    with pytest.raises(RuntimeError):
+        future.result(timeout=1)
+
+
+def test_detections_are_handled_on_the_loop_and_acks_offloaded(writer):
+    client = AsyncMqttClient({}, MagicMock(), MagicMock(), writer.loop)
+    threads = {}
+
+    def handle(log, message, topic, go, register_unknown=True):
+        threads[message] = threading.current_thread()
+        return MagicMock()
+
+    async def deliver():
+        client.on_message(None, None, SimpleNamespace(payload=b"d2_55_3", topic="sensor/1"))
+        client.on_message(None, None, SimpleNamespace(payload=b"w_12", topic="sensor/1"))
+
+    with patch('AsyncMqttClient.MessageHandler', side_effect=handle) as handler:
+        handler.method_of = lambda message: message.split('_', 1)[0]
+        asyncio.run_coroutine_threadsafe(deliver(), writer.loop).result(timeout=1)
+        client.executor.shutdown(wait=True)
+
+    assert threads["d2_55_3"] is writer
+    assert threads["w_12"] is not writer
+    assert client.stats()['received'] == 2
+    assert client.stats()['handled'] == 2
+
+
+def test_unknown_plants_are_registered_off_the_loop(writer):
+    go = MagicMock()
+    go.registry.get_plant_ids.side_effect = lambda sensor_id, plant_nums: {plant_num: None for plant_num in plant_nums}
+    go.get_plant_id.side_effect = lambda sensor_id, plant_num: threads.append(threading.current_thread()) or 42
+    client = AsyncMqttClient({}, MagicMock(), go, writer.loop)
+    threads = []
+
+    async def deliver():
+        client.on_message(None, None, SimpleNamespace(payload=b"d2_55_3", topic="sensor/1"))
+
+    asyncio.run_coroutine_threadsafe(deliver(), writer.loop).result(timeout=1)
+    client.executor.shutdown(wait=True)
+
+    assert len(threads) == 1
+    assert threads[0] is not writer
+    go.add_detection.assert_called_once_with(42, 55, 1, None)
+    assert client.stats()['handled'] == 1
@@ -0,0 +1,195 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import datetime
+import struct
+import pytest
+from unittest.mock import MagicMock
+from BinaryPayload import BinaryPayload
+from MessageHandler import MessageHandler, RegistrationRequired, SEQUENCE_GAPS
+
+
+@pytest.fixture(autouse=True)
+def reset_sequences():
+    BinaryPayload._sequences.clear()
+
+
+@pytest.fixture
+def go():
+    go = MagicMock()
+    go.get_plant_id.return_value = 11
+    go.get_all_sensor_id.return_value = [7]
+    return go
+
+
+def test_detection_round_trip():
+    timestamp = datetime.datetime(2024, 5, 1, 12, 30)
+
+    message = BinaryPayload.decode(BinaryPayload.encode_detection(42, 3, 55, timestamp))
+
+    assert message == {'method': "d2", 'sequence': 42, 'plant_num': 3, 'humidity': 55, 'timestamp': timestamp}
+    assert BinaryPayload.decode(BinaryPayload.encode_detection(1, 3, 55))['timestamp'] is None
+
+
+def test_text_and_binary_payloads_are_told_apart():
+    payload = BinaryPayload.encode_detection(1, 3, 55)
+
+    assert BinaryPayload.decode_payload(payload) == payload
+    assert BinaryPayload.decode_payload(b"d2_55_3") == "d2_55_3"
+    assert MessageHandler.method_of(payload) == "d2"
+    assert MessageHandler.method_of("w_12") == "w"
+
+
+@pytest.mark.parametrize("payload", [
+    b"\xa5\x01",
+    b"\xa5\x02\x01\x00\x00\x01\x03\x00\x37",
+    b"\xa5\x01\x09\x00\x00\x01\x03\x00\x37",
+    BinaryPayload.encode_detection(1, 3, 55) + b"\x00",
+])
+def test_invalid_payloads_are_rejected(payload):
+    with pytest.raises(ValueError):
+        BinaryPayload.decode(payload)
+
+
+def test_sequence_tracking():
+    window = BinaryPayload.SEQUENCE_WINDOW
+    assert BinaryPayload.track_sequence(7, 65534) == 0
+    assert BinaryPayload.track_sequence(7, 65535) == 0
+    assert BinaryPayload.track_sequence(7, 65535) == -1
+    # 0 and 1 are holes until they slide out of the window
+    assert BinaryPayload.track_sequence(7, 2) == 0
+    assert BinaryPayload.track_sequence(7, window - 1) == 0
+    assert BinaryPayload.track_sequence(7, window + 1) == 2
+    # The holes 3 to 62 and 64, then 66 to 128 skipped beyond the window at once
+    assert BinaryPayload.track_sequence(7, 192) == 60 + 1 + 63
+
+
+def test_reordered_sequence_is_not_a_gap():
+    assert [BinaryPayload.track_sequence(7, sequence) for sequence in (5, 7, 6, 8)] == [0, 0, 0, 0]
+    # Late duplicates are recognized, the last sequence number never moves back
+    assert BinaryPayload.track_sequence(7, 6) == -1
+    assert BinaryPayload.track_sequence(7, 5) == -1
+    assert BinaryPayload.track_sequence(7, 9) == 0
+    # The numbers before the first one are not holes
+    assert BinaryPayload.track_sequence(7, 9 + BinaryPayload.SEQUENCE_WINDOW) == 0
+    # Too late to be told apart from a repeated message
+    assert BinaryPayload.track_sequence(7, 9) == 0
+
+
+def test_restart_counts_the_pending_holes():
+    for sequence in (1, 4):
+        BinaryPayload.track_sequence(7, sequence)
+
+    assert BinaryPayload.reset_sequence(7) == 2
+    assert BinaryPayload.reset_sequence(7) == 0
+
+
+def test_reordered_binary_detections_are_all_queued(go):
+    gaps = SEQUENCE_GAPS.value()
+
+    for sequence in (5, 7, 6, 8):
+        MessageHandler(MagicMock(), BinaryPayload.encode_detection(sequence, 3, 55), "sensor/7", go).run()
+    MessageHandler(MagicMock(), BinaryPayload.encode_detection(8 + BinaryPayload.SEQUENCE_WINDOW, 3, 55), "sensor/7", go).run()
+
+    assert go.add_detection.call_count == 5
+    assert SEQUENCE_GAPS.value() - gaps == 0
+
+
+def test_binary_detection_is_queued(go):
+    timestamp = datetime.datetime(2024, 5, 1, 12, 30)
+
+    MessageHandler(MagicMock(), BinaryPayload.encode_detection(1, 3, 55, timestamp), "sensor/7", go).run()
+
+    go.get_plant_id.assert_called_once_with(7, 3)
+    go.add_detection.assert_called_once_with(11, 55, 7, timestamp)
+
+
+def test_repeated_binary_detection_is_discarded(go):
+    payload = BinaryPayload.encode_detection(1, 3, 55)
+
+    MessageHandler(MagicMock(), payload, "sensor/7", go).run()
+    MessageHandler(MagicMock(), payload, "sensor/7", go).run()
+
+    assert go.add_detection.call_count == 1
+
+
+def test_binary_watering_ack(go):
+    payload = struct.pack("!BBBBHI", 0xA5, 1, BinaryPayload.WATERING_ACK, 0, 1, 1234)
+
+    MessageHandler(MagicMock(), payload, "sensor/7", go).run()
+
+    go.ack_watering.assert_called_once_with(1234)
+
+
+def test_binary_greeting_resets_the_sequence(go):
+    BinaryPayload.track_sequence(7, 500)
+    payload = struct.pack("!BBBBHI", 0xA5, 1, BinaryPayload.GREETING, 0, 0, 7)
+
+    MessageHandler(MagicMock(), payload, "greeting", go).run()
+
+    assert BinaryPayload.track_sequence(7, 0) == 0
+    go.add_sensor.assert_not_called()
+
+
+def test_text_greeting_resets_the_sequence(go):
+    BinaryPayload.track_sequence(7, 500)
+
+    MessageHandler(MagicMock(), "s_7", "greeting", go).run()
+
+    assert BinaryPayload.track_sequence(7, 0) == 0
+
+
+def test_text_detection_still_works(go):
+    MessageHandler(MagicMock(), "d2_55_3", "sensor/7", go).run()
+
+    go.add_detection.assert_called_once_with(11, 55, 7, None)
+
+
+def test_batch_round_trip():
+    timestamp = datetime.datetime(2024, 5, 1, 12, 30)
+
+    message = BinaryPayload.decode(BinaryPayload.encode_batch(9, [(0, 55), (1, 140)], timestamp))
+
+    assert message == {'method': "b", 'sequence': 9, 'readings': [(0, 55), (1, 140)], 'timestamp': timestamp}
+    with pytest.raises(ValueError):
+        BinaryPayload.decode(BinaryPayload.encode_batch(9, [(0, 55), (1, 140)])[:-1])
+
+
+@pytest.mark.parametrize("payload", ["b_0:55,1:140,2:60", BinaryPayload.encode_batch(1, [(0, 55), (1, 140), (2, 60)])])
+def test_batch_detections_are_resolved_and_queued_together(go, payload):
+    go.get_plant_ids.return_value = {0: 10, 1: 11, 2: 12}
+
+    MessageHandler(MagicMock(), payload, "sensor/7", go).run()
+
+    go.get_plant_ids.assert_called_once_with(7, [0, 1, 2])
+    go.add_detections.assert_called_once_with(7, [(10, 55, None), (12, 60, None)])
+    go.add_detection.assert_not_called()
+
+
+def test_negative_humidity_is_not_queued(go):
+    go.get_plant_ids.return_value = {0: 10, 1: 11, 2: 12}
+
+    MessageHandler(MagicMock(), "b_0:55,1:-5,2:60", "sensor/7", go).run()
+
+    go.add_detections.assert_called_once_with(7, [(10, 55, None), (12, 60, None)])
+
+
+@pytest.mark.parametrize("message", ["b_", "b_0:55,1", "b_0:x"])
+def test_invalid_text_batch_is_rejected(go, message):
+    MessageHandler(MagicMock(), message, "sensor/7", go).run()
+
+    go.add_detections.assert_not_called()
+
+
+@pytest.mark.parametrize("payload", ["d2_55_3", BinaryPayload.encode_detection(1, 3, 55)])
+def test_unknown_plant_is_left_to_a_registering_handler(go, payload):
+    go.registry.get_plant_ids.return_value = {3: None}
+
+    with pytest.raises(RegistrationRequired):
+        MessageHandler(MagicMock(), payload, "sensor/7", go, register_unknown=False).run()
+    go.get_plant_id.assert_not_called()
+
+    # The retry is not mistaken for a repeated message
+    MessageHandler(MagicMock(), payload, "sensor/7", go).run()
+    go.add_detection.assert_called_once_with(11, 55, 7, None)
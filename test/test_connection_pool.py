@@ -0,0 +1,114 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import threading
+import pytest
+from unittest.mock import MagicMock
+from ConnectionPool import ConnectionPool, PoolTimeoutError
+
+
+@pytest.fixture
+def factory():
+    return MagicMock(side_effect=lambda: MagicMock())
+
+
+def test_pool_prefills_min_size(factory):
+    pool = ConnectionPool(factory, MagicMock(), min_size=2, max_size=4)
+
+    assert factory.call_count == 2
+    assert pool.stats() == {'size': 2, 'idle': 2, 'in_use': 0, 'max_size': 4}
+
+
+def test_connection_is_reused(factory):
+    pool = ConnectionPool(factory, MagicMock(), min_size=1, max_size=2)
+
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+
+    assert first is second
+    assert factory.call_count == 1
+
+
+def test_acquire_times_out_when_pool_is_full(factory):
+    pool = ConnectionPool(factory, MagicMock(), min_size=0, max_size=1, acquire_timeout=0.05)
+    con = pool.acquire()
+
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+
+    pool.release(con)
+    assert pool.acquire() is con
+
+
+def test_waiting_thread_gets_released_connection(factory):
+    pool = ConnectionPool(factory, MagicMock(), min_size=0, max_size=1, acquire_timeout=2)
+    con = pool.acquire()
+    acquired = []
+
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    pool.release(con)
+    waiter.join(1)
+
+    assert acquired == [con]
+
+
+def test_failed_connection_is_discarded(factory):
+    pool = ConnectionPool(factory, MagicMock(), min_size=1, max_size=1)
+
+    with pytest.raises(RuntimeError):
+        with pool.connection() as con:
+            raise RuntimeError("query failed")
+
+    con.close.assert_called_once()
+    assert pool.stats()['size'] == 0
+    with pool.connection() as new_con:
+        assert new_con is not con
+
+
+def test_unhealthy_idle_connection_is_replaced(factory):
+    validator = MagicMock(side_effect=ConnectionError())
+    pool = ConnectionPool(factory, MagicMock(), min_size=1, max_size=1, health_check_interval=0, validator=validator)
+    stale = pool.acquire()
+    pool.release(stale)
+
+    con = pool.acquire()
+
+    assert con is not stale
+    stale.close.assert_called_once()
+
+
+def test_idle_connections_above_min_size_are_recycled(factory):
+    pool = ConnectionPool(factory, MagicMock(), min_size=1, max_size=3, idle_timeout=0)
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+
+    pool.acquire()
+
+    first.close.assert_called_once()
+    assert pool.stats()['size'] == 1
+
+
+def test_released_connection_is_rolled_back(factory):
+    pool = ConnectionPool(factory, MagicMock(), min_size=1, max_size=1)
+
+    with pool.connection() as con:
+        pass
+
+    con.rollback.assert_called_once()
+    assert pool.stats() == {'size': 1, 'idle': 1, 'in_use': 0, 'max_size': 1}
+
+
+def test_connection_failing_rollback_is_discarded(factory):
+    pool = ConnectionPool(factory, MagicMock(), min_size=1, max_size=1)
+    con = pool.acquire()
+    con.rollback.side_effect = ConnectionError()
+
+    pool.release(con)
+
+    con.close.assert_called_once()
+    assert pool.stats()['size'] == 0
@@ -0,0 +1,72 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import datetime
+import pytest
+from unittest.mock import MagicMock
+from DataVersion import DataVersion
+from main import create_app
+
+
+@pytest.fixture
+def go():
+    go = MagicMock()
+    go.getAppSecret.return_value = "secret"
+    go.get_allowed_cors_sites.return_value = ['*']
+    go.status_version = DataVersion()
+    go.history_version = DataVersion()
+    go.get_plant_recap.return_value = [{'plant_id': 1}]
+    go.get_plant_statistics.return_value = []
+    return go
+
+
+def test_bump_changes_etag():
+    version = DataVersion()
+    etag, _ = version.validators()
+
+    version.bump()
+
+    assert version.validators()[0] != etag
+
+
+def test_time_slot_is_part_of_validators():
+    version = DataVersion()
+    slot = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0) + datetime.timedelta(hours=1)
+
+    etag, last_modified = version.validators(slot)
+
+    assert etag != version.validators()[0]
+    assert last_modified == slot
+
+
+def test_status_answers_304_without_reading_data(go):
+    client = create_app(go).test_client()
+    first = client.get("/status")
+
+    second = client.get("/status", headers={"If-None-Match": first.headers["ETag"]})
+
+    assert first.status_code == 200
+    assert second.status_code == 304
+    assert go.get_plant_recap.call_count == 1
+
+
+def test_status_is_rebuilt_after_a_change(go):
+    client = create_app(go).test_client()
+    first = client.get("/status")
+    go.status_version.bump()
+
+    second = client.get("/status", headers={"If-None-Match": first.headers["ETag"]})
+
+    assert second.status_code == 200
+    assert second.headers["ETag"] != first.headers["ETag"]
+
+
+def test_statistics_honour_if_modified_since(go):
+    client = create_app(go).test_client()
+    first = client.get("/statistic/weekly/1")
+
+    second = client.get("/statistic/weekly/1", headers={"If-Modified-Since": first.headers["Last-Modified"]})
+
+    assert second.status_code == 304
+    assert go.get_plant_statistics.call_count == 1
@@ -0,0 +1,323 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import datetime
+import pytest
+from unittest.mock import MagicMock, patch
+from Database import Database
+from StorageBackend import StorageError
+
+
+@pytest.fixture(params=[":memory:", "file"])
+def db(request, tmp_path):
+    path = ":memory:" if request.param == ":memory:" else str(tmp_path / "garden.db")
+    db = Database({'backend': 'sqlite', 'sqlite_path': path}, MagicMock())
+    db.insert_new_plant(10, "Basil", 0, "", "Roma", "")
+    db.insert_new_plant(10, "Mint", 1, "", "Roma", "")
+    yield db
+    db.disconnect()
+
+
+def test_batch_insert_returns_ids_and_rolls_up(db):
+    hour = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+    ids = db.insert_plant_detections([(1, 40, 10, hour), (1, 50, 10, hour), (2, 30, 10, hour)])
+    ids += db.insert_plant_detections([(1, 60, 10, hour + datetime.timedelta(minutes=1))])
+
+    assert ids == [1, 2, 3, 4]
+    rows = db.get_values_from_db("SELECT * FROM plant_history_hourly WHERE plant_id = ?", (1,))
+    assert rows == [{'plant_id': 1, 'hour_ts': hour, 'hum_sum': 150, 'hum_count': 3, 'hum_min': 40, 'hum_max': 60}]
+    statistics = db.get_plant_statistics(1, 1)
+    assert statistics[0]['Value'] == 50
+    assert statistics[0]['Date'] == hour.date()
+    assert statistics[0]['Hour'] == hour.hour
+
+
+def test_action_summary_reports_elapsed_time(db):
+    now = datetime.datetime.now()
+    db.insert_plant_detections([(1, 40, 10, now), (1, 45, 10, now)])
+    watering_id = db.insert_plant_watering(1, 150)
+    db.ack_watering(watering_id)
+
+    summary = db.get_plant_action_summary()
+
+    assert len(summary) == 1
+    assert summary[0]['plant_name'] == "Basil"
+    assert summary[0]['mean_value'] == 43
+    assert datetime.timedelta(0) <= summary[0]['last_watering_successful'] < datetime.timedelta(minutes=1)
+
+
+def test_last_detections_lists_every_plant(db):
+    db.insert_plant_detections([(1, 40, 10, datetime.datetime(2024, 5, 1, 10)), (1, 45, 10, datetime.datetime(2024, 5, 1, 11))])
+
+    recap = db.get_plant_last_detections()
+
+    assert [row['plant_id'] for row in recap] == [1, 2]
+    assert recap[0]['plant_hum'] == 45
+    assert recap[0]['detection_ts'] == datetime.datetime(2024, 5, 1, 11)
+    assert recap[1]['plant_hum'] is None
+
+
+def test_retention_deletes_old_rows_and_folds_hourly(db):
+    old = datetime.datetime.now().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(days=40)
+    db.insert_plant_detections([(1, 40, 10, old), (1, 60, 10, old), (1, 50, 10, datetime.datetime.now())])
+
+    report = db.apply_retention(30, 30)
+
+    assert report['raw_rows'] == 2
+    assert report['hourly_rows'] == 1
+    daily = db.get_values_from_db("SELECT * FROM plant_history_daily")
+    assert daily == [{'plant_id': 1, 'day': old.date(), 'hum_sum': 100, 'hum_count': 2, 'hum_min': 40, 'hum_max': 60}]
+
+
+def test_stream_plant_history_yields_batches(db):
+    start = datetime.datetime(2024, 5, 1, 10)
+    db.insert_plant_detections([(1 + i % 2, 40 + i, 10, start + datetime.timedelta(minutes=i)) for i in range(5)])
+
+    stream = db.stream_plant_history(1, start, start + datetime.timedelta(hours=1), batch_size=2)
+
+    assert next(stream) == ['detection_id', 'plant_id', 'plant_hum', 'nodemcu_id', 'timestamp']
+    batches = list(stream)
+    assert [len(rows) for rows in batches] == [2, 1]
+    assert [row[2] for rows in batches for row in rows] == [40, 42, 44]
+    assert batches[0][0][4] == start
+
+
+def test_columnar_statistics_group_values_by_column(db):
+    hour = datetime.datetime.now().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=1)
+    db.insert_plant_detections([(1, 40, 10, hour), (1, 60, 10, hour + datetime.timedelta(hours=1))])
+
+    statistics = db.get_plant_statistics(1, 1, columnar=True)
+
+    assert statistics['columns'] == ['plant_id', 'Value', 'Date', 'Hour']
+    assert statistics['data']['Value'] == [40, 60]
+    assert statistics['data']['Date'][0] == hour.date()
+    assert db.get_plant_statistics(2, 1, columnar=True)['data'] == {'plant_id': [], 'Value': [], 'Date': [], 'Hour': []}
+
+
+def test_schema_migrations_are_recorded_and_not_replayed(tmp_path):
+    config = {'backend': 'sqlite', 'sqlite_path': str(tmp_path / "garden.db")}
+    db = Database(config, MagicMock())
+    assert db.get_schema_version() == Database.migrations[-1][0]
+    db.disconnect()
+
+    with patch.object(Database, "create_table") as create_table:
+        db = Database(config, MagicMock())
+
+    create_table.assert_not_called()
+    db.disconnect()
+
+
+def test_missing_migrations_are_applied(tmp_path):
+    config = {'backend': 'sqlite', 'sqlite_path': str(tmp_path / "garden.db")}
+    db = Database(config, MagicMock())
+    db.execute_transaction([("DELETE FROM schema_version WHERE version > ?", (2,))])
+
+    assert db.get_schema_version() == 2
+    assert db.install()
+    rows = db.get_values_from_db("SELECT version FROM schema_version ORDER BY version")
+    assert [row['version'] for row in rows] == [number for number, _, _ in Database.migrations]
+    db.disconnect()
+
+
+def test_plant_reference_is_unique(db):
+    with pytest.raises(db.backend.Error):
+        db.insert_new_plant(10, "Basil again", 0, "", "Roma", "")
+
+    assert db.get_plant_id(10, 0) == 1
+
+
+def test_rollup_upsert_merges_batches_of_the_same_hour(db):
+    hour = datetime.datetime(2024, 5, 1, 10)
+    db.insert_plant_detections([(1, 40, 10, hour), (2, 30, 10, hour + datetime.timedelta(hours=1))])
+    db.insert_plant_detections([(1, 70, 10, hour + datetime.timedelta(minutes=30)), (1, 20, 10, hour + datetime.timedelta(minutes=59))])
+
+    rows = db.get_values_from_db("SELECT * FROM plant_history_hourly ORDER BY plant_id, hour_ts")
+
+    assert rows == [
+        {'plant_id': 1, 'hour_ts': hour, 'hum_sum': 130, 'hum_count': 3, 'hum_min': 20, 'hum_max': 70},
+        {'plant_id': 2, 'hour_ts': hour + datetime.timedelta(hours=1), 'hum_sum': 30, 'hum_count': 1, 'hum_min': 30, 'hum_max': 30}
+    ]
+
+
+def test_backfill_rebuilds_past_hours_only(db):
+    current_hour = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+    past_hour = current_hour - datetime.timedelta(hours=2)
+    db.insert_plant_detections([(1, 40, 10, past_hour), (1, 60, 10, past_hour), (1, 50, 10, current_hour)])
+    db.execute_transaction([("DELETE FROM plant_history_hourly", ())])
+
+    db.backfill_hourly_rollup()
+
+    rows = db.get_values_from_db("SELECT * FROM plant_history_hourly")
+    assert rows == [{'plant_id': 1, 'hour_ts': past_hour, 'hum_sum': 100, 'hum_count': 2, 'hum_min': 40, 'hum_max': 60}]
+
+
+def test_backfill_skips_the_days_already_folded(db):
+    old = datetime.datetime.now().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(days=40)
+    recent = datetime.datetime.now().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(days=5)
+    db.insert_plant_detections([(1, 40, 10, old), (1, 60, 10, old), (1, 50, 10, recent)])
+    # Keep the raw detections, fold the hourly aggregates older than 30 days
+    db.apply_retention(0, 30)
+
+    db.backfill_hourly_rollup()
+
+    hourly = db.get_values_from_db("SELECT hour_ts FROM plant_history_hourly")
+    assert hourly == [{'hour_ts': recent}]
+    daily = db.get_values_from_db("SELECT hum_count FROM plant_history_daily")
+    assert daily == [{'hum_count': 2}]
+
+
+def test_backfill_skips_the_hours_older_than_the_retention(db):
+    old = datetime.datetime.now().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(days=40)
+    db.insert_plant_detections([(1, 40, 10, old)])
+    db.execute_transaction([("DELETE FROM plant_history_hourly", ())])
+
+    assert db.backfill_hourly_rollup(30) == 0
+    assert db.get_values_from_db("SELECT * FROM plant_history_hourly") == []
+
+
+def test_backfill_without_retention_has_no_lower_bound(db):
+    con = MagicMock()
+    db.get_connection = MagicMock()
+    db.get_connection.return_value.__enter__.return_value = con
+
+    db.backfill_hourly_rollup()
+
+    sql, parameters = con.cursor.return_value.execute.call_args.args
+    # No sentinel date, out of the range of a MariaDB TIMESTAMP
+    assert "ph.timestamp >=" not in sql
+    assert parameters == (datetime.datetime.now().replace(minute=0, second=0, microsecond=0),)
+
+
+@pytest.fixture
+def partitioned():
+    """A Database on a fake MariaDB backend, recording the DDL instead of running it"""
+    db = Database.__new__(Database)
+    db.config = {}
+    db.logging = MagicMock()
+    db.backend = MagicMock(partitioning=True)
+    db.get_values_from_db = MagicMock()
+    db.create_table = MagicMock(return_value=True)
+    return db
+
+
+def month_bound(month: datetime.date) -> str:
+    """The PARTITION_DESCRIPTION of the partition of the month, as read from information_schema"""
+    return str(int(datetime.datetime.combine(Database.next_month(month), datetime.time()).timestamp()))
+
+
+def test_partition_definitions_end_with_the_catch_all():
+    definitions = Database.partition_definitions([datetime.date(2024, 11, 1), datetime.date(2024, 12, 1)])
+
+    assert definitions == ("PARTITION p202411 VALUES LESS THAN (UNIX_TIMESTAMP('2024-12-01 00:00:00')), "
+                           "PARTITION p202412 VALUES LESS THAN (UNIX_TIMESTAMP('2025-01-01 00:00:00')), "
+                           "PARTITION pfuture VALUES LESS THAN MAXVALUE")
+    assert Database.partition_months(datetime.datetime(2024, 11, 20, 8), datetime.date(2025, 1, 1)) == [
+        datetime.date(2024, 11, 1), datetime.date(2024, 12, 1), datetime.date(2025, 1, 1)]
+
+
+def test_history_partition_bounds_are_parsed(partitioned):
+    partitioned.get_values_from_db.return_value = [
+        {'name': 'p202411', 'bound': '1733011200', 'table_rows': 10, 'bytes': 16384},
+        {'name': 'pfuture', 'bound': 'MAXVALUE', 'table_rows': 0, 'bytes': 16384}
+    ]
+
+    partitions = partitioned.get_history_partitions()
+
+    assert [p['bound'] for p in partitions] == [1733011200, None]
+    assert partitioned.get_values_from_db.call_args.args[1] == ("plant_history",)
+
+
+def test_unpartitioned_history_is_converted(partitioned):
+    first_ts = datetime.datetime.combine(datetime.date.today().replace(day=1), datetime.time())
+    partitioned.get_values_from_db.side_effect = [[], [{'first_ts': first_ts}]]
+
+    assert partitioned.partition_plant_history()
+
+    primary_key, partitions = [c.args[0] for c in partitioned.create_table.call_args_list]
+    assert "ADD CONSTRAINT detection_id_PK PRIMARY KEY (detection_id, timestamp)" in primary_key
+    assert "PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp))" in partitions
+    months = Database.partition_months(first_ts, partitioned.last_partition_month())
+    assert len(months) == Database.partition_months_ahead + 1
+    assert partitions.strip().endswith("(" + Database.partition_definitions(months) + ");")
+
+
+def test_missing_partitions_are_split_from_the_catch_all(partitioned):
+    this_month = datetime.date.today().replace(day=1)
+    partitioned.get_values_from_db.return_value = [
+        {'name': Database.partition_name(this_month), 'bound': month_bound(this_month), 'table_rows': 0, 'bytes': 0},
+        {'name': 'pfuture', 'bound': 'MAXVALUE', 'table_rows': 0, 'bytes': 0}
+    ]
+
+    assert partitioned.ensure_history_partitions()
+
+    ddl = partitioned.create_table.call_args.args[0]
+    missing = Database.partition_months(Database.next_month(this_month), partitioned.last_partition_month())
+    assert "REORGANIZE PARTITION pfuture INTO (" + Database.partition_definitions(missing) + ");" in ddl
+    assert Database.partition_name(this_month) not in ddl
+
+
+def test_no_partition_is_added_when_all_exist(partitioned):
+    months = Database.partition_months(datetime.date.today(), partitioned.last_partition_month())
+    partitioned.get_values_from_db.return_value = [
+        {'name': Database.partition_name(month), 'bound': month_bound(month), 'table_rows': 0, 'bytes': 0} for month in months
+    ] + [{'name': 'pfuture', 'bound': 'MAXVALUE', 'table_rows': 0, 'bytes': 0}]
+
+    assert partitioned.ensure_history_partitions()
+
+    partitioned.create_table.assert_not_called()
+
+
+def test_retention_drops_only_the_expired_partitions(partitioned):
+    this_month = datetime.date.today().replace(day=1)
+    # The partition ending 3 months ago is expired after 60 days, the one ending this month is not
+    old_month = this_month
+    for _ in range(4):
+        old_month = (old_month - datetime.timedelta(days=1)).replace(day=1)
+    last_month = (this_month - datetime.timedelta(days=1)).replace(day=1)
+    partitioned.get_values_from_db.return_value = [
+        {'name': Database.partition_name(old_month), 'bound': month_bound(old_month), 'table_rows': 120, 'bytes': 4096},
+        {'name': Database.partition_name(last_month), 'bound': month_bound(last_month), 'table_rows': 30, 'bytes': 1024},
+        {'name': 'pfuture', 'bound': 'MAXVALUE', 'table_rows': 0, 'bytes': 0}
+    ]
+
+    report = partitioned.apply_retention(60, 0)
+
+    partitioned.create_table.assert_called_once_with("ALTER TABLE plant_history DROP PARTITION " + Database.partition_name(old_month) + ";")
+    assert report['raw_partitions'] == [Database.partition_name(old_month)]
+    assert report['raw_rows'] == 120
+    assert report['raw_bytes'] == 4096
+
+
+def test_duplicate_plants_are_merged_before_the_unique_index(tmp_path):
+    config = {'backend': 'sqlite', 'sqlite_path': str(tmp_path / "garden.db")}
+    db = Database(config, MagicMock())
+    hour = datetime.datetime(2024, 5, 1, 10)
+    # A DB created before the unique index, where /add/plant registered sensor 1 plant 1 twice
+    db.execute_transaction([("DROP INDEX plant_inventory_reference_UN", ()), ("DELETE FROM schema_version WHERE version = ?", (5,))])
+    for name in ("First", "Second", "Other"):
+        db.insert_new_plant(1, name, 1 if name != "Other" else 2, "", "Roma", "")
+    db.insert_plant_detections([(1, 40, 1, hour), (2, 60, 1, hour), (2, 50, 1, hour + datetime.timedelta(days=1)), (3, 30, 1, hour)])
+    db.insert_plant_watering(2, 150)
+    db.disconnect()
+
+    db = Database(config, MagicMock())
+
+    assert db.get_schema_version() == Database.migrations[-1][0]
+    assert [plant['plant_name'] for plant in db.get_plant_inventory()] == ["First", "Other"]
+    assert [row['plant_id'] for row in db.get_values_from_db("SELECT plant_id FROM plant_history ORDER BY detection_id")] == [1, 1, 1, 3]
+    assert db.get_values_from_db("SELECT plant_id FROM plant_water") == [{'plant_id': 1}]
+    hourly = db.get_values_from_db("SELECT * FROM plant_history_hourly WHERE plant_id = ? ORDER BY hour_ts", (1,))
+    assert [(row['hum_sum'], row['hum_count'], row['hum_min'], row['hum_max']) for row in hourly] == [(100, 2, 40, 60), (50, 1, 50, 50)]
+    assert db.get_values_from_db("SELECT COUNT(*) AS plants FROM plant_history_hourly WHERE plant_id = ?", (2,)) == [{'plants': 0}]
+    db.disconnect()
+
+
+def test_failed_migration_aborts_startup(tmp_path):
+    config = {'backend': 'sqlite', 'sqlite_path': str(tmp_path / "garden.db")}
+    Database(config, MagicMock()).disconnect()
+
+    with patch.object(Database, "get_schema_version", return_value=4), \
+            patch.object(Database, "unique_plant_reference", return_value=False):
+        with pytest.raises(StorageError):
+            Database(config, MagicMock())
@@ -0,0 +1,71 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from unittest.mock import MagicMock
+from DetectionWriter import DetectionWriter
+
+
+@pytest.fixture
+def mock_db():
+    db = MagicMock()
+    db.insert_plant_detections.side_effect = lambda rows: list(range(1, len(rows) + 1))
+    return db
+
+
+def test_flush_on_batch_size(mock_db):
+    writer = DetectionWriter(MagicMock(), mock_db, batch_size=3, max_latency=60)
+    writer.start()
+
+    futures = [writer.submit(plant, 40, 7) for plant in (1, 2, 3)]
+
+    assert [f.result(timeout=1) for f in futures] == [1, 2, 3]
+    mock_db.insert_plant_detections.assert_called_once()
+    rows = mock_db.insert_plant_detections.call_args[0][0]
+    assert [row[:3] for row in rows] == [(1, 40, 7), (2, 40, 7), (3, 40, 7)]
+    writer.stop(1)
+
+
+def test_flush_on_max_latency(mock_db):
+    writer = DetectionWriter(MagicMock(), mock_db, batch_size=100, max_latency=0.05)
+    writer.start()
+
+    future = writer.submit(1, 40, 7)
+
+    assert future.result(timeout=1) == 1
+    writer.stop(1)
+
+
+def test_stop_flushes_pending_detections(mock_db):
+    writer = DetectionWriter(MagicMock(), mock_db, batch_size=100, max_latency=60)
+    writer.start()
+    future = writer.submit(1, 40, 7)
+
+    writer.stop(1)
+
+    assert future.result(timeout=0) == 1
+    assert not writer.is_alive()
+
+
+def test_db_error_is_propagated_to_futures(mock_db):
+    mock_db.insert_plant_detections.side_effect = RuntimeError("DB down")
+    writer = DetectionWriter(MagicMock(), mock_db, batch_size=1, max_latency=60)
+    writer.start()
+
+    future = writer.submit(1, 40, 7)
+
+    with pytest.raises(RuntimeError):
+        future.result(timeout=1)
+    writer.stop(1)
+
+
+def test_submit_many_writes_a_single_batch(mock_db):
+    writer = DetectionWriter(MagicMock(), mock_db, batch_size=2, max_latency=60)
+    writer.start()
+
+    futures = writer.submit_many([(plant, 40, 7, None) for plant in (1, 2, 3)])
+
+    assert [f.result(timeout=1) for f in futures] == [1, 2, 3]
+    mock_db.insert_plant_detections.assert_called_once()
+    writer.stop(1)
@@ -0,0 +1,34 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import datetime
+import json
+from GardenOrchestrator import GardenOrchestrator
+
+
+def stream(*batches):
+    yield ['detection_id', 'plant_id', 'timestamp']
+    yield from batches
+
+
+def test_csv_export_yields_a_chunk_per_batch():
+    ts = datetime.datetime(2024, 5, 1, 10)
+    chunks = list(GardenOrchestrator.format_export(stream([(1, 3, ts)], [(2, 3, ts)]), "csv"))
+
+    assert chunks == ["detection_id,plant_id,timestamp\n1,3,2024-05-01T10:00:00\n", "2,3,2024-05-01T10:00:00\n"]
+
+
+def test_empty_csv_export_has_only_the_header():
+    assert list(GardenOrchestrator.format_export(stream(), "csv")) == ["detection_id,plant_id,timestamp\n"]
+
+
+def test_ndjson_export_writes_one_object_per_line():
+    ts = datetime.datetime(2024, 5, 1, 10)
+    chunks = list(GardenOrchestrator.format_export(stream([(1, 3, ts), (2, 4, ts)]), "ndjson"))
+
+    lines = "".join(chunks).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {'detection_id': 1, 'plant_id': 3, 'timestamp': "2024-05-01T10:00:00"},
+        {'detection_id': 2, 'plant_id': 4, 'timestamp': "2024-05-01T10:00:00"}
+    ]
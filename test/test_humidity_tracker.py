@@ -0,0 +1,91 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import datetime
+import pytest
+from unittest.mock import MagicMock
+from HumidityTracker import HumidityTracker
+
+NOW = datetime.datetime(2024, 6, 21, 22, 0)
+
+
+@pytest.fixture
+def tracker():
+    registry = MagicMock()
+    registry.get_plant.side_effect = lambda plant_id: {
+        'plant_id': plant_id, 'plant_name': f"Plant {plant_id}", 'default_watering': 150, 'plant_location': "Roma"
+    }
+    tracker = HumidityTracker(MagicMock(), registry, window_minutes=15)
+    tracker.started_at = NOW - datetime.timedelta(hours=1)
+    return tracker
+
+
+def test_summary_averages_the_window(tracker):
+    tracker.add_detection(1, 90, NOW - datetime.timedelta(minutes=20))
+    tracker.add_detection(1, 40, NOW - datetime.timedelta(minutes=10))
+    tracker.add_detection(1, 45, NOW - datetime.timedelta(minutes=5))
+    tracker.add_detection(2, 60, NOW - datetime.timedelta(minutes=30))
+
+    summary = tracker.summary(NOW)
+
+    assert len(summary) == 1
+    assert summary[0]['plant_id'] == 1
+    assert summary[0]['mean_value'] == 43
+    assert summary[0]['last_watering_req'] is None
+
+
+def test_out_of_order_detections_are_expired(tracker):
+    tracker.add_detection(1, 40, NOW - datetime.timedelta(minutes=5))
+    tracker.add_detection(1, 90, NOW - datetime.timedelta(minutes=20))
+    tracker.add_detection(1, 50, NOW - datetime.timedelta(minutes=14))
+    tracker.add_detection(1, 45, NOW - datetime.timedelta(minutes=10))
+
+    assert tracker.summary(NOW)[0]['mean_value'] == 45
+    assert tracker.summary(NOW + datetime.timedelta(minutes=2))[0]['mean_value'] == 43
+
+
+def test_watering_times_are_tracked(tracker):
+    tracker.seed_waterings([{'plant_id': 1, 'last_watering_req': NOW - datetime.timedelta(hours=5),
+                             'last_watering_successful': NOW - datetime.timedelta(hours=5)}])
+    tracker.add_detection(1, 40, NOW)
+    tracker.add_watering_request(1, 12, NOW - datetime.timedelta(minutes=30))
+
+    assert tracker.ack_watering(12)
+    assert not tracker.ack_watering(13)
+
+    summary = tracker.summary(NOW)[0]
+    assert summary['last_watering_req'] == datetime.timedelta(minutes=30)
+    assert summary['last_watering_successful'] == datetime.timedelta(minutes=30)
+
+
+def test_timed_out_watering_is_forgotten(tracker):
+    tracker.add_watering_request(1, 12, NOW - datetime.timedelta(minutes=30))
+
+    tracker.forget_watering(12)
+
+    assert not tracker.ack_watering(12)
+    # A late ack is resolved with the request read from the DB
+    assert tracker.ack_watering(12, 1, NOW - datetime.timedelta(minutes=30))
+
+
+def test_is_warm_after_a_whole_window(tracker):
+    tracker.started_at = NOW
+
+    assert not tracker.is_warm(NOW + datetime.timedelta(minutes=10))
+    assert tracker.is_warm(NOW + datetime.timedelta(minutes=15))
+
+
+def test_recent_waterings_update_the_db_summary(tracker):
+    tracker.add_watering_request(1, 12, NOW - datetime.timedelta(minutes=5))
+    tracker.ack_watering(12)
+    summary = [
+        {'plant_id': 1, 'last_watering_req': datetime.timedelta(hours=3), 'last_watering_successful': None},
+        {'plant_id': 2, 'last_watering_req': datetime.timedelta(hours=3), 'last_watering_successful': datetime.timedelta(hours=3)}
+    ]
+
+    tracker.merge_waterings(summary, NOW)
+
+    assert summary[0]['last_watering_req'] == datetime.timedelta(minutes=5)
+    assert summary[0]['last_watering_successful'] == datetime.timedelta(minutes=5)
+    assert summary[1]['last_watering_successful'] == datetime.timedelta(hours=3)
@@ -0,0 +1,52 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import datetime
+import pytest
+from unittest.mock import MagicMock
+from LatestState import LatestState
+
+
+@pytest.fixture
+def state():
+    registry = MagicMock()
+    registry.get_plants.return_value = [
+        {'plant_id': 1, 'plant_name': "Basil", 'nodemcu_id': 10, 'owner': "", 'plant_location': "Roma", 'plant_type': ""},
+        {'plant_id': 2, 'plant_name': "Mint", 'nodemcu_id': 10, 'owner': "", 'plant_location': "Roma", 'plant_type': ""}
+    ]
+    state = LatestState(MagicMock(), registry)
+    state.seed([{'plant_id': 1, 'plant_hum': 40, 'detection_ts': datetime.datetime(2024, 5, 1, 10),
+                 'water_quantity': 150, 'watering_ts': datetime.datetime(2024, 5, 1, 2)}])
+    return state
+
+
+def test_recap_merges_inventory_and_state(state):
+    recap = state.recap()
+
+    assert [row['plant_id'] for row in recap] == [1, 2]
+    assert recap[0]['plant_name'] == "Basil"
+    assert recap[0]['plant_hum'] == 40
+    assert recap[1]['plant_hum'] is None
+    assert recap[1]['watering_ts'] is None
+
+
+def test_updates_keep_latest_values(state):
+    state.update_detection(1, 55, datetime.datetime(2024, 5, 1, 11))
+    state.update_detection(1, 30, datetime.datetime(2024, 5, 1, 9))
+    state.update_watering(2, 200, datetime.datetime(2024, 5, 1, 12))
+
+    recap = state.recap()
+
+    assert recap[0]['plant_hum'] == 55
+    assert recap[0]['detection_ts'] == datetime.datetime(2024, 5, 1, 11)
+    assert recap[1]['water_quantity'] == 200
+
+
+def test_recap_columns_match_recap(state):
+    columns = state.recap_columns()
+    recap = state.recap()
+
+    assert columns['columns'] == list(recap[0].keys())
+    for column in columns['columns']:
+        assert columns['data'][column] == [row[column] for row in recap]
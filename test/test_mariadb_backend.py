@@ -0,0 +1,53 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import threading
+import pytest
+from unittest.mock import MagicMock, patch
+
+pytest.importorskip("mariadb")
+from MariaDBBackend import MariaDBBackend
+from ConnectionPool import PoolTimeoutError
+
+
+@pytest.fixture
+def backend():
+    with patch("MariaDBBackend.mariadb.connect", side_effect=lambda **kwargs: MagicMock()):
+        backend = MariaDBBackend({'pool_min_size': 1, 'pool_max_size': 1, 'pool_acquire_timeout': 0.05}, MagicMock())
+    yield backend
+    backend.close()
+
+
+def test_migrations_run_on_the_connection_holding_the_schema_lock(backend):
+    with backend.read_connection() as con:
+        con.cursor.return_value.fetchone.return_value = (1,)
+
+    with backend.schema_lock():
+        with backend.write_connection() as write_con, backend.read_connection() as read_con:
+            assert write_con is con
+            assert read_con is con
+
+    with backend.write_connection() as released:
+        assert released is con
+    assert backend.pool.stats()['in_use'] == 0
+
+
+def test_other_threads_wait_for_the_schema_lock_connection(backend):
+    with backend.read_connection() as con:
+        con.cursor.return_value.fetchone.return_value = (1,)
+    errors = []
+
+    def borrow():
+        try:
+            with backend.read_connection():
+                pass
+        except PoolTimeoutError as e:
+            errors.append(e)
+
+    with backend.schema_lock():
+        other = threading.Thread(target=borrow)
+        other.start()
+        other.join()
+
+    assert len(errors) == 1
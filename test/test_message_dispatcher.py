@@ -0,0 +1,59 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from unittest.mock import MagicMock
+from MessageDispatcher import MessageDispatcher
+
+
+def test_workers_handle_queued_messages():
+    handler = MagicMock()
+    dispatcher = MessageDispatcher(MagicMock(), handler, workers=2, queue_size=10)
+    dispatcher.start()
+
+    for i in range(5):
+        dispatcher.submit(f"d2_50_{i}", "sensor/1")
+    dispatcher.queue.join()
+    dispatcher.stop(1)
+
+    assert handler.call_count == 5
+    stats = dispatcher.stats()
+    assert stats['handled'] == 5
+    assert stats['queue_depth'] == 0
+
+
+def test_drop_newest_rejects_incoming_message():
+    dispatcher = MessageDispatcher(MagicMock(), MagicMock(), queue_size=1, overload_policy="drop_newest")
+
+    assert dispatcher.submit("first", "sensor/1") is True
+    assert dispatcher.submit("second", "sensor/1") is False
+
+    assert dispatcher.queue.get_nowait()[1] == "first"
+    assert dispatcher.stats()['dropped'] == 1
+
+
+def test_drop_oldest_makes_room_for_incoming_message():
+    dispatcher = MessageDispatcher(MagicMock(), MagicMock(), queue_size=1, overload_policy="drop_oldest")
+
+    dispatcher.submit("first", "sensor/1")
+    assert dispatcher.submit("second", "sensor/1") is True
+
+    assert dispatcher.queue.get_nowait()[1] == "second"
+    assert dispatcher.stats()['dropped'] == 1
+
+
+def test_handler_errors_are_counted():
+    dispatcher = MessageDispatcher(MagicMock(), MagicMock(side_effect=ValueError()), workers=1)
+    dispatcher.start()
+
+    dispatcher.submit("bad", "sensor/1")
+    dispatcher.queue.join()
+    dispatcher.stop(1)
+
+    assert dispatcher.stats()['failed'] == 1
+
+
+def test_unknown_policy_is_refused():
+    with pytest.raises(ValueError):
+        MessageDispatcher(MagicMock(), MagicMock(), overload_policy="random")
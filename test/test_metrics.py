@@ -0,0 +1,65 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from unittest.mock import MagicMock
+from Metrics import Metrics
+from MessageHandler import MessageHandler, MESSAGES_PARSED, MESSAGES_REJECTED, MESSAGES_RECEIVED
+
+
+def test_counter_is_rendered_per_label():
+    registry = Metrics()
+    counter = registry.counter("messages_total", "Messages", ("method",))
+    counter.inc("d2")
+    counter.inc("d2")
+    counter.inc("w", amount=3)
+
+    text = registry.render()
+
+    assert "# TYPE messages_total counter" in text
+    assert 'messages_total{method="d2"} 2' in text
+    assert 'messages_total{method="w"} 3' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Metrics()
+    histogram = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1))
+    histogram.observe(0.05, "/status")
+    histogram.observe(0.5, "/status")
+    histogram.observe(5, "/status")
+
+    text = registry.render()
+
+    assert 'latency_seconds_bucket{route="/status",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{route="/status",le="1"} 2' in text
+    assert 'latency_seconds_bucket{route="/status",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{route="/status"} 3' in text
+    assert 'latency_seconds_sum{route="/status"} 5.55' in text
+
+
+def test_gauge_is_read_on_render_and_failures_are_skipped():
+    registry = Metrics()
+    registry.gauge("queue_depth", "Depth", lambda: 7)
+    registry.gauge("broken", "Broken", lambda: 1 / 0)
+
+    text = registry.render()
+
+    assert "queue_depth 7" in text
+    assert "# TYPE broken gauge" in text
+
+
+def test_registering_twice_returns_the_same_counter():
+    registry = Metrics()
+
+    assert registry.counter("a_total", "A") is registry.counter("a_total", "A")
+
+
+def test_message_handler_counts_per_method():
+    parsed, rejected, received = MESSAGES_PARSED.value("w"), MESSAGES_REJECTED.value("unknown"), MESSAGES_RECEIVED.value("w")
+
+    MessageHandler(MagicMock(), "w_12", "sensor/3", MagicMock()).run()
+    MessageHandler(MagicMock(), "x_12", "sensor/3", MagicMock()).run()
+
+    assert MESSAGES_PARSED.value("w") == parsed + 1
+    assert MESSAGES_RECEIVED.value("w") == received + 1
+    assert MESSAGES_REJECTED.value("unknown") == rejected + 1
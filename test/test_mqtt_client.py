@@ -4,7 +4,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 import pytest
 from unittest.mock import MagicMock, patch
-from socket import gaierror
+from MessageHandler import RegistrationRequired
 from MqttClient import MqttClient
 
 @pytest.fixture
@@ -54,48 +54,58 @@ def test_new_subscription_calls_client(mqtt_instance):
     mqtt_instance.client.subscribe.assert_called_with(topic)
 
 
-def test_send_message_success(mqtt_instance, mock_mqtt_client):
-    result = mqtt_instance.send_message("my/topic", "hello")
+def test_on_message_queues_message(mqtt_instance):
+    mock_message = MagicMock()
+    mock_message.payload.decode.return_value = "payload"
+    mock_message.topic = "test/topic"
+    mqtt_instance.dispatcher = MagicMock()
 
-    mock_mqtt_client.connect.assert_called_with(
-        "localhost", 1883, 60
-    )
-    mock_mqtt_client.publish.assert_called_with("my/topic", "hello")
-    mock_mqtt_client.disconnect.assert_called_once()
-    assert result is True
+    mqtt_instance.on_message(None, None, mock_message)
 
+    mqtt_instance.logging.info.assert_called_with("Received message")
+    mqtt_instance.dispatcher.submit.assert_called_with("payload", "test/topic")
 
-def test_send_message_connection_refused(mqtt_instance, mock_mqtt_client):
-    mock_mqtt_client.connect.side_effect = ConnectionRefusedError()
 
-    result = mqtt_instance.send_message("my/topic", "hello")
+def test_handle_message_runs_handler(mqtt_instance):
+    with patch("MqttClient.MessageHandler") as mock_handler:
+        instance = mock_handler.return_value
 
-    assert result is False
-    mqtt_instance.logging.warning.assert_called()
-    mock_mqtt_client.disconnect.assert_not_called()
+        mqtt_instance.handle_message("payload", "test/topic")
 
+        mock_handler.assert_called_with(
+            mqtt_instance.logging, "payload", "test/topic", mqtt_instance.go, register_unknown=True
+        )
+        instance.run.assert_called_once()
 
-def test_send_message_host_not_found(mqtt_instance, mock_mqtt_client):
-    mock_mqtt_client.connect.side_effect = gaierror()
+def test_on_connect_with_shared_group_subscribes_wildcards(mqtt_instance):
+    client = MagicMock()
+    mqtt_instance.shared_group = "garden"
 
-    result = mqtt_instance.send_message("my/topic", "hello")
+    mqtt_instance.on_connect(client, None, None, 0)
 
-    assert result is False
-    mqtt_instance.logging.error.assert_called_with("Host: [localhost] not found")
+    subscribed = [call.args[0] for call in client.subscribe.call_args_list]
+    assert subscribed == ["$share/garden/greeting", "$share/garden/sensor/+", "garden/registry"]
+    mqtt_instance.go.get_all_sensor_id.assert_not_called()
 
 
-def test_on_message_triggers_handler(mqtt_instance):
-    mock_message = MagicMock()
-    mock_message.payload.decode.return_value = "payload"
-    mock_message.topic = "test/topic"
+def test_coordinator_receives_every_sensor_message(mock_mqtt_client):
+    config = {"host": "localhost", "port": 1883, "keepalive": 60, "shared_group": "garden", "role": "coordinator"}
+    coordinator = MqttClient(config, MagicMock(), MagicMock())
+    client = MagicMock()
+
+    coordinator.on_connect(client, None, None, 0)
+
+    subscribed = [call.args[0] for call in client.subscribe.call_args_list]
+    assert subscribed == ["greeting", "sensor/+", "garden/registry"]
+
+
+def test_coordinator_leaves_unknown_plants_to_the_workers(mock_mqtt_client):
+    config = {"host": "localhost", "port": 1883, "keepalive": 60, "shared_group": "garden", "role": "coordinator"}
+    coordinator = MqttClient(config, MagicMock(), MagicMock())
 
     with patch("MqttClient.MessageHandler") as mock_handler:
-        instance = mock_handler.return_value
+        mock_handler.return_value.run.side_effect = RegistrationRequired()
 
-        mqtt_instance.on_message(None, None, mock_message)
+        coordinator.handle_message("d2_55_3", "sensor/7")
 
-        mqtt_instance.logging.info.assert_called_with("Received message")
-        mock_handler.assert_called_with(
-            mqtt_instance.logging, "payload", "test/topic", mqtt_instance.go
-        )
-        instance.start.assert_called_once()
\ No newline at end of file
+    assert mock_handler.call_args.kwargs == {'register_unknown': False}
@@ -0,0 +1,84 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import threading
+import pytest
+import paho.mqtt.client as mqtt
+from unittest.mock import MagicMock, patch
+from MqttPublisher import MqttPublisher
+
+
+@pytest.fixture
+def mock_mqtt_client():
+    with patch("MqttPublisher.mqtt.Client") as mock_client_class:
+        mock_client = MagicMock()
+        mock_client_class.return_value = mock_client
+        yield mock_client
+
+
+@pytest.fixture
+def publisher(mock_mqtt_client):
+    config = {"host": "localhost", "port": 1883, "keepalive": 60}
+    return MqttPublisher(config, MagicMock())
+
+
+def publish_result(rc, mid=1):
+    return MagicMock(rc=rc, mid=mid)
+
+
+def test_start_opens_persistent_session(publisher, mock_mqtt_client):
+    publisher.start()
+
+    mock_mqtt_client.connect_async.assert_called_with("localhost", 1883, 60)
+    mock_mqtt_client.loop_start.assert_called_once()
+
+
+def test_send_message_does_not_reconnect(publisher, mock_mqtt_client):
+    mock_mqtt_client.publish.return_value = publish_result(mqtt.MQTT_ERR_SUCCESS)
+
+    assert publisher.send_message("my/topic", "hello") is True
+    assert publisher.send_message("my/topic", "hello") is True
+
+    mock_mqtt_client.publish.assert_called_with("my/topic", "hello", qos=1)
+    mock_mqtt_client.connect.assert_not_called()
+    mock_mqtt_client.disconnect.assert_not_called()
+
+
+def test_puback_clears_inflight_message(publisher, mock_mqtt_client):
+    mock_mqtt_client.publish.return_value = publish_result(mqtt.MQTT_ERR_SUCCESS, mid=7)
+    publisher.send_message("my/topic", "hello")
+    assert publisher.inflight() == 1
+
+    publisher.on_publish(None, None, 7)
+
+    assert publisher.inflight() == 0
+
+
+def test_send_message_waits_for_puback(publisher, mock_mqtt_client):
+    mock_mqtt_client.publish.return_value = publish_result(mqtt.MQTT_ERR_SUCCESS, mid=3)
+    threading.Timer(0.05, publisher.on_publish, (None, None, 3)).start()
+
+    assert publisher.send_message("my/topic", "hello", wait_for_ack=1) is True
+
+
+def test_send_message_ack_timeout(publisher, mock_mqtt_client):
+    mock_mqtt_client.publish.return_value = publish_result(mqtt.MQTT_ERR_SUCCESS)
+
+    assert publisher.send_message("my/topic", "hello", wait_for_ack=0.01) is False
+    publisher.logging.warning.assert_called()
+
+
+def test_send_message_queued_while_disconnected(publisher, mock_mqtt_client):
+    mock_mqtt_client.publish.return_value = publish_result(mqtt.MQTT_ERR_NO_CONN)
+
+    assert publisher.send_message("my/topic", "hello") is True
+    assert publisher.inflight() == 1
+
+
+def test_send_message_failure(publisher, mock_mqtt_client):
+    publisher.qos = 0
+    mock_mqtt_client.publish.return_value = publish_result(mqtt.MQTT_ERR_NO_CONN)
+
+    assert publisher.send_message("my/topic", "hello") is False
+    publisher.logging.warning.assert_called()
@@ -0,0 +1,63 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from unittest.mock import MagicMock
+from PlantRegistry import PlantRegistry
+
+
+def plant(plant_id, sensor_id, plant_num):
+    return {'plant_id': plant_id, 'plant_name': f"Plant {plant_id}", 'plant_num': plant_num, 'nodemcu_id': sensor_id,
+            'owner': "", 'plant_location': "Roma", 'plant_type': "", 'default_watering': 150}
+
+
+@pytest.fixture
+def registry():
+    db = MagicMock()
+    db.get_plant_inventory.return_value = [plant(1, 10, 1), plant(2, 10, 2), plant(3, 20, 1), plant(4, None, None)]
+    registry = PlantRegistry(MagicMock(), db)
+    registry.load()
+    return registry
+
+
+def test_lookups_are_served_from_memory(registry):
+    assert registry.get_plant_id(10, 2) == 2
+    assert registry.get_plant_id(30, 1) is None
+    assert registry.get_reference(3) == (20, 1)
+    assert registry.get_reference(99) == (None, None)
+    assert registry.get_sensor_ids() == [10, 20]
+    assert registry.known_plant(4)
+    registry.db.get_plant_inventory.assert_called_once()
+
+
+def test_add_registers_new_plant(registry):
+    registry.add(plant(5, 30, 1))
+
+    assert registry.get_plant_id(30, 1) == 5
+    assert registry.get_sensor_ids() == [10, 20, 30]
+    assert [p['plant_id'] for p in registry.get_plants()] == [1, 2, 3, 4, 5]
+
+
+def test_add_moves_plant_to_new_reference(registry):
+    registry.add(plant(1, 20, 2))
+
+    assert registry.get_plant_id(10, 1) is None
+    assert registry.get_plant_id(20, 2) == 1
+
+
+def test_sensor_without_plants_is_dropped(registry):
+    registry.add(plant(3, 30, 1))
+    assert registry.get_sensor_ids() == [10, 30]
+
+    # Plant 2 is still on sensor 10
+    registry.add(plant(1, 30, 2))
+    assert registry.get_sensor_ids() == [10, 30]
+
+
+def test_load_replaces_inventory(registry):
+    registry.db.get_plant_inventory.return_value = [plant(1, 10, 1)]
+
+    assert registry.load() == 1
+    assert registry.get_plant_id(20, 1) is None
+    assert registry.get_sensor_ids() == [10]
@@ -0,0 +1,72 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import datetime
+import threading
+import pytest
+from unittest.mock import MagicMock
+from Scheduler import Scheduler
+
+NOW = datetime.datetime(2024, 6, 21, 12, 0)
+
+
+@pytest.fixture
+def scheduler():
+    go = MagicMock()
+    go.next_watering_time.return_value = None
+    scheduler = Scheduler(MagicMock(), 15, go, max_idle=60)
+    scheduler._heap.clear()
+    yield scheduler
+    scheduler.stop()
+
+
+def test_daily_deadline():
+    next_run = Scheduler.daily("03:30")
+
+    assert next_run(NOW) == datetime.datetime(2024, 6, 22, 3, 30)
+    assert next_run(datetime.datetime(2024, 6, 21, 1, 0)) == datetime.datetime(2024, 6, 21, 3, 30)
+
+
+def test_evaluation_follows_recurrence_inside_watering_window(scheduler):
+    scheduler.go.next_watering_time.return_value = NOW
+
+    assert scheduler.next_evaluation(NOW) == NOW + datetime.timedelta(minutes=15)
+
+
+def test_evaluation_is_stretched_while_windows_are_closed(scheduler):
+    scheduler.go.next_watering_time.return_value = NOW + datetime.timedelta(minutes=40)
+    assert scheduler.next_evaluation(NOW) == NOW + datetime.timedelta(minutes=40)
+
+    scheduler.go.next_watering_time.return_value = NOW + datetime.timedelta(hours=8)
+    assert scheduler.next_evaluation(NOW) == NOW + datetime.timedelta(minutes=60)
+
+
+def test_jobs_are_single_flight(scheduler):
+    release = threading.Event()
+    started = []
+
+    def slow_job():
+        started.append(datetime.datetime.now())
+        release.wait(1)
+
+    scheduler.add_job(slow_job, lambda now: now + datetime.timedelta(seconds=0.05), datetime.datetime.now())
+    scheduler.start()
+    threading.Event().wait(0.2)
+
+    # The job is due again after 50ms, but it is planned only when the running one ends
+    assert len(started) == 1
+    assert scheduler._heap == []
+    release.set()
+    threading.Event().wait(0.2)
+    assert len(started) > 1
+
+
+def test_failed_job_is_rescheduled(scheduler):
+    def failing_job():
+        raise RuntimeError("DB down")
+
+    scheduler.run_job(failing_job, Scheduler.every(15), NOW)
+
+    assert scheduler._heap[0][2] is failing_job
+    scheduler.logging.error.assert_called_once()
@@ -0,0 +1,123 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import threading
+import pytest
+from unittest.mock import MagicMock, patch
+from DataVersion import DataVersion
+from GardenOrchestrator import GardenOrchestrator
+from MessageHandler import MessageHandler
+from PlantRegistry import PlantRegistry
+import main
+
+
+class IntegrityError(Exception):
+    pass
+
+
+@pytest.fixture
+def go():
+    db = MagicMock()
+    db.backend.Error = IntegrityError
+    db.get_plant_inventory.return_value = []
+    db.get_plant.side_effect = lambda plant_id: {'plant_id': plant_id, 'nodemcu_id': 7, 'plant_num': 3, 'plant_location': ""}
+    go = GardenOrchestrator.__new__(GardenOrchestrator)
+    go.logging = MagicMock()
+    go.db = db
+    go.registry = PlantRegistry(go.logging, db)
+    go.registration_lock = threading.RLock()
+    go.status_version = DataVersion()
+    go.history_version = DataVersion()
+    go.latest_state = MagicMock()
+    go.humidity_tracker = MagicMock()
+    go.detection_writer = MagicMock()
+    go.shared_group = "garden"
+    go.role = "ingestion"
+    go.registry_topic = "garden/registry"
+    go.mqttBroker = MagicMock()
+    go.mqttc = MagicMock()
+    return go
+
+
+def test_registered_plant_is_announced_to_the_group(go):
+    go.db.insert_new_plant.return_value = 12
+
+    assert go.get_plant_id(7, 3) == 12
+
+    go.mqttBroker.send_message.assert_called_once_with("garden/registry", "r_12")
+    assert go.registry.get_plant_id(7, 3) == 12
+
+
+def test_plant_registered_by_another_worker_is_loaded(go):
+    go.db.insert_new_plant.side_effect = IntegrityError("Duplicate entry")
+    go.db.get_plant_id.return_value = 12
+
+    assert go.get_plant_id(7, 3) == 12
+
+    go.mqttBroker.send_message.assert_not_called()
+    assert go.registry.get_plant_id(7, 3) == 12
+
+
+def test_registry_event_syncs_the_plant(go):
+    MessageHandler(MagicMock(), "r_12", "garden/registry", go).run()
+
+    assert go.registry.get_plant_id(7, 3) == 12
+
+
+def test_registry_event_from_a_sensor_is_rejected(go):
+    MessageHandler(MagicMock(), "r_12", "sensor/7", go).run()
+
+    go.db.get_plant.assert_not_called()
+
+
+def test_new_sensor_is_covered_by_the_wildcard(go):
+    go.add_sensor(8)
+
+    go.mqttc.new_subscription.assert_not_called()
+
+
+def test_ingestion_worker_writes_its_detections(go):
+    go.add_detection(12, 55, 7)
+    go.add_detections(7, [(12, 55, None), (13, 60, None)])
+
+    go.detection_writer.submit.assert_called_once()
+    go.detection_writer.submit_many.assert_called_once()
+
+
+def test_coordinator_observes_detections_without_writing_them(go):
+    go.role = "coordinator"
+    version = go.history_version.validators()[0]
+
+    assert go.add_detection(12, 55, 7).result() is None
+    assert [future.result() for future in go.add_detections(7, [(12, 55, None), (13, 60, None)])] == [None, None]
+
+    go.detection_writer.submit.assert_not_called()
+    go.detection_writer.submit_many.assert_not_called()
+    assert go.humidity_tracker.add_detection.call_count == 3
+    assert go.history_version.validators()[0] != version
+
+
+def test_ingestion_worker_runs_no_scheduler_nor_api():
+    go = MagicMock(role="ingestion")
+
+    with patch("main.GardenOrchestrator", return_value=go), patch("main.serve") as serve, \
+            patch("main.threading.Event") as event, patch("main.signal.signal"):
+        main.main()
+
+    event.return_value.wait.assert_called_once()
+    go.setScheduler.assert_not_called()
+    serve.assert_not_called()
+    go.shutdown.assert_called_once()
+
+
+def test_coordinator_runs_the_scheduler_and_the_api():
+    go = MagicMock(role="coordinator")
+
+    with patch("main.GardenOrchestrator", return_value=go), patch("main.serve") as serve:
+        main.main()
+
+    go.setScheduler.return_value.start.assert_called_once()
+    serve.assert_called_once()
+    go.setScheduler.return_value.stop.assert_called_once()
+    go.shutdown.assert_called_once()
@@ -0,0 +1,167 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import datetime
+import pytest
+from unittest.mock import MagicMock
+from CircuitBreaker import CircuitBreaker
+from Spool import Spool
+
+NOW = datetime.datetime(2024, 5, 1, 12, 30, 15, 250)
+
+
+@pytest.fixture
+def db():
+    db = MagicMock()
+    db.insert_plant_detections.side_effect = lambda rows: list(range(1, len(rows) + 1))
+    return db
+
+
+@pytest.fixture
+def spool(db, tmp_path):
+    breaker = CircuitBreaker(MagicMock(), "DB", failure_threshold=1, reset_timeout=0)
+    spool = Spool(MagicMock(), db, str(tmp_path / "spool.bin"), breaker, fsync_batch=2, replay_batch=2)
+    yield spool
+    spool.stop()
+
+
+def test_breaker_opens_and_probes():
+    breaker = CircuitBreaker(MagicMock(), "DB", failure_threshold=2, reset_timeout=60, latency_budget=1)
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_success(5)
+    assert not breaker.allow()
+
+    breaker.reset_timeout = 0
+    assert breaker.allow()
+    # A single probe at a time while half open
+    assert not breaker.allow()
+    breaker.record_success(0.1)
+    assert breaker.is_closed()
+
+
+def test_record_round_trip():
+    data = Spool.encode_detection(12, 55, None, NOW) + Spool.layouts[Spool.WATERING_ACK].pack(Spool.WATERING_ACK, 99)
+
+    kind, values, offset = Spool.decode(data, 0)
+    assert (kind, values) == (Spool.DETECTION, (12, 55, None, NOW))
+    assert Spool.decode(data, offset)[:2] == (Spool.WATERING_ACK, 99)
+    # A torn record at the end is not decoded
+    assert Spool.decode(data[:-1], offset) is None
+
+
+def test_writes_go_to_the_db_while_healthy(spool, db):
+    assert spool.insert_plant_detections([(1, 40, 7, NOW)]) == [1]
+    assert spool.backlog() == 0
+
+
+def test_failed_writes_are_spooled_and_replayed_oldest_first(spool, db):
+    db.insert_plant_detections.side_effect = RuntimeError("DB down")
+    db.ack_waterings.side_effect = RuntimeError("DB down")
+
+    assert spool.insert_plant_detections([(1, 40, 7, NOW), (2, 45, 7, NOW)]) == [None, None]
+    spool.insert_plant_detections([(3, 50, 8, NOW)])
+    spool.ack_waterings([99])
+    assert spool.backlog() > 0
+    assert spool.replay() == 0
+
+    db.insert_plant_detections.side_effect = lambda rows: list(range(1, len(rows) + 1))
+    db.ack_waterings.side_effect = None
+    db.ack_waterings.reset_mock()
+    assert spool.replay() == 4
+
+    batches = [call.args[0] for call in db.insert_plant_detections.call_args_list[-2:]]
+    assert batches == [[(1, 40, 7, NOW), (2, 45, 7, NOW)], [(3, 50, 8, NOW)]]
+    db.ack_waterings.assert_called_once_with([99])
+    assert spool.backlog() == 0
+    assert not os.path.exists(spool.replay_path)
+
+
+def test_interrupted_replay_resumes_from_the_last_batch(spool, db):
+    db.insert_plant_detections.side_effect = RuntimeError("DB down")
+    spool.insert_plant_detections([(plant, 40, 7, NOW) for plant in (1, 2, 3)])
+    written = []
+
+    def flaky_insert(rows):
+        if written:
+            raise RuntimeError("DB down again")
+        written.append(rows)
+        return [1] * len(rows)
+    db.insert_plant_detections.side_effect = flaky_insert
+    assert spool.replay() == 2
+
+    db.insert_plant_detections.side_effect = lambda rows: written.append(rows) or [1] * len(rows)
+    assert spool.replay() == 1
+    assert [row[0] for rows in written for row in rows] == [1, 2, 3]
+
+
+def test_unencodable_detections_do_not_fail_the_batch(spool, db):
+    db.insert_plant_detections.side_effect = RuntimeError("DB down")
+    assert spool.insert_plant_detections([(1, 40, 7, NOW), (2, 70000, 7, NOW), (3, 50, 7, NOW)]) == [None, None, None]
+
+    db.insert_plant_detections.side_effect = lambda rows: list(range(1, len(rows) + 1))
+    assert spool.replay() == 2
+    assert [row[0] for call in db.insert_plant_detections.call_args_list[-1:] for row in call.args[0]] == [1, 3]
+
+
+def test_rejected_records_are_dead_lettered(db, tmp_path):
+    breaker = CircuitBreaker(MagicMock(), "DB", failure_threshold=1, reset_timeout=60)
+    spool = Spool(MagicMock(), db, str(tmp_path / "spool.bin"), breaker, replay_batch=10, rejected_errors=(ValueError,))
+    db.insert_plant_detections.side_effect = RuntimeError("DB down")
+    spool.insert_plant_detections([(plant, 40, 7, NOW) for plant in (1, 2, 3)])
+    spool.ack_waterings([99])
+    breaker.reset_timeout = 0
+
+    written = []
+
+    def refuse_plant_2(rows):
+        if any(row[0] == 2 for row in rows):
+            raise ValueError("Foreign key constraint fails")
+        written.extend(rows)
+        return [1] * len(rows)
+    db.insert_plant_detections.side_effect = refuse_plant_2
+    db.ack_waterings.side_effect = None
+    assert spool.replay() == 3
+
+    assert [row[0] for row in written] == [1, 3]
+    db.ack_waterings.assert_called_with([99])
+    with open(spool.dead_letter_path, "rb") as f:
+        assert Spool.decode(f.read(), 0)[:2] == (Spool.DETECTION, (2, 40, 7, NOW))
+    # The DB answered, a refused record does not open the breaker
+    assert breaker.is_closed()
+    assert not os.path.exists(spool.replay_path)
+    spool.stop()
+
+
+def test_rejected_live_batch_is_spooled_without_opening_the_breaker(db, tmp_path):
+    breaker = CircuitBreaker(MagicMock(), "DB", failure_threshold=1, reset_timeout=60)
+    spool = Spool(MagicMock(), db, str(tmp_path / "spool.bin"), breaker, rejected_errors=(ValueError,))
+    db.insert_plant_detections.side_effect = ValueError("Out of range value")
+
+    assert spool.insert_plant_detections([(1, 40, 7, NOW)]) == [None]
+    assert spool.backlog() > 0
+    assert breaker.is_closed()
+    spool.stop()
+
+
+def test_torn_record_is_truncated_before_appending(db, tmp_path):
+    path = tmp_path / "spool.bin"
+    path.write_bytes(Spool.encode_detection(1, 40, 7, NOW) + Spool.encode_detection(2, 45, 7, NOW)[:5])
+    breaker = CircuitBreaker(MagicMock(), "DB", failure_threshold=1, reset_timeout=0)
+    spool = Spool(MagicMock(), db, str(path), breaker)
+    db.insert_plant_detections.side_effect = RuntimeError("DB down")
+    spool.insert_plant_detections([(3, 50, 7, NOW), (4, 55, 7, NOW)])
+
+    db.insert_plant_detections.side_effect = lambda rows: list(range(1, len(rows) + 1))
+    assert spool.replay() == 3
+    assert [row[0] for row in db.insert_plant_detections.call_args.args[0]] == [1, 3, 4]
+    spool.stop()
+
+
+def test_out_of_range_record_is_corrupt():
+    data = bytearray(Spool.encode_detection(1, 40, 7, NOW))
+    data[-8:] = (2 ** 63 - 1).to_bytes(8, "little")
+
+    assert Spool.decode(bytes(data), 0) is None
@@ -0,0 +1,37 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+from unittest.mock import MagicMock
+from WateringDispatcher import WateringDispatcher
+
+
+def test_lines_water_in_parallel_and_same_line_waits():
+    sent = []
+    dispatcher = WateringDispatcher(MagicMock(), lambda action: sent.append((action['line'], time.monotonic())), wait_watering=0.2)
+    actions = [{'line': 1}, {'line': 1}, {'line': 2}, {'line': 3}]
+    start = time.monotonic()
+
+    assert dispatcher.dispatch(actions, lambda action: action['line'], timeout=2)
+
+    elapsed = time.monotonic() - start
+    assert len(sent) == 4
+    # Only the second action of line 1 waits
+    assert 0.2 <= elapsed < 0.4
+    line_one = [ts for line, ts in sent if line == 1]
+    assert line_one[1] - line_one[0] >= 0.2
+
+
+def test_send_errors_do_not_block_the_line():
+    send = MagicMock(side_effect=[RuntimeError("broker down"), None])
+    dispatcher = WateringDispatcher(MagicMock(), send, wait_watering=0)
+
+    assert dispatcher.dispatch([{'line': 1}, {'line': 1}], lambda action: action['line'], timeout=1)
+    assert send.call_count == 2
+
+
+def test_dispatch_timeout():
+    dispatcher = WateringDispatcher(MagicMock(), lambda action: time.sleep(0.2), wait_watering=0)
+
+    assert dispatcher.dispatch([{'line': 1}], lambda action: action['line'], timeout=0.01) is False
@@ -0,0 +1,78 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import datetime
+import threading
+import pytest
+from unittest.mock import MagicMock
+from WateringTracker import WateringTracker
+
+NOW = datetime.datetime(2024, 6, 21, 23, 30)
+
+
+@pytest.fixture
+def store():
+    store = MagicMock()
+    written = threading.Event()
+    store.ack_waterings.side_effect = lambda ids: written.set()
+    store.written = written
+    return store
+
+
+@pytest.fixture
+def tracker(store):
+    tracker = WateringTracker(MagicMock(), store, ack_timeout=60, batch_size=3, max_latency=60)
+    tracker.start()
+    yield tracker
+    tracker.stop(1)
+
+
+def test_states_until_ack(tracker, store):
+    tracker.request(1, 10, 300, NOW)
+    assert tracker.state(1) == WateringTracker.REQUESTED
+    tracker.published(1)
+    assert tracker.state(1) == WateringTracker.PUBLISHED
+
+    request = tracker.ack(1)
+
+    assert request['plant_id'] == 10
+    assert request['requested_at'] == NOW
+    assert tracker.state(1) is None
+    assert tracker.pending() == 0
+
+
+def test_acks_are_written_in_batches(tracker, store):
+    for watering_id in (1, 2, 3):
+        tracker.request(watering_id, 10, 300, NOW)
+        tracker.ack(watering_id)
+
+    assert store.written.wait(1)
+    store.ack_waterings.assert_called_once_with([1, 2, 3])
+
+
+def test_stop_writes_pending_acks(tracker, store):
+    tracker.ack(7)
+
+    tracker.stop(1)
+
+    store.ack_waterings.assert_called_once_with([7])
+    tracker.ack(8)
+    store.ack_waterings.assert_called_with([8])
+
+
+def test_missing_ack_times_out(store):
+    timed_out = []
+    tracker = WateringTracker(MagicMock(), store, ack_timeout=0.05, on_timeout=timed_out.append)
+    tracker.start()
+    tracker.request(1, 10, 0, NOW)
+    tracker.request(2, 10, 60, NOW)
+
+    threading.Event().wait(0.3)
+
+    assert tracker.state(1) is None
+    assert tracker.state(2) == WateringTracker.REQUESTED
+    tracker.logging.warning.assert_called_once()
+    assert tracker.ack(1) is None
+    assert timed_out == [1]
+    tracker.stop(1)
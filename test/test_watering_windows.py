@@ -0,0 +1,55 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import datetime
+import pytest
+from unittest.mock import MagicMock, patch
+from WateringWindows import WateringWindows
+
+
+@pytest.fixture
+def windows():
+    return WateringWindows(MagicMock())
+
+
+def test_window_is_computed_once_per_day(windows):
+    day = datetime.date(2024, 6, 21)
+    with patch("WateringWindows.sun.sun", wraps=__import__("astral").sun.sun) as mock_sun:
+        first = windows.get("Roma", day)
+        second = windows.get("Roma", day)
+        windows.get("Roma", day + datetime.timedelta(days=1))
+
+    assert first == second
+    assert mock_sun.call_count == 2
+
+
+def test_failed_lookup_is_cached_as_negative_entry(windows):
+    day = datetime.date(2024, 6, 21)
+    with patch("WateringWindows.sun.sun", side_effect=ValueError("sun never sets")) as mock_sun:
+        assert windows.get("Svalbard", day) == (WateringWindows.default_sunset, WateringWindows.default_sunrise)
+        assert windows.get("Svalbard", day) == (WateringWindows.default_sunset, WateringWindows.default_sunrise)
+
+    mock_sun.assert_called_once()
+    windows.logging.warning.assert_called_once()
+
+
+def test_missing_location_uses_default_window(windows):
+    assert windows.is_watering_time(None, datetime.datetime(2024, 6, 21, 23, 30))
+    assert not windows.is_watering_time("", datetime.datetime(2024, 6, 21, 12, 0))
+
+
+def test_prefetch_computes_day_and_forgets_old_windows(windows):
+    windows.get("Roma", datetime.date(2024, 6, 18))
+
+    windows.prefetch(["Roma", "Milano", None], datetime.date(2024, 6, 22))
+
+    assert set(windows._windows) == {("Roma", datetime.date(2024, 6, 22)), ("Milano", datetime.date(2024, 6, 22))}
+
+
+def test_next_start(windows):
+    day = datetime.date(2024, 6, 21)
+
+    assert windows.next_start(None, datetime.datetime.combine(day, datetime.time(12, 0))) == datetime.datetime.combine(day, WateringWindows.default_sunset)
+    assert windows.next_start(None, datetime.datetime.combine(day, datetime.time(23, 30))) == datetime.datetime.combine(day, datetime.time(23, 30))
+    assert windows.next_start(None, datetime.datetime.combine(day, datetime.time(7, 30))) == datetime.datetime.combine(day, WateringWindows.default_sunset)